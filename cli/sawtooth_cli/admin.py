@@ -14,13 +14,21 @@
 # ------------------------------------------------------------------------------
 from sawtooth_cli.exceptions import CliException
 
+from sawtooth_cli.admin_command.compact import add_compact_parser
+from sawtooth_cli.admin_command.compact import do_compact
 from sawtooth_cli.admin_command.genesis import add_genesis_parser
 from sawtooth_cli.admin_command.genesis import do_genesis
+from sawtooth_cli.admin_command.snapshot import add_snapshot_parser
+from sawtooth_cli.admin_command.snapshot import do_snapshot
 
 
 def do_admin(args):
     if args.admin_cmd == 'genesis':
         do_genesis(args)
+    elif args.admin_cmd == 'snapshot':
+        do_snapshot(args)
+    elif args.admin_cmd == 'compact':
+        do_compact(args)
     else:
         raise CliException("invalid command: {}".format(args.command))
 
@@ -30,3 +38,5 @@ def add_admin_parser(subparsers, parent_parser):
     admin_sub = parser.add_subparsers(title='admin_commands', dest='admin_cmd')
 
     add_genesis_parser(admin_sub, parser)
+    add_snapshot_parser(admin_sub, parser)
+    add_compact_parser(admin_sub, parser)
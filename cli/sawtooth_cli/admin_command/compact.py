@@ -0,0 +1,69 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import os
+import time
+
+from sawtooth_cli.exceptions import CliException
+
+
+def add_compact_parser(subparsers, parent_parser):
+    """Creates the arg parser needed for the compact command.
+    """
+    parser = subparsers.add_parser('compact')
+    parser.add_argument(
+        '--database',
+        type=str,
+        required=True,
+        help='the database file of the validator')
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        help='the name of the file to write the compacted copy to, which '
+        'can be done while the validator runs; without it, the database '
+        'file is replaced with its compacted copy, which requires the '
+        'validator to be stopped')
+
+
+def do_compact(args):
+    """Writes a copy of a validator's database file without its free pages,
+    replacing the file unless an output file is given.
+    """
+    # The database files are handled by the validator's database modules,
+    # which are only available where a validator is installed.
+    try:
+        from sawtooth_validator.database.lmdb_nolock_database import \
+            compact_file
+        import lmdb
+    except ImportError:
+        raise CliException(
+            'The compact command requires the sawtooth validator package')
+
+    if not os.path.isfile(args.database):
+        raise CliException('No database at {}'.format(args.database))
+    if args.output is not None and os.path.exists(args.output):
+        raise CliException('{} already exists'.format(args.output))
+
+    print('Compacting {}'.format(args.database))
+    start = time.time()
+    try:
+        size, compacted_size = compact_file(args.database, args.output)
+    except (OSError, lmdb.Error) as e:
+        raise CliException('Unable to compact {}: {}'.format(
+            args.database, e))
+
+    print('Compacted {} bytes to {} bytes in {:.1f}s, reclaiming {} '
+          'bytes'.format(size, compacted_size, time.time() - start,
+                         size - compacted_size))
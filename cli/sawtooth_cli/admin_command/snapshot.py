@@ -0,0 +1,118 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import os
+import time
+
+from sawtooth_cli.exceptions import CliException
+
+
+def add_snapshot_parser(subparsers, parent_parser):
+    """Creates the arg parsers needed for the snapshot command.
+    """
+    parser = subparsers.add_parser('snapshot')
+    snapshot_sub = parser.add_subparsers(title='snapshot_commands',
+                                         dest='snapshot_cmd')
+
+    export_parser = snapshot_sub.add_parser('export')
+    export_parser.add_argument(
+        '--database',
+        type=str,
+        required=True,
+        help='the database file of the validator')
+    export_parser.add_argument(
+        '-o', '--output',
+        type=str,
+        required=True,
+        help='the name of the file to output the snapshot')
+    export_parser.add_argument(
+        'state_root',
+        type=str,
+        help='the state root to export the state of')
+
+    import_parser = snapshot_sub.add_parser('import')
+    import_parser.add_argument(
+        '--database',
+        type=str,
+        required=True,
+        help='the database file of the validator to load the snapshot into, '
+        'which is created if needed')
+    import_parser.add_argument(
+        '--state-root',
+        type=str,
+        help='the state root the snapshot is expected to have')
+    import_parser.add_argument(
+        'input_file',
+        type=str,
+        help='the snapshot file')
+
+
+def do_snapshot(args):
+    """Exports the state under a state root from a validator's state database
+    to a snapshot file, or loads a snapshot file into a state database.
+    """
+    # The snapshots are read and written by the validator's state modules,
+    # which are only available where a validator is installed.
+    try:
+        from sawtooth_validator.database.lmdb_nolock_database import \
+            LMDBEnvironment
+        from sawtooth_validator.database.lmdb_nolock_database import \
+            STATE_DATABASE
+        from sawtooth_validator.state import snapshot
+    except ImportError:
+        raise CliException(
+            'The snapshot commands require the sawtooth validator package')
+
+    if args.snapshot_cmd == 'export':
+        if not os.path.isfile(args.database):
+            raise CliException('No database at {}'.format(args.database))
+
+        print('Exporting state root {} to {}'.format(args.state_root,
+                                                     args.output))
+        start = time.time()
+        environment = LMDBEnvironment(args.database, 'r')
+        try:
+            database = environment.open_database(STATE_DATABASE, raw=True)
+            with open(args.output, 'wb') as out_file:
+                count = snapshot.export_snapshot(database, args.state_root,
+                                                 out_file)
+        except (ValueError, snapshot.SnapshotError) as e:
+            raise CliException('Unable to export {}: {}'.format(
+                args.state_root, e))
+        finally:
+            environment.close()
+        print('Exported {} nodes in {:.1f}s'.format(
+            count, time.time() - start))
+
+    elif args.snapshot_cmd == 'import':
+        print('Importing {} into {}'.format(args.input_file, args.database))
+        start = time.time()
+        environment = LMDBEnvironment(args.database, 'c')
+        try:
+            database = environment.open_database(STATE_DATABASE, raw=True)
+            with open(args.input_file, 'rb') as in_file:
+                state_root, count = snapshot.import_snapshot(
+                    database, in_file, state_root=args.state_root)
+        except (OSError, ValueError, snapshot.SnapshotError) as e:
+            raise CliException('Unable to import {}: {}'.format(
+                args.input_file, e))
+        finally:
+            environment.close()
+
+        print('Imported {} nodes in {:.1f}s, state root {}'.format(
+            count, time.time() - start, state_root))
+
+    else:
+        raise CliException('invalid command: {}'.format(args.snapshot_cmd))
@@ -55,6 +55,8 @@ def start_rest_api(host, port, stream_url):
     app.router.add_get('/state', handler.state_current)
     app.router.add_get('/state/{merkle_root}', handler.state_list)
     app.router.add_get('/state/{merkle_root}/{address}', handler.state_get)
+    app.router.add_get('/state/{merkle_root}/{address}/proof',
+                       handler.state_proof)
 
     app.router.add_get('/blocks', handler.block_list)
     app.router.add_get('/blocks/{block_id}', handler.block_get)
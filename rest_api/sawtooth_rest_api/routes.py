@@ -78,8 +78,21 @@ class RouteHandler(object):
         root = RouteHandler._safe_get(request.match_info, 'merkle_root')
         # if no prefix is defined return all
         prefix = RouteHandler._safe_get(request.rel_url.query, 'prefix')
+        # paging: start from an address, the `next` of the previous page
+        start = RouteHandler._safe_get(request.rel_url.query, 'start')
+        limit = RouteHandler._safe_get(request.rel_url.query, 'limit', '0')
+        try:
+            limit = int(limit)
+            if limit < 0:
+                raise ValueError()
+        except ValueError:
+            raise web.HTTPBadRequest(
+                reason='Expected limit to be a non-negative integer')
+
         client_request = client.ClientStateListRequest(merkle_root=root,
-                                                       prefix=prefix)
+                                                       prefix=prefix,
+                                                       start=start,
+                                                       limit=limit)
         return self._generic_get(
             web_request=request,
             msg_type=Message.CLIENT_STATE_LIST_REQUEST,
@@ -116,6 +129,20 @@ class RouteHandler(object):
             parsed_response
         )
 
+    @asyncio.coroutine
+    def state_proof(self, request):
+        # CLIENT_STATE_PROOF_REQUEST
+        root = RouteHandler._safe_get(request.match_info, 'merkle_root')
+        addr = RouteHandler._safe_get(request.match_info, 'address')
+
+        return self._generic_get(
+            web_request=request,
+            msg_type=Message.CLIENT_STATE_PROOF_REQUEST,
+            msg_content=client.ClientStateProofRequest(merkle_root=root,
+                                                       address=addr),
+            resp_proto=client.ClientStateProofResponse,
+        )
+
     @asyncio.coroutine
     def block_list(self, request):
         """
@@ -0,0 +1,149 @@
+# Copyright 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Verification of the Merkle proofs returned by the validator for a state
+address (see the CLIENT_STATE_PROOF_REQUEST message).
+
+A proof is the list of the encoded trie nodes on the path from a state root
+to an address, the root first. A node is identified by the first 64 hex
+characters of the SHA-512 of its encoding, and lists the hashes of its
+children, so a proof only needs to be trusted as far as the state root it
+is checked against, typically the state_root_hash of a block header.
+"""
+
+import hashlib
+
+import cbor
+
+_COMPACT_VERSION = 0x01
+_FLAG_DENSE = 0x01
+_FLAG_VALUE = 0x02
+_FLAG_LABELS = 0x04
+
+_TOKEN_SIZE = 2
+
+
+def verify_proof(state_root, address, value, proof):
+    """Checks a proof of the value of an address under a state root.
+
+    Args:
+        state_root (str): the trusted state root
+        address (str): the address
+        value (bytes): the expected value of the address, or None to check
+            that the address has no value
+        proof (list of bytes): the encoded nodes from the root to the address
+
+    Returns:
+        bool: True if the proof shows that the address has the value under
+            the state root
+    """
+    if not proof:
+        return False
+
+    expected_hash = state_root
+    rest = address
+    for i, packed in enumerate(proof):
+        packed = bytes(packed)
+        if hashlib.sha512(packed).hexdigest()[:64] != expected_hash:
+            return False
+        try:
+            node_value, children = _decode_node(packed)
+        except (ValueError, IndexError, KeyError, TypeError):
+            return False
+
+        last = i == len(proof) - 1
+        if not rest:
+            # the node of the address; it must end the proof
+            if not last:
+                return False
+            if node_value is None:
+                return value is None
+            return value is not None and cbor.loads(node_value) == value
+
+        label = _child_label(children, rest)
+        if last:
+            # the path stops before the address: it has no value
+            return value is None and (
+                label is None or not rest.startswith(label))
+        if label is None or not rest.startswith(label):
+            return False
+        expected_hash = children[label]
+        rest = rest[len(label):]
+
+    return False
+
+
+def _child_label(children, path):
+    token = path[:_TOKEN_SIZE]
+    if token in children:
+        return token
+    for label in children:
+        if label.startswith(token):
+            return label
+    return None
+
+
+def _decode_node(packed):
+    """Decodes a node in either of the node formats of the validator,
+    returning its encoded value (or None) and its children, as a dict of
+    edge label to child hash.
+    """
+    if packed[0] != _COMPACT_VERSION:
+        node = cbor.loads(packed)
+        return node['v'], node['c']
+
+    flags = packed[1]
+    if flags & _FLAG_LABELS:
+        count, pos = _decode_varint(packed, 2)
+        labels = []
+        for _ in range(count):
+            length = packed[pos]
+            labels.append(packed[pos + 1:pos + 1 + length].hex())
+            pos += 1 + length
+    elif flags & _FLAG_DENSE:
+        labels = ['{:02x}'.format(i) for i in range(256)
+                  if packed[2 + (i >> 3)] & (0x80 >> (i & 0x07))]
+        pos = 34
+    else:
+        count = packed[2]
+        labels = [packed[3 + i:4 + i].hex() for i in range(count)]
+        pos = 3 + count
+
+    children = {}
+    for label in labels:
+        child_hash = packed[pos:pos + 32]
+        if len(child_hash) != 32:
+            raise ValueError('truncated node')
+        children[label] = child_hash.hex()
+        pos += 32
+
+    value = None
+    if flags & _FLAG_VALUE:
+        length, pos = _decode_varint(packed, pos)
+        value = packed[pos:pos + length]
+        if len(value) != length:
+            raise ValueError('truncated node')
+    return value, children
+
+
+def _decode_varint(packed, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = packed[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
@@ -13,7 +13,14 @@
 # limitations under the License.
 # ------------------------------------------------------------------------------
 from collections import OrderedDict
-from threading import RLock
+from contextlib import contextmanager
+import sys
+from threading import Lock
+
+# 32MB of cached values
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+# the number of independently locked shares of a cache
+DEFAULT_CACHE_STRIPES = 16
 
 
 class Database(object):
@@ -49,6 +56,38 @@ class Database(object):
         """
         raise NotImplementedError()
 
+    def get_batch(self, keys):
+        """Retrieves the values associated with several keys from the
+        database. Implementations should read all the keys at once, for
+        example within a single read transaction.
+
+        Args:
+            keys (list): The keys to retrieve
+
+        Returns:
+            list: (key, value) tuples, for the keys found in the database
+        """
+        result = []
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                result.append((key, value))
+        return result
+
+    @contextmanager
+    def read_txn(self):
+        """Opens a scope for several reads, which implementations may run
+        within a single read transaction, so that they all see the same
+        snapshot of the database. Values read within the scope may be
+        buffers which are only valid until the scope ends.
+
+        Yields:
+            a reader with the read methods of the database: get(),
+            get_batch(), read_txn() and in. It can be used as the database
+            of a MerkleDatabase, to run a whole query on the snapshot.
+        """
+        yield self
+
     def set(self, key, value):
         """Sets a value associated with a key in the database
 
@@ -58,6 +97,17 @@ class Database(object):
         """
         raise NotImplementedError()
 
+    def set_batch(self, kvpairs):
+        """Sets several key:value pairs in the database. Implementations
+        should write all the pairs at once, for example within a single
+        write transaction.
+
+        Args:
+            kvpairs (list): (key, value) tuples to set
+        """
+        for key, value in kvpairs:
+            self.set(key, value)
+
     def delete(self, key):
         """Removes a key:value from the database
 
@@ -66,6 +116,17 @@ class Database(object):
         """
         raise NotImplementedError()
 
+    def delete_batch(self, keys):
+        """Removes several keys from the database. Implementations should
+        remove all the keys at once, for example within a single write
+        transaction.
+
+        Args:
+            keys (list): The keys to remove
+        """
+        for key in keys:
+            self.delete(key)
+
     def sync(self):
         """Ensures that pending writes are flushed to disk
         """
@@ -82,76 +143,289 @@ class Database(object):
         raise NotImplementedError()
 
 
-class CachedDatabase(object):
-    """
-    Takes Database subclasses as argument to constructor
-    and implements a caching mechanism
-    Attributes:
-        _database: instance of subclass
-        _cache: dict
-        _rlock: Threading.Rlock
-    """
+class CachedDatabase(Database):
+    """Wraps a database with a size-bounded LRU cache of its values.
 
-    def __init__(self, database, cache_limit=1000):
+    Reads go through the cache: a miss reads the wrapped database and
+    caches the value. Writes are written through and cached, and deletes
+    remove the cached values. The cache is split into stripes, each with
+    its own lock, LRU order and share of the byte budget, so concurrent
+    readers of different keys seldom wait on each other.
 
-        self._database = database
-        self._cache = OrderedDict()
-        self._rlock = RLock()
-        self._cachelimit = cache_limit
+    Values read from buffers of the wrapped database are copied before they
+    are cached. A value read while it is being deleted is not cached, so a
+    deleted key never reappears from the cache.
 
-    def __getitem__(self, item):
-        with self._rlock:
-            if item in self._cache:
-                return self._cache[item]
-            return self._database[item]
+    Attributes:
+        _database (Database): the wrapped database
+        _stripes (list): the _CacheStripe of each share of the keys
+    """
 
-    def __setitem__(self, key, value):
-        with self._rlock:
-            self._database[key] = value
-            self._cache[key] = value
+    def __init__(self, database, max_bytes=DEFAULT_CACHE_BYTES,
+                 stripes=DEFAULT_CACHE_STRIPES):
+        """Constructor for the CachedDatabase class.
 
-            if len(self._cache) > self._cachelimit:
-                self._cache.popitem(last=False)
+        Args:
+            database (Database): the database to cache the values of
+            max_bytes (int): the budget, in bytes, of the cached values
+            stripes (int): the number of independently locked stripes
+        """
+        super(CachedDatabase, self).__init__()
+        self._database = database
+        self._stripes = [_CacheStripe(max_bytes // stripes)
+                         for _ in range(stripes)]
 
-    def __delitem__(self, key):
-        with self._rlock:
-            if key in self._cache:
-                del self._cache[key]
-            del self._database[key]
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
 
     def __len__(self):
-        with self._rlock:
-            return len(self._database)
+        return len(self._database)
 
-    def __contains__(self, item):
-        with self._rlock:
-            return item in self._cache or item in self._database
+    def __contains__(self, key):
+        return self._stripe(key).peek(key) or key in self._database
 
     def get(self, key):
-        with self._rlock:
-            if key in self._cache:
-                return self._cache[key]
-            return self._database.get(key)
+        stripe = self._stripe(key)
+        value, generation = stripe.get(key)
+        if value is not None:
+            return value
+        value = self._database.get(key)
+        if value is not None:
+            value = stripe.put(key, value, generation)
+        return value
+
+    def get_batch(self, keys):
+        result = []
+        missing = []
+        for key in keys:
+            value, generation = self._stripe(key).get(key)
+            if value is not None:
+                result.append((key, value))
+            else:
+                missing.append((key, generation))
+
+        if missing:
+            generations = dict(missing)
+            for key, value in self._database.get_batch(list(generations)):
+                result.append((key, self._stripe(key).put(
+                    key, value, generations[key])))
+        return result
+
+    @contextmanager
+    def read_txn(self):
+        with self._database.read_txn() as txn:
+            yield _CachedReader(self, txn)
 
     def set(self, key, value):
-        with self._rlock:
-            self._cache[key] = value
-            self._database.set(key, value)
+        self._database.set(key, value)
+        self._stripe(key).put(key, value)
+
+    def set_batch(self, kvpairs):
+        kvpairs = list(kvpairs)
+        self._database.set_batch(kvpairs)
+        for key, value in kvpairs:
+            self._stripe(key).put(key, value)
 
     def delete(self, key):
-        with self._rlock:
-            if key in self._cache:
-                del self._cache[key]
-            self._database.delete(key)
+        self._database.delete(key)
+        self._stripe(key).invalidate(key)
+
+    def delete_batch(self, keys):
+        keys = list(keys)
+        self._database.delete_batch(keys)
+        for key in keys:
+            self._stripe(key).invalidate(key)
 
     def sync(self):
-        with self._rlock:
-            self._database.sync()
+        self._database.sync()
 
     def close(self):
-        with self._rlock:
-            self._database.close()
+        self._database.close()
 
     def keys(self):
-        with self._rlock:
-            return self._database.keys()
+        return self._database.keys()
+
+    def clear(self):
+        """Removes all the values from the cache. The counters are kept.
+        """
+        for stripe in self._stripes:
+            stripe.clear()
+
+    @property
+    def size_bytes(self):
+        return sum(stripe.size_bytes for stripe in self._stripes)
+
+    @property
+    def hits(self):
+        return sum(stripe.hits for stripe in self._stripes)
+
+    @property
+    def misses(self):
+        return sum(stripe.misses for stripe in self._stripes)
+
+    @property
+    def evictions(self):
+        return sum(stripe.evictions for stripe in self._stripes)
+
+    @property
+    def hit_ratio(self):
+        """The share of the reads served by the cache, or 0.0 before any
+        read.
+        """
+        hits = self.hits
+        reads = hits + self.misses
+        return hits / reads if reads else 0.0
+
+    @property
+    def metrics(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hit_ratio,
+            'size_bytes': self.size_bytes,
+            'entries': sum(len(stripe) for stripe in self._stripes)
+        }
+
+
+class _CachedReader(object):
+    """The reader of CachedDatabase.read_txn(), which reads the values which
+    are not cached within the read transaction of the wrapped database.
+    """
+    def __init__(self, cached_database, txn):
+        self._cached_database = cached_database
+        self._txn = txn
+
+    @contextmanager
+    def read_txn(self):
+        yield self
+
+    def __contains__(self, key):
+        # pylint: disable=protected-access
+        return self._cached_database._stripe(key).peek(key) or \
+            key in self._txn
+
+    def get_batch(self, keys):
+        result = []
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                result.append((key, value))
+        return result
+
+    def get(self, key):
+        # pylint: disable=protected-access
+        stripe = self._cached_database._stripe(key)
+        value, generation = stripe.get(key)
+        if value is not None:
+            return value
+        value = self._txn.get(key)
+        if value is not None:
+            value = stripe.put(key, value, generation)
+        return value
+
+
+class _CacheStripe(object):
+    """A share of the values of a CachedDatabase, in LRU order.
+
+    The generation counts the deletes of the stripe, which invalidate keys
+    once they are deleted from the wrapped database. A value read from the
+    wrapped database is only cached if no key of the stripe was invalidated
+    since the read began, as the value may be that of a deleted key.
+
+    Attributes:
+        _lock (threading.Lock): guards the entries and the counters
+        _entries (OrderedDict): key to (value, size), the least recently
+            used entry first
+    """
+    __slots__ = ['_lock', '_entries', '_max_bytes', '_size_bytes',
+                 '_generation', 'hits', 'misses', 'evictions']
+
+    def __init__(self, max_bytes):
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._max_bytes = max_bytes
+        self._size_bytes = 0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def peek(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        """Returns the cached value of a key, marking it as the most
+        recently used, or None and the generation to pass to put() once
+        the value is read.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, self._generation
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], None
+
+    def put(self, key, value, generation=None):
+        """Caches the value of a key, evicting the least recently used
+        values to stay within the byte budget.
+
+        Args:
+            key (str): the key
+            value: the value, which is copied if it is a buffer
+            generation (int): for a value read from the wrapped database,
+                the generation returned by get() before the read
+
+        Returns:
+            the value, as cached
+        """
+        if isinstance(value, memoryview):
+            value = bytes(value)
+        size = _value_size(value)
+        if size > self._max_bytes:
+            return value
+
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return value
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size_bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._size_bytes += size
+
+            while self._size_bytes > self._max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size_bytes -= evicted_size
+                self.evictions += 1
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size_bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._size_bytes = 0
+
+    @property
+    def size_bytes(self):
+        return self._size_bytes
+
+
+def _value_size(value):
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return sys.getsizeof(value)
@@ -28,6 +28,9 @@ class DictDatabase(database.Database):
     def get(self, key):
         return self._data.get(key)
 
+    def get_batch(self, keys):
+        return [(k, self._data[k]) for k in keys if k in self._data]
+
     def __contains__(self, item):
         return item in self._data
 
@@ -42,13 +45,17 @@ class DictDatabase(database.Database):
         pass
 
     def delete(self, key):
-        pass
+        self._data.pop(key, None)
+
+    def delete_batch(self, keys):
+        for key in keys:
+            self._data.pop(key, None)
 
     def __len__(self):
-        pass
+        return len(self._data)
 
     def keys(self):
-        pass
+        return list(self._data)
 
     def sync(self):
         pass
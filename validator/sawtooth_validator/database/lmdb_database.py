@@ -69,7 +69,7 @@ class LMDBDatabase(database.Database):
     def __contains__(self, key):
         with self._lock:
             with self._lmdb.begin() as txn:
-                return bool(txn.get(key) is not None)
+                return bool(txn.get(key.encode()) is not None)
 
     def get(self, key):
         """Retrieves a value associated with a key from the database
@@ -79,7 +79,7 @@ class LMDBDatabase(database.Database):
         """
         with self._lock:
             with self._lmdb.begin() as txn:
-                pickled = txn.get(key)
+                pickled = txn.get(key.encode())
                 if pickled is not None:
                     return pickle.loads(pickled)
 
@@ -93,7 +93,19 @@ class LMDBDatabase(database.Database):
         pickled = pickle.dumps(value)
         with self._lock:
             with self._lmdb.begin(write=True, buffers=True) as txn:
-                txn.put(key, pickled, overwrite=True)
+                txn.put(key.encode(), pickled, overwrite=True)
+
+    def set_batch(self, kvpairs):
+        """Sets several key:value pairs in the database, within a single
+        write transaction
+
+        Args:
+            kvpairs (list): (key, value) tuples to set
+        """
+        with self._lock:
+            with self._lmdb.begin(write=True, buffers=True) as txn:
+                for key, value in kvpairs:
+                    txn.put(key.encode(), pickle.dumps(value), overwrite=True)
 
     def delete(self, key):
         """Removes a key:value from the database
@@ -103,7 +115,7 @@ class LMDBDatabase(database.Database):
         """
         with self._lock:
             with self._lmdb.begin(write=True, buffers=True) as txn:
-                txn.delete(key)
+                txn.delete(key.encode())
 
     def sync(self):
         """Ensures that pending writes are flushed to disk
@@ -122,4 +134,4 @@ class LMDBDatabase(database.Database):
         """
         with self._lock:
             with self._lmdb.begin() as txn:
-                return [key for key, _ in txn.cursor()]
+                return [key.decode() for key, _ in txn.cursor()]
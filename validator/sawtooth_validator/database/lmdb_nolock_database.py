@@ -13,31 +13,95 @@
 # limitations under the License.
 # ------------------------------------------------------------------------------
 
+import logging
 import os
+from threading import Condition
+from threading import Event
+from threading import Lock
+from threading import Thread
+from threading import local
+import time
+
 import lmdb
 import cbor
 
 from sawtooth_validator.database import database
 
+LOGGER = logging.getLogger(__name__)
 
-class LMDBNoLockDatabase(database.Database):
-    """LMDBNoLockDatabase is an implementation of the
-    sawtooth_validator.database.Database interface which uses LMDB for the
-    underlying persistence.
+# The key recording that the values of a database are stored raw. Its value
+# is _RAW_DONE once every value is raw, or _RAW_MIGRATING followed by the
+# first key still to migrate while existing values are being converted.
+# Database keys are encoded strings, so they never start with a NUL byte.
+_RAW_KEY = b'\x00sawtooth.raw'
+_RAW_DONE = b'done'
+_RAW_MIGRATING = b'from:'
+
+# the number of values converted per write transaction by a migration
+MIGRATION_CHUNK_SIZE = 10000
+
+# Durability policies: when committed writes are flushed to disk.
+# every write returns once flushed
+DURABILITY_WRITE = 'write'
+# writes are flushed every sync_interval seconds, on a background thread
+DURABILITY_INTERVAL = 'interval'
+# writes are only flushed by sync(), or by a write_txn(), typically when a
+# block is committed
+DURABILITY_BLOCK = 'block'
+
+DURABILITY_POLICIES = [DURABILITY_WRITE, DURABILITY_INTERVAL, DURABILITY_BLOCK]
+
+DEFAULT_SYNC_INTERVAL = 0.1
+
+# the number of named databases an environment can hold
+DEFAULT_MAX_DBS = 8
+
+# the named databases of the validator's database file
+STATE_DATABASE = 'state'
+BLOCK_DATABASE = 'blocks'
+CHAIN_DATABASE = 'chain'
+
+
+class LMDBEnvironment(object):
+    """An LMDB file holding several named databases, which share its group
+    commits and durability policy, and which can be written together
+    atomically with write_txn().
+
+    Writes are group committed: the writes of concurrent callers are queued,
+    and the first caller to find no commit in progress writes everything
+    queued in one write transaction, while the others wait for it. The
+    durability policy then decides whether the commit is flushed to disk
+    before the callers return; writes queued during a flush are committed
+    together once it completes.
 
     Attributes:
-       _lmdb (lmdb.Environment): The underlying lmdb database.
+       _lmdb (lmdb.Environment): The underlying lmdb environment.
+       _write_cond (threading.Condition): guards _pending and _committing.
+       _pending (list): the queued _WriteRequests.
+       _committing (bool): whether a caller is committing queued writes.
     """
 
-    def __init__(self, filename, flag):
-        """Constructor for the LMDBNoLockDatabase class.
-
+    def __init__(self, filename, flag, max_dbs=DEFAULT_MAX_DBS,
+                 durability=DURABILITY_WRITE,
+                 sync_interval=DEFAULT_SYNC_INTERVAL):
+        """
         Args:
             filename (str): The filename of the database file.
             flag (str): a flag indicating the mode for opening the database.
-                Refer to the documentation for anydbm.open().
+                Refer to the documentation for anydbm.open(). A file opened
+                with 'r' is read-only.
+            max_dbs (int): the number of named databases the file can hold,
+                or 0 for a file with a single, unnamed, database
+            durability (str): one of DURABILITY_POLICIES
+            sync_interval (float): the number of seconds between flushes
+                with DURABILITY_INTERVAL
+
+        Raises:
+            ValueError: if the durability policy is unknown
         """
-        super(LMDBNoLockDatabase, self).__init__()
+        if durability not in DURABILITY_POLICIES:
+            raise ValueError("unknown durability policy {}".format(
+                durability))
 
         create = bool(flag == 'c')
 
@@ -46,21 +110,414 @@ class LMDBNoLockDatabase(database.Database):
                 os.remove(filename)
             create = True
 
+        self._filename = filename
+        self._readonly = flag == 'r'
         self._lmdb = lmdb.Environment(path=filename,
                                       map_size=1024**4,
                                       map_async=True,
                                       writemap=True,
                                       subdir=False,
                                       create=create,
-                                      lock=True)
+                                      lock=True,
+                                      max_dbs=max_dbs,
+                                      readonly=self._readonly,
+                                      # commits are flushed by sync(),
+                                      # according to the durability policy
+                                      sync=False)
+        self._durability = durability
+
+        self._write_cond = Condition()
+        self._pending = []
+        self._committing = False
+
+        self._metrics_lock = Lock()
+        self._commits = 0
+        self._committed_writes = 0
+        self._max_batch_size = 0
+        self._syncs = 0
+        self._sync_time = 0.0
+        self._max_sync_time = 0.0
+
+        self._dirty = False
+        self._sync_thread = None
+        self._stop_event = Event()
+        if durability == DURABILITY_INTERVAL:
+            self._sync_thread = Thread(target=self._sync_periodically,
+                                       args=(sync_interval,),
+                                       name='LMDBSync')
+            self._sync_thread.daemon = True
+            self._sync_thread.start()
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def lmdb(self):
+        return self._lmdb
+
+    @property
+    def readonly(self):
+        return self._readonly
+
+    def open_database(self, name, raw=False):
+        """Opens a named database of the file, creating it if needed. The
+        database is closed with the environment.
+
+        Args:
+            name (str): the name of the database
+            raw (bool): whether values are stored raw rather than CBOR
+                encoded
+
+        Returns:
+            LMDBNoLockDatabase: the database
+        """
+        return LMDBNoLockDatabase(raw=raw, environment=self, name=name)
+
+    def write_txn(self):
+        """Starts a write transaction over several databases of the file.
+        The writes are committed together, in a single LMDB transaction,
+        and flushed to disk whatever the durability policy, when the
+        transaction is used as a context manager which exits without
+        error; they are not visible to reads before then.
+
+        Returns:
+            a transaction with set(database, key, value) and
+            delete(database, key) methods
+        """
+        return _LMDBWriteTxn(self)
+
+    def write(self, puts=(), deletes=(), sync=False):
+        """Queues writes, and commits the queued writes unless another
+        caller is already committing, in which case it waits for them to be
+        committed.
+
+        Args:
+            puts (list): (database handle, key, value) tuples, with the key
+                and value as bytes
+            deletes (list): (database handle, key) tuples
+            sync (bool): whether to flush the commit whatever the
+                durability policy
+        """
+        request = _WriteRequest(puts, deletes, sync)
+        with self._write_cond:
+            self._pending.append(request)
+            while self._committing and not request.done:
+                self._write_cond.wait()
+            if request.done:
+                if request.error is not None:
+                    raise request.error
+                return
+            self._committing = True
+            batch = self._pending
+            self._pending = []
+
+        error = None
+        try:
+            self._commit(batch)
+            if self._durability == DURABILITY_WRITE or \
+                    any(queued.sync for queued in batch):
+                self.sync()
+            else:
+                self._dirty = True
+        # the error is raised in each caller whose writes were in the batch
+        # pylint: disable=broad-except
+        except Exception as exc:
+            error = exc
+
+        with self._write_cond:
+            for queued in batch:
+                queued.done = True
+                queued.error = error
+            self._committing = False
+            self._write_cond.notify_all()
+
+        if error is not None:
+            raise error
+
+    def _commit(self, batch):
+        with self._lmdb.begin(write=True, buffers=True) as txn:
+            for request in batch:
+                for db, key, packed in request.puts:
+                    txn.put(key, packed, overwrite=True, db=db)
+                for db, key in request.deletes:
+                    txn.delete(key, db=db)
+
+        with self._metrics_lock:
+            self._commits += 1
+            self._committed_writes += len(batch)
+            self._max_batch_size = max(self._max_batch_size, len(batch))
+
+    def sync(self):
+        """Ensures that pending writes are flushed to disk
+        """
+        self._dirty = False
+        start = time.time()
+        self._lmdb.sync(True)
+        duration = time.time() - start
+
+        with self._metrics_lock:
+            self._syncs += 1
+            self._sync_time += duration
+            self._max_sync_time = max(self._max_sync_time, duration)
+
+    def _sync_periodically(self, interval):
+        while not self._stop_event.wait(interval):
+            if self._dirty:
+                try:
+                    self.sync()
+                except lmdb.Error as exc:
+                    LOGGER.exception(exc)
+
+    @property
+    def metrics(self):
+        """The write metrics of the file: the number of commits and of
+        writes committed, their mean and largest batch size, and the number
+        of flushes to disk with their mean and largest latency in seconds.
+        """
+        with self._metrics_lock:
+            return {
+                'commits': self._commits,
+                'committed_writes': self._committed_writes,
+                'mean_batch_size':
+                    self._committed_writes / max(1, self._commits),
+                'max_batch_size': self._max_batch_size,
+                'syncs': self._syncs,
+                'mean_sync_latency': self._sync_time / max(1, self._syncs),
+                'max_sync_latency': self._max_sync_time,
+            }
+
+    def copy(self, path, compact=True):
+        """Writes a copy of the file, as of a read transaction, so reads and
+        writes go on while it is written; later writes are not copied.
+
+        Args:
+            path (str): the file of the copy, which must not exist
+            compact (bool): whether to leave the free pages out of the copy,
+                and renumber the pages in use
+        """
+        self._lmdb.copy(path, compact=compact)
+
+    def close(self):
+        """Flushes pending writes and closes the file
+        """
+        self._stop_event.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join()
+        if not self._readonly:
+            self.sync()
+        self._lmdb.close()
+
+
+def file_size(filename):
+    """Returns the disk space used by a file. LMDB files are sparse files
+    as large as their map size, so their apparent size says nothing of the
+    space they use.
+    """
+    return os.stat(filename).st_blocks * 512
+
+
+def compact_file(filename, output=None):
+    """Writes a compacted copy of an LMDB file, without its free pages.
+    LMDB files never shrink: the pages freed by deletes are reused, but not
+    returned to the file system.
+
+    The copy is a snapshot of the file, so it can be written while another
+    process, such as a validator, uses the file. Replacing the file with
+    its copy requires that no other process has the file open, since its
+    writes after the snapshot would be lost.
+
+    Args:
+        filename (str): the LMDB file
+        output (str): the file of the copy, or None to replace the file
+            with its copy. The replacement is atomic: the file is either
+            the original or the complete copy.
+
+    Returns:
+        tuple: the disk space, in bytes, used by the file and by the copy
+    """
+    size = file_size(filename)
+    target = output
+    if target is None:
+        target = filename + '.compact'
+    if os.path.exists(target):
+        os.remove(target)
+
+    environment = LMDBEnvironment(filename, 'r')
+    try:
+        environment.copy(target, compact=True)
+    finally:
+        environment.close()
+
+    if output is None:
+        # the copy is flushed before it replaces the file, and the rename
+        # is flushed with the directory
+        fd = os.open(target, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(target, filename)
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    return size, file_size(output if output is not None else filename)
+
+
+class LMDBNoLockDatabase(database.Database):
+    """LMDBNoLockDatabase is an implementation of the
+    sawtooth_validator.database.Database interface which uses LMDB for the
+    underlying persistence.
+
+    The database is either the only database of its own file, or one of the
+    named databases of an LMDBEnvironment (see open_database()), in which
+    case its writes are group committed with those of the other databases
+    of the file.
+
+    By default, values are CBOR encoded when written and decoded when read.
+    In raw mode, values must be bytes, and are stored and returned as they
+    are, which saves encoding values which already are encoded, such as the
+    nodes of the Merkle trie. Raw databases are marked as such, and an
+    existing database opened in raw mode is migrated in place, a chunk of
+    values per write transaction, so an interrupted migration resumes where
+    it stopped the next time the database is opened.
+
+    Attributes:
+       _environment (LMDBEnvironment): The file of the database.
+       _lmdb (lmdb.Environment): The underlying lmdb environment.
+       _db (lmdb._Database): The handle of the database in the file.
+       _raw (bool): Whether values are stored raw.
+    """
+
+    def __init__(self, filename=None, flag=None, raw=False,
+                 durability=DURABILITY_WRITE,
+                 sync_interval=DEFAULT_SYNC_INTERVAL,
+                 environment=None, name=None):
+        """Constructor for the LMDBNoLockDatabase class. The database is
+        either the only database of the file filename, or the named database
+        name of an environment, typically opened with
+        LMDBEnvironment.open_database().
+
+        Args:
+            filename (str): The filename of the database file.
+            flag (str): a flag indicating the mode for opening the database.
+                Refer to the documentation for anydbm.open(). A database
+                opened with 'r' is read-only.
+            raw (bool): whether values are stored raw rather than CBOR
+                encoded.
+            durability (str): one of DURABILITY_POLICIES
+            sync_interval (float): the number of seconds between flushes
+                with DURABILITY_INTERVAL
+            environment (LMDBEnvironment): the environment holding the
+                database, instead of filename, flag, durability and
+                sync_interval
+            name (str): the name of the database in the environment
+
+        Raises:
+            ValueError: if a raw database is opened without raw mode, a
+                read-only database needs migrating to raw values, or the
+                durability policy is unknown
+        """
+        super(LMDBNoLockDatabase, self).__init__()
+
+        self._owns_environment = environment is None
+        if environment is None:
+            environment = LMDBEnvironment(filename, flag, max_dbs=0,
+                                          durability=durability,
+                                          sync_interval=sync_interval)
+        self._environment = environment
+        self._lmdb = environment.lmdb
+        self._name = name
+        try:
+            self._db = self._lmdb.open_db(
+                name.encode() if name is not None else None,
+                create=not environment.readonly)
+        except lmdb.NotFoundError:
+            raise ValueError("{} has no database {}".format(
+                environment.filename, name))
+        self._raw = raw
+        # the reader of each thread, see read_txn()
+        self._readers = local()
+
+        with self._lmdb.begin() as txn:
+            marker = txn.get(_RAW_KEY, db=self._db)
+            empty = txn.stat(self._db)['entries'] == 0
+
+        error = None
+        if not raw:
+            if marker is not None:
+                error = "stores raw values, and must be opened in raw mode"
+        elif marker == _RAW_DONE or (empty and environment.readonly):
+            pass
+        elif environment.readonly:
+            error = "must be migrated to raw values, which requires it " \
+                "to be writable"
+        elif empty:
+            with self._lmdb.begin(write=True) as txn:
+                txn.put(_RAW_KEY, _RAW_DONE, db=self._db)
+        else:
+            self._migrate_to_raw(marker)
+
+        if error is not None:
+            self.close()
+            raise ValueError("{} {}".format(self._describe(), error))
+
+    def _describe(self):
+        if self._name is None:
+            return self._environment.filename
+        return '{}:{}'.format(self._environment.filename, self._name)
+
+    def _migrate_to_raw(self, marker):
+        """Decodes the values stored CBOR encoded, starting after the last
+        migrated chunk if a migration was interrupted.
+        """
+        start = b''
+        if marker is not None:
+            start = marker[len(_RAW_MIGRATING):]
+        LOGGER.info("Migrating %s to raw values", self._describe())
+
+        migrated = 0
+        while True:
+            with self._lmdb.begin(write=True) as txn:
+                cursor = txn.cursor(db=self._db)
+                found = cursor.set_range(start)
+                count = 0
+                while found and count < MIGRATION_CHUNK_SIZE:
+                    key, packed = cursor.item()
+                    if key != _RAW_KEY:
+                        cursor.put(key, cbor.loads(packed))
+                        count += 1
+                    found = cursor.next()
+
+                if found:
+                    start = cursor.key()
+                    txn.put(_RAW_KEY, _RAW_MIGRATING + start, db=self._db)
+                else:
+                    txn.put(_RAW_KEY, _RAW_DONE, db=self._db)
+            migrated += count
+            if not found:
+                break
+
+        self.sync()
+        LOGGER.info("Migrated %s values of %s", migrated, self._describe())
+
+    @property
+    def environment(self):
+        return self._environment
 
     def __len__(self):
         with self._lmdb.begin() as txn:
-            return txn.stat()['entries']
+            entries = txn.stat(self._db)['entries']
+            if self._raw and txn.get(_RAW_KEY, db=self._db) is not None:
+                entries -= 1
+            return entries
 
     def __contains__(self, key):
         with self._lmdb.begin() as txn:
-            return bool(txn.get(key.encode()) is not None)
+            return bool(txn.get(key.encode(), db=self._db) is not None)
 
     def get(self, key):
         """Retrieves a value associated with a key from the database
@@ -69,19 +526,51 @@ class LMDBNoLockDatabase(database.Database):
             key (str): The key to retrieve
         """
         with self._lmdb.begin() as txn:
-            packed = txn.get(key.encode())
-            if packed is not None:
+            packed = txn.get(key.encode(), db=self._db)
+            if packed is not None and not self._raw:
                 return cbor.loads(packed)
+            return packed
 
     def get_batch(self, keys):
+        """Retrieves the values associated with several keys, within a
+        single read transaction.
+
+        Args:
+            keys (list): The keys to retrieve
+
+        Returns:
+            list: (key, value) tuples, for the keys found in the database
+        """
         with self._lmdb.begin() as txn:
             result = []
             for key in keys:
-                packed = txn.get(key.encode())
+                packed = txn.get(key.encode(), db=self._db)
                 if packed is not None:
-                    result.append((key, cbor.loads(packed)))
+                    if not self._raw:
+                        packed = cbor.loads(packed)
+                    result.append((key, packed))
         return result
 
+    def read_txn(self):
+        """Opens a read transaction, to be used as a context manager. In raw
+        mode, the values it returns are memoryviews of the database map,
+        which are only valid until the transaction ends, and must be copied
+        to be kept.
+
+        Each thread has a single reader, and read transactions opened on a
+        thread while one is open share its transaction.
+
+        Returns:
+            a reader with the read methods of the database (get,
+            get_batch, read_txn and in), which read the snapshot of the
+            database taken when the transaction began
+        """
+        reader = getattr(self._readers, 'reader', None)
+        if reader is None:
+            reader = _LMDBReader(self._lmdb, self._db, self._raw)
+            self._readers.reader = reader
+        return reader
+
     def set(self, key, value):
         """Sets a value associated with a key in the database
 
@@ -89,17 +578,21 @@ class LMDBNoLockDatabase(database.Database):
             key (str): The key to set.
             value (str): The value to associate with the key.
         """
-        packed = cbor.dumps(value)
-        with self._lmdb.begin(write=True, buffers=True) as txn:
-            txn.put(key.encode(), packed, overwrite=True)
-        self.sync()
+        self.set_batch([(key, value)])
 
     def set_batch(self, kvpairs):
-        with self._lmdb.begin(write=True, buffers=True) as txn:
-            for k, v in kvpairs:
-                packed = cbor.dumps(v)
-                txn.put(k.encode(), packed, overwrite=True)
-        self.sync()
+        """Sets several key:value pairs, committed within a single write
+        transaction, possibly with the writes of other callers.
+
+        Args:
+            kvpairs (list): (key, value) tuples
+        """
+        self._environment.write(puts=[self._put(k, v) for k, v in kvpairs])
+
+    def _put(self, key, value):
+        if self._raw:
+            return (self._db, key.encode(), value)
+        return (self._db, key.encode(), cbor.dumps(value))
 
     def delete(self, key):
         """Removes a key:value from the database
@@ -107,21 +600,124 @@ class LMDBNoLockDatabase(database.Database):
         Args:
             key (str): The key to remove.
         """
-        with self._lmdb.begin(write=True, buffers=True) as txn:
-            txn.delete(key.encode())
+        self.delete_batch([key])
+
+    def delete_batch(self, keys):
+        """Removes several keys from the database, within a single write
+        transaction.
+
+        Args:
+            keys (list): The keys to remove
+        """
+        self._environment.write(
+            deletes=[self._delete(key) for key in keys])
+
+    def _delete(self, key):
+        return (self._db, key.encode())
 
     def sync(self):
         """Ensures that pending writes are flushed to disk
         """
-        self._lmdb.sync()
+        self._environment.sync()
+
+    @property
+    def metrics(self):
+        """The write metrics of the file of the database (see
+        LMDBEnvironment.metrics).
+        """
+        return self._environment.metrics
 
     def close(self):
-        """Closes the connection to the database
+        """Closes the connection to the database. The database of an
+        environment shared with other databases only releases the
+        environment, which is closed with LMDBEnvironment.close().
         """
-        self._lmdb.close()
+        if self._owns_environment:
+            self._environment.close()
+        self._lmdb = None
 
     def keys(self):
         """Returns a list of keys in the database
         """
         with self._lmdb.begin() as txn:
-            return [key.decode() for key, _ in txn.cursor()]
+            return [key.decode()
+                    for key in txn.cursor(db=self._db).iternext(values=False)
+                    if key != _RAW_KEY]
+
+
+class _LMDBWriteTxn(object):
+    # pylint: disable=protected-access
+    def __init__(self, environment):
+        self._environment = environment
+        self._puts = []
+        self._deletes = []
+
+    def set(self, database_, key, value):
+        self._puts.append(database_._put(key, value))
+
+    def delete(self, database_, key):
+        self._deletes.append(database_._delete(key))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._environment.write(self._puts, self._deletes, sync=True)
+
+
+class _WriteRequest(object):
+    __slots__ = ['puts', 'deletes', 'sync', 'done', 'error']
+
+    def __init__(self, puts, deletes, sync):
+        self.puts = puts
+        self.deletes = deletes
+        self.sync = sync
+        self.done = False
+        self.error = None
+
+
+class _LMDBReader(object):
+    """The reader of a database's read transactions on a thread. Entering
+    it again while it is open, for example from the reads of a
+    MerkleDatabase built on it, reuses the open transaction, so all the
+    reads of a query see the same snapshot of the database.
+    """
+    def __init__(self, lmdb_env, db, raw):
+        self._lmdb = lmdb_env
+        self._db = db
+        self._raw = raw
+        self._txn = None
+        self._depth = 0
+
+    def __enter__(self):
+        if self._depth == 0:
+            self._txn = self._lmdb.begin(db=self._db, buffers=self._raw)
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if self._depth == 0:
+            self._txn.abort()
+            self._txn = None
+
+    def read_txn(self):
+        return self
+
+    def __contains__(self, key):
+        return self._txn.get(key.encode()) is not None
+
+    def get(self, key):
+        packed = self._txn.get(key.encode())
+        if packed is not None and not self._raw:
+            return cbor.loads(packed)
+        return packed
+
+    def get_batch(self, keys):
+        result = []
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                result.append((key, value))
+        return result
@@ -12,20 +12,35 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ------------------------------------------------------------------------------
-import hashlib
+from collections import OrderedDict
+import itertools
 import logging
+import os
 import time
 
+from threading import Event
 from threading import Thread
 from threading import Lock
-from threading import Condition
+from queue import Empty
 from queue import Queue
 
 from sawtooth_validator.state.merkle import MerkleDatabase
+from sawtooth_validator.state.node_codec import CBOR_NODE_FORMAT
+from sawtooth_validator.state.overlay import StateOverlay
 
 
 LOGGER = logging.getLogger(__name__)
 
+# 16MB of state values read or written by contexts
+DEFAULT_VALUE_CACHE_BYTES = 16 * 1024 * 1024
+# the number of threads reading the inputs of the contexts
+DEFAULT_READER_THREADS = 4
+# the largest number of contexts whose inputs a reader thread reads at once
+DEFAULT_READ_BATCH_SIZE = 32
+# the number of seconds after which a context which is still there is
+# deleted, as its scheduler or transaction processor is gone
+DEFAULT_CONTEXT_TTL = 600
+
 
 class AuthorizationException(Exception):
     def __init__(self, address):
@@ -41,32 +56,81 @@ class SquashException(Exception):
     pass
 
 
-class StateContext(object):
+# the number of seconds a context waits for its inputs to be read
+PREFETCH_TIMEOUT = 2
+
+# the state of the slots of a context
+_UNSET = 0
+_PREFETCHED = 1
+_SET = 2
+
+
+def _entry_size(address, value):
+    """Approximates the memory taken by the value of an address, by the
+    length of the address and of the value, for values which are bytes or
+    strings.
     """
+    size = len(address)
+    if isinstance(value, (bytes, str)):
+        size += len(value)
+    return size
+
+
+class StateContext(object):
+    """The addresses a transaction may read and write, under a state root,
+    and their values.
+
+    The values are kept in a slot per address, and one event tells when
+    the inputs have been read, rather than one future per address.
+
     Attributes:
-        self._state_hash (str):
-        self._read_list (list):
-        self._write_list (list):
-        self._address_value_dict (dict): a dict with address keys and
-                                    _ContextFuture values
+        _owner: the scheduler, or whatever the contexts are deleted with,
+            the context belongs to, or None.
+        _created (float): the time.monotonic() of the creation of the
+            context.
+        _slots (dict): the slot of each address of the context.
+        _values (list): the value of each slot, None until it is read or
+            set.
+        _states (bytearray): whether each slot is unset, prefetched or set
+            by the transaction.
+        _pending (int): the number of inputs not read yet.
+        _prefetched (threading.Event): set once every input is read.
     """
-    def __init__(self, state_hash, read_list, write_list):
-        """
 
+    __slots__ = ['_id', '_state_hash', '_read_list', '_write_list',
+                 '_slots', '_values', '_states', '_pending', '_prefetched',
+                 '_owner', '_created']
+
+    def __init__(self, context_id, state_hash, read_list, write_list,
+                 owner=None):
+        """
         Args:
-            state_hash: the Merkle root
-            access_list: a list of tuples ('read', address)...
+            context_id (str): the unique id of the context
+            state_hash (str): the Merkle root
+            read_list (list): the addresses the context may read
+            write_list (list): the addresses the context may write
+            owner: what the context belongs to, if anything
         """
+        self._id = context_id
         self._state_hash = state_hash
+        self._owner = owner
+        self._created = time.monotonic()
 
-        self._read_list = read_list
-        self._write_list = write_list
+        self._read_list = frozenset(read_list)
+        self._write_list = frozenset(write_list)
 
-        self._address_value_dict = {}
+        self._slots = {}
+        for address in read_list:
+            self._slots.setdefault(address, len(self._slots))
+        for address in write_list:
+            self._slots.setdefault(address, len(self._slots))
+        self._values = [None] * len(self._slots)
+        self._states = bytearray(len(self._slots))
 
-        self._id = hashlib.sha256((str(state_hash) + ":" +
-                                  str(read_list + write_list) + ":" +
-                                  str(time.time())).encode()).hexdigest()
+        self._pending = len(self._read_list)
+        self._prefetched = Event()
+        if not self._pending:
+            self._prefetched.set()
 
     @property
     def session_id(self):
@@ -76,50 +140,88 @@ class StateContext(object):
     def merkle_root(self):
         return self._state_hash
 
-    def initialize_futures(self, address_list):
-        """
-
-        Args:
-            address_list (list): a list of addresses
-
-        Returns: void
+    @property
+    def owner(self):
+        return self._owner
 
+    @property
+    def created(self):
+        return self._created
+
+    def value_bytes(self):
+        """Returns the approximate size of the values read or set."""
+        return sum(_entry_size(address, self._values[slot])
+                   for address, slot in self._slots.items()
+                   if self._states[slot] != _UNSET)
+
+    def set_prefetched(self, address_value_dict):
+        """Sets the values read for inputs of the context. The values the
+        transaction already set are kept.
         """
-        for add in address_list:
-            self._address_value_dict[add] = _ContextFuture(add)
+        for address, value in address_value_dict.items():
+            slot = self._slots[address]
+            if self._states[slot] == _UNSET:
+                self._values[slot] = value
+                self._states[slot] = _PREFETCHED
+                self._pending -= 1
+        if self._pending <= 0:
+            self._prefetched.set()
+
+    def set_values(self, address_value_dict):
+        for address, value in address_value_dict.items():
+            slot = self._slots[address]
+            if self._states[slot] == _UNSET and address in self._read_list:
+                # the read of the input no longer matters
+                self._pending -= 1
+            self._values[slot] = value
+            self._states[slot] = _SET
+        if self._pending <= 0:
+            self._prefetched.set()
+
+    def get_writable_values(self):
+        """Returns the values of the outputs of the context, once its
+        inputs are read.
 
-    def set_futures(self, address_value_dict):
-        for add, val in address_value_dict.items():
-            self._address_value_dict.get(add).set_result(val)
+        Returns:
+            dict: address to value
+        """
+        self._prefetched.wait(PREFETCH_TIMEOUT)
+        return {address: self._values[slot]
+                for address, slot in self._slots.items()
+                if address in self._write_list}
 
-    def get_writable_address_value_dict(self):
-        add_value_dict = {}
-        for add, val in self._address_value_dict.items():
-            if add in self._write_list:
-                add_value_dict[add] = val
-        return add_value_dict
+    def get_all_values(self):
+        """Returns the values of every address of the context, once its
+        inputs are read.
 
-    def get_address_value_dict(self):
-        return self._address_value_dict
+        Returns:
+            dict: address to value
+        """
+        self._prefetched.wait(PREFETCH_TIMEOUT)
+        return {address: self._values[slot]
+                for address, slot in self._slots.items()}
 
-    def get_from_prefetched(self, address_list):
+    def get_values(self, address_list):
         """
 
         Args:
             address_list (list): a list of addresses
 
         Returns:
-            found_values (list): a list of (address, ContextFuture) tuples
+            found_values (list): a list of (address, value) tuples
 
+        Raises:
+            AuthorizationException: if an address is not an input
         """
-        found_values = []
         for address in address_list:
             if address not in self._read_list:
                 LOGGER.warning("Authorization exception, address: %s", address)
                 raise AuthorizationException(address)
-            found_values.append((address,
-                                self._address_value_dict.get(address)))
-        return found_values
+        slots = [self._slots[address] for address in address_list]
+        if any(self._states[slot] == _UNSET for slot in slots):
+            self._prefetched.wait(PREFETCH_TIMEOUT)
+        return [(address, self._values[slot])
+                for address, slot in zip(address_list, slots)]
 
     def can_set(self, address_value_list):
         for add_value_dict in address_value_list:
@@ -130,60 +232,112 @@ class StateContext(object):
 
 class ContextManager(object):
 
-    def __init__(self, database):
+    def __init__(self, database, node_cache=None, hash_executor=None,
+                 node_format=CBOR_NODE_FORMAT, compress_paths=False,
+                 value_cache_bytes=DEFAULT_VALUE_CACHE_BYTES,
+                 reader_threads=DEFAULT_READER_THREADS,
+                 read_batch_size=DEFAULT_READ_BATCH_SIZE,
+                 state_overlay=False, context_ttl=DEFAULT_CONTEXT_TTL):
         """
 
         Args:
             database database.Database subclass: the subclass/implementation of
                                                 the Database
+            node_cache (NodeCache): an optional cache of decoded merkle nodes
+                                    shared by all the trie readers
+            hash_executor (concurrent.futures.Executor): an optional executor
+                                    used to hash large trie updates
+            node_format (str): the format merkle nodes are written in
+            compress_paths (bool): whether the merkle trie is written with
+                                    path compression
+            value_cache_bytes (int): the budget, in bytes, of the cache of
+                                    the values of addresses under state
+                                    roots, shared by the contexts
+            reader_threads (int): the number of threads reading the inputs
+                                    of the contexts
+            read_batch_size (int): the largest number of contexts whose
+                                    inputs a reader thread reads at once
+            state_overlay (bool): whether the states computed by squashes
+                                    are kept in memory, until the state of
+                                    a block is written by flush_state()
+            context_ttl (float): the number of seconds after which the
+                                    contexts which are still there are
+                                    deleted, or None to keep them until
+                                    they are deleted
         """
         self._database = database
+        # the states computed by squashes are read through the overlay
+        self._overlay = None
+        if state_overlay:
+            self._overlay = StateOverlay(database)
+            database = self._overlay
+        self._node_cache = node_cache
+        self._hash_executor = hash_executor
+        self._node_format = node_format
+        self._compress_paths = compress_paths
         self._first_merkle_root = None
         self._contexts = {}
-
-        self._address_queue = Queue()
-
-        inflated_addresses = Queue()
-
-        self._context_reader = _ContextReader(database, self._address_queue,
-                                              inflated_addresses)
-        self._context_reader.setDaemon(True)
-        self._context_reader.start()
+        # the context ids are a counter, after a prefix which tells them
+        # apart from those of other runs
+        self._id_prefix = os.urandom(8).hex()
+        self._id_counter = itertools.count()
+        # the ids of the contexts of each owner, guarded by _shared_lock
+        self._owned_contexts = {}
+        self._released_contexts = 0
+        self._expired_contexts = 0
+        # the roots written by squashes and commits since the last call of
+        # collect_in_flight_roots, guarded by _shared_lock
+        self._written_roots = set()
+        self._value_cache = StateValueCache(value_cache_bytes)
 
         # the lock is shared between the ContextManager and
-        # the _ContextWriter because they both access _contexts
+        # the readers because they both access _contexts
         self._shared_lock = Lock()
-        self._context_writer = _ContextWriter(self._shared_lock,
-                                              inflated_addresses,
-                                              self._contexts)
-        self._context_writer.setDaemon(True)
-        self._context_writer.start()
+        self._prefetcher = _ContextPrefetcher(
+            database, node_cache, self._value_cache, self._contexts,
+            self._shared_lock, reader_threads, read_batch_size)
+
+        self._context_ttl = context_ttl
+        self._stopped = Event()
+        self._sweeper = None
+        if context_ttl is not None:
+            self._sweeper = Thread(target=self._sweep_expired,
+                                   name='ContextSweeper')
+            self._sweeper.daemon = True
+            self._sweeper.start()
 
     def get_first_root(self):
         if self._first_merkle_root is not None:
             return self._first_merkle_root
         self._first_merkle_root = MerkleDatabase(
-            self._database).get_merkle_root()
+            self._database, node_cache=self._node_cache,
+            node_format=self._node_format,
+            compress_paths=self._compress_paths).get_merkle_root()
         return self._first_merkle_root
 
-    def create_context(self, state_hash, inputs, outputs):
+    def create_context(self, state_hash, inputs, outputs, owner=None):
         """
         Part of the interface to the Executor
         Args:
             state_hash: (str): Merkle root
             access_list: (list): list of tuples like [('read', 'address'),...
+            owner: what the context belongs to, typically its scheduler;
+                delete_owned_contexts() deletes the contexts of an owner
 
         Returns:
             context_id (str): the unique context_id of the session
 
         """
-        context = StateContext(state_hash, inputs, outputs)
         with self._shared_lock:
-            context.initialize_futures(inputs + outputs)
+            context = StateContext(
+                '{}-{:x}'.format(self._id_prefix, next(self._id_counter)),
+                state_hash, inputs, outputs, owner)
             self._contexts[context.session_id] = context
+            if owner is not None:
+                self._owned_contexts.setdefault(owner, set()).add(
+                    context.session_id)
 
-        self._address_queue.put_nowait(
-            (context.session_id, state_hash, inputs))
+        self._prefetcher.prefetch(context.session_id, state_hash, inputs)
         LOGGER.debug("CREATE_CONTEXT: %s", context.session_id)
         return context.session_id
 
@@ -210,24 +364,44 @@ class ContextManager(object):
                 "MerkleRoots not all equal, yet asking to merge")
 
         merkle_root = self._contexts[first_id].merkle_root
-        tree = MerkleDatabase(self._database, merkle_root)
 
         merged_updates = {}
         for c_id in context_id_list:
             with self._shared_lock:
-                context = self._contexts[c_id]
-                del self._contexts[c_id]
-            for k in context.get_writable_address_value_dict().keys():
+                context = self._remove_context(c_id)
+            writable_values = context.get_writable_values()
+            for k in writable_values.keys():
                 if k in merged_updates:
                     raise CommitException(
                         "Duplicate address {} in context {}".format(k, c_id))
-            merged_updates.update(context.get_writable_address_value_dict())
+            merged_updates.update(writable_values)
+
+        return self._update_state(merkle_root, merged_updates, virtual)
 
-        new_root = merkle_root
-        add_value_dict = {address: value.result()
-                          for address, value in merged_updates.items()}
-        new_root = tree.update(set_items=add_value_dict, virtual=virtual)
+    def _update_state(self, state_root, updates, virtual=False):
+        """Computes the state made by updates on a state, writing its nodes
+        to the overlay, or to the database without one, unless virtual.
 
+        Returns:
+            str: the new state root
+        """
+        database = self._database
+        if self._overlay is not None:
+            database = self._overlay.new_layer()
+        tree = MerkleDatabase(database, state_root,
+                              node_cache=self._node_cache,
+                              hash_executor=self._hash_executor,
+                              node_format=self._node_format,
+                              compress_paths=self._compress_paths)
+        new_root = tree.update(set_items=updates, virtual=virtual)
+        if self._overlay is not None and not virtual:
+            self._overlay.add_layer(state_root, new_root, database)
+        # the next contexts, built on the new root, typically read
+        # what the previous transactions wrote
+        self._value_cache.put_many(new_root, updates.items())
+        if not virtual:
+            with self._shared_lock:
+                self._written_roots.add(new_root)
         return new_root
 
     def delete_context(self, context_id_list):
@@ -244,7 +418,60 @@ class ContextManager(object):
         for c_id in context_id_list:
             with self._shared_lock:
                 if c_id in self._contexts:
-                    del self._contexts[c_id]
+                    self._remove_context(c_id)
+
+    def _remove_context(self, context_id):
+        # the caller holds _shared_lock
+        context = self._contexts.pop(context_id)
+        if context.owner is not None:
+            owned = self._owned_contexts[context.owner]
+            owned.discard(context_id)
+            if not owned:
+                del self._owned_contexts[context.owner]
+        return context
+
+    def delete_owned_contexts(self, owner):
+        """Deletes the contexts of an owner, typically once the results of
+        its scheduler are read, or when the scheduler is abandoned.
+
+        Args:
+            owner: the owner given to create_context()
+
+        Returns:
+            int: the number of contexts deleted
+        """
+        with self._shared_lock:
+            context_ids = list(self._owned_contexts.get(owner, ()))
+            for c_id in context_ids:
+                self._remove_context(c_id)
+            self._released_contexts += len(context_ids)
+        return len(context_ids)
+
+    def delete_expired_contexts(self):
+        """Deletes the contexts older than the context TTL, those of
+        transaction processors which never answered, or of schedulers
+        whose contexts were never deleted.
+
+        Returns:
+            int: the number of contexts deleted
+        """
+        if self._context_ttl is None:
+            return 0
+        oldest = time.monotonic() - self._context_ttl
+        with self._shared_lock:
+            expired = [c_id for c_id, context in self._contexts.items()
+                       if context.created < oldest]
+            for c_id in expired:
+                self._remove_context(c_id)
+            self._expired_contexts += len(expired)
+        if expired:
+            LOGGER.warning("Deleted %s contexts older than %s seconds",
+                           len(expired), self._context_ttl)
+        return len(expired)
+
+    def _sweep_expired(self):
+        while not self._stopped.wait(self._context_ttl / 2):
+            self.delete_expired_contexts()
 
     def get(self, context_id, address_list):
         """
@@ -261,8 +488,7 @@ class ContextManager(object):
                 return []
         with self._shared_lock:
             context = self._contexts.get(context_id)
-        return [(a, f.result())
-                for a, f in context.get_from_prefetched(address_list)]
+        return context.get_values(address_list)
 
     def set(self, context_id, address_value_list):
         """
@@ -286,106 +512,401 @@ class ContextManager(object):
             for d in address_value_list:
                 for add, val in d.items():
                     add_value_dict[add] = val
-            context.set_futures(add_value_dict)
+            context.set_values(add_value_dict)
         return True
 
     def get_squash_handler(self):
         def _squash(state_root, context_ids):
-            tree = MerkleDatabase(self._database, state_root)
             updates = dict()
             for c_id in context_ids:
                 with self._shared_lock:
                     context = self._contexts[c_id]
-                for add in context.get_address_value_dict().keys():
+                values = context.get_all_values()
+                for add in values.keys():
                     if add in updates:
                         raise SquashException(
                             "Duplicate address {} in context {}".format(
                                 add, c_id))
-                updates.update({k: v.result() for k, v in
-                                context.get_address_value_dict().items()})
-            state_hash = tree.update(updates, virtual=False)
-            return state_hash
+                updates.update(values)
+            return self._update_state(state_root, updates)
         return _squash
 
+    def flush_state(self, state_root):
+        """Writes the state under a state root to the database, when the
+        states computed by squashes are kept in memory; typically called
+        before the block of the state is committed. The states computed
+        from it, and those of the existing contexts, remain readable.
+
+        Args:
+            state_root (str): the state root
+
+        Returns:
+            int: the number of nodes written
+
+        Raises:
+            KeyError: if the state is neither in memory nor in the database
+        """
+        if self._overlay is None:
+            return 0
+        with self._shared_lock:
+            in_use_roots = [context.merkle_root
+                            for context in self._contexts.values()]
+        written = self._overlay.flush(state_root, in_use_roots)
+        with self._shared_lock:
+            self._written_roots.add(state_root)
+        return written
+
+    def collect_in_flight_roots(self):
+        """Returns the state roots which are in use by the scheduler and the
+        publisher, and which state pruning must keep: the roots of the
+        existing contexts, and the roots written since the previous call.
+        A root written by a squash is thus kept by at least one pruning
+        cycle, until the contexts built on it exist or the block it
+        belongs to is committed. With the states of the squashes kept in
+        memory, the roots of the states of the database they were computed
+        on are in flight as well.
+
+        Returns:
+            set: the state root hashes
+        """
+        with self._shared_lock:
+            roots = self._written_roots
+            self._written_roots = set()
+            roots.update(context.merkle_root
+                         for context in self._contexts.values())
+        if self._overlay is not None:
+            roots.update(self._overlay.base_roots())
+        return roots
+
+    @property
+    def value_cache(self):
+        return self._value_cache
+
+    @property
+    def prefetch_metrics(self):
+        return self._prefetcher.metrics
+
+    @property
+    def context_metrics(self):
+        """The number of live contexts and of their owners, the approximate
+        size in bytes of the values the contexts hold, and the number of
+        contexts deleted with their owner or once expired.
+        """
+        with self._shared_lock:
+            return {
+                'live_contexts': len(self._contexts),
+                'owners': len(self._owned_contexts),
+                'prefetched_bytes': sum(
+                    context.value_bytes()
+                    for context in self._contexts.values()),
+                'released_contexts': self._released_contexts,
+                'expired_contexts': self._expired_contexts,
+            }
+
+    @property
+    def overlay_metrics(self):
+        """The metrics of the states kept in memory, or None when they are
+        written to the database by the squashes.
+        """
+        if self._overlay is None:
+            return None
+        return self._overlay.metrics
+
     def stop(self):
-        self._context_writer.join(1)
-        self._context_reader.join(1)
+        self._stopped.set()
+        self._prefetcher.stop()
 
 
-class _ContextReader(Thread):
-    """
+class StateValueCache(object):
+    """A size-bounded LRU cache of the values of addresses under state
+    roots, keyed by (state root, address).
+
+    The value of an address under a state root never changes, so entries
+    never become stale: a new root is a new key. Entries only leave the
+    cache when the byte budget is exceeded. An address missing from a state
+    is cached as well, with a None value. The size of an entry is
+    approximated by the length of the address and of the value, for values
+    which are bytes or strings.
+
     Attributes:
-        _in_condition (threading.Condition): threading object for notification
-        _addresses (queue.Queue): each item is a tuple
-                                  (context_id, state_hash, address_list)
-        _inflated_addresses (queue.Queue): each item is a tuple
-                                          (context_id, [(address, value), ...
+        _lock (threading.Lock): guards the entries and the counters.
+        _values (OrderedDict): (state root, address) to (value, size) in LRU
+            order, the least recently used entry first.
     """
-    def __init__(self, database, address_queue, inflated_addresses):
-        super(_ContextReader, self).__init__()
-        self._database = database
-        self._addresses = address_queue
-        self._inflated_addresses = inflated_addresses
 
-    def run(self):
-        while True:
-            context_state_addresslist_tuple = self._addresses.get(block=True)
-            c_id, state_hash, address_list = context_state_addresslist_tuple
-            tree = MerkleDatabase(self._database, state_hash)
-            return_values = []
-            for address in address_list:
-                value = None
-                try:
-                    value = tree.get(address)
-                except KeyError:
-                    pass
-                return_values.append((address, value))
-            self._inflated_addresses.put((c_id, return_values))
+    def __init__(self, max_bytes=DEFAULT_VALUE_CACHE_BYTES):
+        """
+        Args:
+            max_bytes (int): the budget, in bytes, of the cached entries
+        """
+        self._lock = Lock()
+        self._values = OrderedDict()
+        self._max_bytes = max_bytes
+        self._size_bytes = 0
 
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._values)
+
+    def get_many(self, state_root, addresses):
+        """Looks up the values of addresses under a state root, marking
+        those found as the most recently used.
+
+        Args:
+            state_root (str): the state root hash
+            addresses (list): the addresses
+
+        Returns:
+            tuple: a dict of the cached values by address, and the list of
+                the addresses which are not cached
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            for address in addresses:
+                key = (state_root, address)
+                entry = self._values.get(key)
+                if entry is None:
+                    missing.append(address)
+                else:
+                    self._values.move_to_end(key)
+                    found[address] = entry[0]
+            self._hits += len(found)
+            self._misses += len(missing)
+        return found, missing
+
+    def put_many(self, state_root, address_values):
+        """Adds the values of addresses under a state root to the cache,
+        evicting the least recently used entries as needed to stay within
+        the byte budget.
+
+        Args:
+            state_root (str): the state root hash
+            address_values (iterable): (address, value) tuples, with None
+                for the addresses missing from the state
+        """
+        with self._lock:
+            for address, value in address_values:
+                key = (state_root, address)
+                size = _entry_size(address, value)
+                if key in self._values or size > self._max_bytes:
+                    continue
+                self._values[key] = (value, size)
+                self._size_bytes += size
+
+            while self._size_bytes > self._max_bytes:
+                _, (_, evicted_size) = self._values.popitem(last=False)
+                self._size_bytes -= evicted_size
+                self._evictions += 1
+
+    @property
+    def size_bytes(self):
+        with self._lock:
+            return self._size_bytes
+
+    @property
+    def metrics(self):
+        with self._lock:
+            reads = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_ratio': self._hits / reads if reads else 0.0,
+                'size_bytes': self._size_bytes,
+                'entries': len(self._values),
+            }
+
+
+class _ContextPrefetcher(object):
+    """Reads the inputs of the contexts, with a pool of reader threads.
+
+    Each reader takes the contexts queued at that time, up to batch_size,
+    and reads the addresses they need with one walk of the trie per state
+    root, after the value cache. An address needed by several contexts of
+    the batch is read once. An address another reader is reading is not
+    read again: that reader sets it in all the contexts waiting for it. A
+    context's inputs are set as soon as their values are read, whatever
+    the other contexts wait for.
 
-class _ContextWriter(Thread):
-    """
     Attributes:
-        _condition (threading.Condition): threading object for notification
-        _inflated_addresses (queue.Queue): each item is a tuple
-                                           (context_id, [(address, value), ...
+        _queue (queue.Queue): each item is a tuple (context_id, state_hash,
+            address_list, time queued), or None to stop a reader
+        _lock (threading.Lock): guards _in_flight and the metrics.
+        _in_flight (dict): the ids of the contexts waiting for each
+            (state_hash, address) being read, by a reader which sets them
+            all.
     """
 
-    def __init__(self, lock, inflated_addresses, contexts):
-        super(_ContextWriter, self).__init__()
-        self._lock = lock
-        self._inflated_addresses = inflated_addresses
-
+    def __init__(self, database, node_cache, value_cache, contexts,
+                 contexts_lock, threads, batch_size):
+        """
+        Args:
+            database (Database): the database of the state
+            node_cache (NodeCache): the optional cache of the trie nodes
+            value_cache (StateValueCache): consulted before the state, and
+                filled with the values read
+            contexts (dict): the contexts by id, guarded by contexts_lock
+            contexts_lock (threading.Lock): shared with the ContextManager
+            threads (int): the number of reader threads
+            batch_size (int): the largest number of contexts read at once
+                by a reader
+        """
+        self._database = database
+        self._node_cache = node_cache
+        self._value_cache = value_cache
         self._contexts = contexts
-
-    def run(self):
+        self._contexts_lock = contexts_lock
+        self._batch_size = batch_size
+        self._queue = Queue()
+
+        self._lock = Lock()
+        self._in_flight = {}
+        self._batches = 0
+        self._prefetched = 0
+        self._read_addresses = 0
+        self._coalesced_addresses = 0
+        self._latency = 0.0
+        self._max_latency = 0.0
+        self._max_queue_depth = 0
+
+        self._readers = []
+        for i in range(threads):
+            reader = Thread(target=self._read_queued,
+                            name='ContextReader-{}'.format(i))
+            reader.daemon = True
+            reader.start()
+            self._readers.append(reader)
+
+    def prefetch(self, context_id, state_hash, address_list):
+        self._queue.put_nowait(
+            (context_id, state_hash, address_list, time.time()))
+        depth = self._queue.qsize()
+        with self._lock:
+            self._max_queue_depth = max(self._max_queue_depth, depth)
+
+    def _read_queued(self):
         while True:
-            c_id, inflated_address_list = self._inflated_addresses.get(
-                block=True)
-            with self._lock:
-                if c_id in self._contexts:
-                    self._contexts[c_id].set_futures(
-                        {k: v for k, v in inflated_address_list})
+            batch = [self._queue.get(block=True)]
+            while batch[-1] is not None and len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            if batch:
+                self._read_batch(batch)
+            if stop:
+                return
+
+    def _read_batch(self, batch):
+        # the ids of the contexts waiting for each address, by state root
+        by_root = {}
+        for c_id, state_hash, address_list, _ in batch:
+            waiting = by_root.setdefault(state_hash, {})
+            for address in address_list:
+                waiting.setdefault(address, []).append(c_id)
+
+        for state_hash, waiting in by_root.items():
+            values, missing = self._value_cache.get_many(state_hash,
+                                                         list(waiting))
+            self._set_values(
+                {address: (values[address], waiting[address])
+                 for address in values})
+            if missing:
+                self._read_missing(state_hash, missing, waiting)
+
+        done = time.time()
+        with self._lock:
+            self._batches += 1
+            self._prefetched += len(batch)
+            for _, _, _, queued in batch:
+                latency = done - queued
+                self._latency += latency
+                self._max_latency = max(self._max_latency, latency)
+
+    def _read_missing(self, state_hash, missing, waiting):
+        # the addresses already being read by another reader are set by it
+        claimed = []
+        with self._lock:
+            for address in missing:
+                key = (state_hash, address)
+                if key in self._in_flight:
+                    self._in_flight[key].extend(waiting[address])
+                    self._coalesced_addresses += 1
+                else:
+                    self._in_flight[key] = list(waiting[address])
+                    claimed.append(address)
+        if not claimed:
+            return
+
+        try:
+            tree = MerkleDatabase(self._database, state_hash,
+                                  node_cache=self._node_cache)
+            read = tree.get_many(claimed)
+            values = [(address, read.get(address)) for address in claimed]
+            self._value_cache.put_many(state_hash, values)
+        except KeyError as exc:
+            # a node of the state is missing: the inputs of the contexts
+            # are still resolved, so that nothing waits on them, and the
+            # readers go on reading for the other contexts
+            LOGGER.error("Unable to read the state from root %s: %s",
+                         state_hash, exc)
+            values = [(address, None) for address in claimed]
+
+        with self._lock:
+            self._read_addresses += len(claimed)
+            waiters = {address: self._in_flight.pop((state_hash, address))
+                       for address in claimed}
+        self._set_values({address: (value, waiters[address])
+                          for address, value in values})
+
+    def _set_values(self, values):
+        """Sets the values in the contexts waiting for them.
 
+        Args:
+            values (dict): address to (value, context ids) tuples
+        """
+        by_context = {}
+        for address, (value, context_ids) in values.items():
+            for c_id in context_ids:
+                by_context.setdefault(c_id, {})[address] = value
+        with self._contexts_lock:
+            for c_id, address_values in by_context.items():
+                context = self._contexts.get(c_id)
+                if context is not None:
+                    context.set_prefetched(address_values)
 
-class _ContextFuture(object):
-    def __init__(self, address):
-        self.address = address
-        self._result = None
-        self._result_is_set = False
-        self._condition = Condition()
-
-    def done(self):
-        return self._result_is_set
-
-    def result(self):
-        with self._condition:
-            if not self._result_is_set:
-                self._condition.wait(2)
-        return self._result
-
-    def set_result(self, result):
-        with self._condition:
-            self._result = result
-            self._result_is_set = True
-            self._condition.notify_all()
+    @property
+    def metrics(self):
+        """The number of contexts waiting for a reader, and the largest
+        such number, the number of contexts prefetched and their mean and
+        largest latency in seconds, from their creation to the end of their
+        read, the number of batches of contexts, and the number of
+        addresses read from the state or coalesced with the read of
+        another reader.
+        """
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'prefetched_contexts': self._prefetched,
+                'mean_prefetch_latency':
+                    self._latency / max(1, self._prefetched),
+                'max_prefetch_latency': self._max_latency,
+                'batches': self._batches,
+                'read_addresses': self._read_addresses,
+                'coalesced_addresses': self._coalesced_addresses,
+            }
+
+    def stop(self):
+        for _ in self._readers:
+            self._queue.put_nowait(None)
+        for reader in self._readers:
+            reader.join(1)
@@ -20,12 +20,19 @@ from sawtooth_validator.protobuf import processor_pb2
 from sawtooth_validator.protobuf import transaction_pb2
 from sawtooth_validator.protobuf import validator_pb2
 
+from sawtooth_validator.execution.scheduler_parallel import \
+    ParallelScheduler
 from sawtooth_validator.execution.scheduler_serial import SerialScheduler
 from sawtooth_validator.execution import processor_iterator
 
 
 LOGGER = logging.getLogger(__name__)
 
+SERIAL_SCHEDULER = 'serial'
+PARALLEL_SCHEDULER = 'parallel'
+
+SCHEDULERS = [SERIAL_SCHEDULER, PARALLEL_SCHEDULER]
+
 
 class TransactionExecutorThread(threading.Thread):
     def __init__(self, service, context_manager, scheduler, processors,
@@ -65,7 +72,8 @@ class TransactionExecutorThread(threading.Thread):
             context_id = self._context_manager.create_context(
                 txn_info.state_hash,
                 inputs=list(header.inputs),
-                outputs=list(header.outputs))
+                outputs=list(header.outputs),
+                owner=self._scheduler)
             content = processor_pb2.TpProcessRequest(
                 header=txn.header,
                 payload=txn.payload,
@@ -104,15 +112,37 @@ class TransactionExecutorThread(threading.Thread):
 
 
 class TransactionExecutor(object):
-    def __init__(self, service, context_manager):
+    def __init__(self, service, context_manager,
+                 scheduler_type=SERIAL_SCHEDULER):
+        """
+        Args:
+            service (Interconnect): the service of the transaction
+                processors
+            context_manager (ContextManager): the state of the transactions
+            scheduler_type (str): one of SCHEDULERS, the scheduler which
+                orders the transactions of the blocks; the parallel one
+                executes the transactions which do not conflict
+                concurrently, with the results of the serial one
+        """
+        if scheduler_type not in SCHEDULERS:
+            raise ValueError("Unknown scheduler: {}".format(scheduler_type))
         self._service = service
         self._context_manager = context_manager
+        self._scheduler_type = scheduler_type
         self.processors = processor_iterator.ProcessorIteratorCollection(
             processor_iterator.RoundRobinProcessorIterator)
 
     def create_scheduler(self, squash_handler, first_state_root):
+        if self._scheduler_type == PARALLEL_SCHEDULER:
+            return ParallelScheduler(squash_handler, first_state_root)
         return SerialScheduler(squash_handler, first_state_root)
 
+    def release_scheduler(self, scheduler):
+        """Deletes the contexts of the transactions executed for a
+        scheduler, once its results are read, or when it is abandoned.
+        """
+        self._context_manager.delete_owned_contexts(scheduler)
+
     def execute(self, scheduler, require_txn_processors=False):
         t = TransactionExecutorThread(
             self._service,
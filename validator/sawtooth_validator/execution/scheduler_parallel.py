@@ -14,6 +14,15 @@
 # ------------------------------------------------------------------------------
 
 from ast import literal_eval
+import heapq
+from threading import Condition
+
+from sawtooth_validator.execution.scheduler import BatchExecutionResult
+from sawtooth_validator.execution.scheduler import TxnInformation
+from sawtooth_validator.execution.scheduler import Scheduler
+from sawtooth_validator.execution.scheduler import SchedulerIterator
+from sawtooth_validator.execution.scheduler_exceptions import SchedulerError
+from sawtooth_validator.protobuf import transaction_pb2
 
 
 class RadixNode:
@@ -96,45 +105,256 @@ class RadixTree:
 
         return readers_and_writers
 
+    def find_readers_and_writers_below(self, address):
+        """Returns the readers and writers of the addresses which address
+        is a strict prefix of.
+        """
+        readers_and_writers = []
+
+        node = self._get(address)
+        if node is None:
+            return readers_and_writers
+
+        pending = list(node.children.values())
+        while pending:
+            node = pending.pop()
+            readers_and_writers.extend(node.readers)
+            if node.writer is not None and \
+                    node.writer not in readers_and_writers:
+                readers_and_writers.append(node.writer)
+            pending.extend(node.children.values())
+
+        return readers_and_writers
+
 
 class TopologicalSorter:
+    """Orders identifiers so that each comes after its predecessors, with
+    Kahn's algorithm, in O((V + E) log V).
+
+    Among the identifiers whose predecessors are all ordered, the first
+    added comes first, so the order is that of the insertion as far as
+    the relations allow. Relations can be added as they arrive, before or
+    after calls to order().
+
+    Attributes:
+        _indexes (dict): the insertion index of each identifier.
+        _identifiers (list): the identifiers, by insertion index.
+        _count (list): the number of predecessors, by insertion index.
+        _successors (list): the lists of the insertion indexes of the
+            successors, by insertion index.
+    """
     def __init__(self):
-        self._count = {}
-        self._successors = {}
+        self._indexes = {}
         self._identifiers = []
+        self._count = []
+        self._successors = []
 
     def _init(self, identifier):
-        if identifier not in self._count:
-            self._count[identifier] = 0
-        if identifier not in self._successors:
-            self._successors[identifier] = []
-        if identifier not in self._identifiers:
+        index = self._indexes.get(identifier)
+        if index is None:
+            index = len(self._identifiers)
+            self._indexes[identifier] = index
             self._identifiers.append(identifier)
+            self._count.append(0)
+            self._successors.append([])
+        return index
+
+    def add_identifier(self, identifier):
+        """Adds an identifier which may have no relations."""
+        self._init(identifier)
 
     def add_relation(self, predecessor, successor):
-        self._init(predecessor)
-        self._init(successor)
-        self._count[successor] += 1
-        self._successors[predecessor].append(successor)
+        predecessor_index = self._init(predecessor)
+        successor_index = self._init(successor)
+        self._count[successor_index] += 1
+        self._successors[predecessor_index].append(successor_index)
 
     def order(self):
+        count = list(self._count)
+        ready = [index for index, predecessors in enumerate(count)
+                 if predecessors == 0]
+        # ready is sorted, so it is a heap already
         retval = []
 
-        while len(self._identifiers) > 0:
-            found = None
-            for identifier in self._identifiers:
-                if self._count[identifier] == 0:
-                    found = identifier
-                    break
-            if found is not None:
-                retval.append(found)
-                for successor in self._successors[found]:
-                    self._count[successor] -= 1
-
-                self._identifiers.remove(found)
-                del self._count[found]
-                del self._successors[found]
-            else:
-                raise Exception("non-acyclic graph detected, aborting")
+        while ready:
+            index = heapq.heappop(ready)
+            retval.append(self._identifiers[index])
+            for successor in self._successors[index]:
+                count[successor] -= 1
+                if count[successor] == 0:
+                    heapq.heappush(ready, successor)
+
+        if len(retval) < len(self._identifiers):
+            raise Exception("non-acyclic graph detected, aborting")
 
         return retval
+
+
+class ParallelScheduler(Scheduler):
+    """Scheduler which returns every transaction whose dependencies are
+    applied, so that transactions which do not conflict are executed
+    concurrently, with the results of the SerialScheduler.
+
+    A transaction depends on the earlier transactions which write an
+    address overlapping its inputs or outputs, an address being a prefix
+    of the other, and on the earlier transactions listed in its
+    dependencies. The results are applied in the order of the
+    transactions, as the SerialScheduler applies them: a valid
+    transaction's context is squashed on the state of the transactions
+    before it. A transaction is returned once the transactions it depends
+    on are applied, with the state root of the transactions applied so
+    far: the transactions before it which are not applied yet do not
+    write its inputs, so it reads the values it would read after all of
+    them.
+
+    Attributes:
+        _condition (threading.Condition): guards the attributes below, and
+            is shared with the iterators.
+        _writers (RadixTree): the index of the last transaction writing
+            each address.
+        _txns (list): (transaction, batch signature) tuples, in order.
+        _ready (list): a heap of the indexes of the transactions whose
+            dependencies are applied, and which are not returned yet.
+        _waiting (dict): the indexes of the transactions waiting for the
+            transaction of each index to be applied.
+        _results (dict): the (is_valid, context_id) results of the
+            executed transactions, by index, until they are applied.
+        _applied (int): the number of transactions applied.
+    """
+    def __init__(self, squash_handler, first_state_hash):
+        self._squash = squash_handler
+        self._condition = Condition()
+        self._writers = RadixTree()
+        self._txns = []
+        self._txn_indexes = {}
+        self._last_in_batch = set()
+        self._batch_statuses = {}
+        self._scheduled_transactions = []
+        self._ready = []
+        self._waiting = {}
+        self._in_progress = set()
+        self._results = {}
+        self._applied = 0
+        self._last_state_hash = first_state_hash
+        self._final = False
+
+    def __iter__(self):
+        return SchedulerIterator(self, self._condition)
+
+    def add_batch(self, batch, state_hash=None):
+        with self._condition:
+            if self._final:
+                raise SchedulerError("Scheduler is finalized. Cannot take"
+                                     " new batches")
+            batch_signature = batch.header_signature
+            for txn in batch.transactions:
+                self._add_transaction(txn, batch_signature)
+            if batch.transactions:
+                self._last_in_batch.add(
+                    batch.transactions[-1].header_signature)
+            self._condition.notify_all()
+
+    def _add_transaction(self, txn, batch_signature):
+        index = len(self._txns)
+        header = transaction_pb2.TransactionHeader()
+        header.ParseFromString(txn.header)
+
+        # the dependencies are looked up before the outputs are set, as
+        # a transaction does not depend on itself
+        dependencies = [self._txn_indexes[signature]
+                        for signature in header.dependencies
+                        if signature in self._txn_indexes]
+        for address in list(header.inputs) + list(header.outputs):
+            dependencies.extend(
+                self._writers.find_readers_and_writers(address))
+            dependencies.extend(
+                self._writers.find_readers_and_writers_below(address))
+        # a writer replaces those of the addresses under it, which it
+        # depends on: waiting for the last writer waits for all of them,
+        # as the transactions are applied in order
+        for address in header.outputs:
+            self._writers.set_writer(address, index)
+
+        self._txns.append((txn, batch_signature))
+        self._txn_indexes[txn.header_signature] = index
+        last_dependency = max(dependencies, default=-1)
+        if last_dependency < self._applied:
+            heapq.heappush(self._ready, index)
+        else:
+            self._waiting.setdefault(last_dependency, []).append(index)
+
+    def get_batch_execution_result(self, batch_signature):
+        with self._condition:
+            return self._batch_statuses.get(batch_signature)
+
+    def set_transaction_execution_result(
+            self, txn_signature, is_valid, context_id):
+        with self._condition:
+            index = self._txn_indexes.get(txn_signature)
+            if index is None:
+                raise ValueError("transaction not in any batches: {}".format(
+                    txn_signature))
+            if index not in self._in_progress:
+                raise ValueError("transaction not in progress: {}".format(
+                    txn_signature))
+            self._in_progress.remove(index)
+            self._results[index] = (is_valid, context_id)
+            self._apply_results()
+            self._condition.notify_all()
+
+    def _apply_results(self):
+        while self._applied in self._results:
+            is_valid, context_id = self._results.pop(self._applied)
+            txn, batch_signature = self._txns[self._applied]
+            if is_valid:
+                self._last_state_hash = self._squash(
+                    self._last_state_hash, [context_id])
+            else:
+                # txn is invalid, preemptively fail the batch
+                self._batch_statuses[batch_signature] = \
+                    BatchExecutionResult(is_valid=False, state_hash=None)
+            if txn.header_signature in self._last_in_batch and \
+                    batch_signature not in self._batch_statuses:
+                self._batch_statuses[batch_signature] = \
+                    BatchExecutionResult(is_valid=True,
+                                         state_hash=self._last_state_hash)
+
+            for index in self._waiting.pop(self._applied, ()):
+                heapq.heappush(self._ready, index)
+            self._applied += 1
+
+    def next_transaction(self):
+        with self._condition:
+            if not self._ready:
+                return None
+            index = heapq.heappop(self._ready)
+            self._in_progress.add(index)
+            txn_info = TxnInformation(self._txns[index][0],
+                                      self._last_state_hash)
+            self._scheduled_transactions.append(txn_info)
+            return txn_info
+
+    def count(self):
+        with self._condition:
+            return len(self._scheduled_transactions)
+
+    def get_transaction(self, index):
+        with self._condition:
+            return self._scheduled_transactions[index]
+
+    def finalize(self):
+        with self._condition:
+            self._final = True
+            self._condition.notify_all()
+
+    def _is_complete(self):
+        return self._final and self._applied == len(self._txns)
+
+    def complete(self, block):
+        with self._condition:
+            if self._is_complete():
+                return True
+            if block:
+                self._condition.wait_for(self._is_complete)
+                return True
+            return False
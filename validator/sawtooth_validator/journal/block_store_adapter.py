@@ -30,7 +30,11 @@ class BlockStoreAdapter(MutableMapping):
         self._block_store = block_store
 
     def __setitem__(self, key, value):
-        self._block_store[key] = {
+        self._block_store[key] = self._unwrap(value)
+
+    @staticmethod
+    def _unwrap(value):
+        return {
             "block": value.block,
             "weight": value.weight
         }
@@ -61,6 +65,26 @@ class BlockStoreAdapter(MutableMapping):
         """
         self._block_store["chain_head_id"] = block_id
 
+    def update_chain(self, new_chain, old_chain):
+        """
+        Stores the blocks of new_chain, makes its first block the chain
+        head, and removes the blocks of old_chain. Stores which support it
+        (see LMDBBlockStore) make the whole update in a single transaction.
+        """
+        update_chain = getattr(self._block_store, 'update_chain', None)
+        if update_chain is not None:
+            update_chain(
+                [(b.identifier, self._unwrap(b)) for b in new_chain],
+                [b.identifier for b in old_chain],
+                new_chain[0].identifier)
+            return
+
+        for b in new_chain:
+            self[b.identifier] = b
+        self.set_chain_head(new_chain[0].identifier)
+        for b in old_chain:
+            del self[b.identifier]
+
     @property
     def chain_head(self):
         """
@@ -89,6 +89,7 @@ class BlockValidator(object):
                                 state_hash = result.state_hash
                             else:
                                 valid = False
+                        self._executor.release_scheduler(scheduler)
                         if block_state.state_root_hash != state_hash:
                             valid = False
                 if valid:
@@ -212,7 +213,19 @@ class ChainController(object):
                  executor,
                  transaction_executor,
                  on_chain_updated,
-                 squash_handler):
+                 squash_handler,
+                 on_block_committed=None,
+                 state_barrier=None):
+        """
+        Args:
+            on_block_committed (callable): called with the new chain head
+                once its blocks are in the block store, before the chain
+                update is notified; used to make the state of the block
+                durable.
+            state_barrier (callable): called with the state roots of the
+                blocks of a new chain before they are written to the block
+                store, it returns once their state is in the state database.
+        """
         self._lock = RLock()
         self._consensus = consensus
         self._block_cache = block_cache
@@ -222,6 +235,8 @@ class ChainController(object):
         self._transaction_executor = transaction_executor
         self._notify_on_chain_updated = on_chain_updated
         self._sqaush_handler = squash_handler
+        self._on_block_committed = on_block_committed
+        self._state_barrier = state_barrier
 
         self._blocks_processing = {}  # a set of blocks that are
         # currently being processed.
@@ -281,15 +296,19 @@ class ChainController(object):
                     # the block validation work we have done is saved.
                     self._verify_block(new_block)
                 elif commit_new_block:
-                    self._chain_head = new_block
+                    # the state of the blocks is written before them
+                    if self._state_barrier is not None:
+                        self._state_barrier(
+                            [block.state_root_hash
+                             for block in reversed(new_chain)])
 
-                    for b in new_chain:
-                        self._block_store[b.identifier] = b
+                    self._chain_head = new_block
 
-                    self._block_store.set_chain_head(new_block.identifier)
+                    # the blocks and the chain head are committed together
+                    self._block_store.update_chain(new_chain, current_chain)
 
-                    for b in current_chain:
-                        del self._block_store[b.identifier]
+                    if self._on_block_committed is not None:
+                        self._on_block_committed(new_block)
 
                     LOGGER.info("Chain head updated to: %s",
                                 self._chain_head)
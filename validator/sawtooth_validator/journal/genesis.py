@@ -37,7 +37,8 @@ class GenesisController(object):
                  transaction_executor,
                  completer,
                  block_store,
-                 data_dir):
+                 data_dir,
+                 state_barrier=None):
         """
         Creates a GenesisController
         Params:
@@ -46,12 +47,16 @@ class GenesisController(object):
             completer - a Completer instance
             block_store - the block store, with dict-like access
             data_dir - the directory for data files
+            state_barrier - called with the genesis state root before the
+                genesis block is written, it returns once the genesis state
+                is in the state database
         """
         self._context_manager = context_manager
         self._transaction_executor = transaction_executor
         self._completer = completer
         self._block_store = block_store
         self._data_dir = data_dir
+        self._state_barrier = state_barrier
 
     def requires_genesis(self):
         """
@@ -132,6 +137,8 @@ class GenesisController(object):
                     .format(batch.header_signature))
 
             state_hash = result.state_hash
+        if genesis_batches:
+            self._transaction_executor.release_scheduler(scheduler)
         LOGGER.debug('Produced state hash %s for genesis block.',
                      state_hash)
 
@@ -145,6 +152,8 @@ class GenesisController(object):
         LOGGER.info('Genesis block created: %s', blkw)
 
         self._completer.add_block(block)
+        if self._state_barrier is not None:
+            self._state_barrier([state_hash])
         self._block_store['chain_head_id'] = blkw.identifier
 
         self._block_store[blkw.identifier] = {
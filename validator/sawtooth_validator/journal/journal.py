@@ -103,8 +103,10 @@ class Journal(object):
                  block_sender,
                  transaction_executor,
                  squash_handler,
-                 block_cache=None  # not require, allows tests to inject a
+                 block_cache=None,  # not require, allows tests to inject a
                  # prepopulated block cache.
+                 on_block_committed=None,  # called with each new chain head
+                 state_barrier=None  # waited on before blocks are committed
                  ):
         self._consensus = consensus
         self._block_store = BlockStoreAdapter(block_store)
@@ -115,6 +117,8 @@ class Journal(object):
         self._transaction_executor = transaction_executor
         self._squash_handler = squash_handler
         self._block_sender = block_sender
+        self._on_block_committed = on_block_committed
+        self._state_barrier = state_barrier
 
         self._block_publisher = None
         self._batch_queue = queue.Queue()
@@ -141,7 +145,9 @@ class Journal(object):
             executor=ThreadPoolExecutor(1),
             transaction_executor=self._transaction_executor,
             on_chain_updated=self._block_publisher.on_chain_updated,
-            squash_handler=self._squash_handler
+            squash_handler=self._squash_handler,
+            on_block_committed=self._on_block_committed,
+            state_barrier=self._state_barrier
         )
         self._chain_thread = self._ChainThread(self._chain_controller,
                                                self._block_queue,
@@ -154,6 +160,36 @@ class Journal(object):
     def get_block_store(self):
         return self._block_store
 
+    def get_state_roots(self, depth):
+        """Returns the state roots which state pruning must keep: the roots
+        of the last blocks of the current chain, and the roots of the blocks
+        in the block cache, which may be forks being validated.
+
+        Args:
+            depth (int): the number of blocks of the current chain to keep
+                the state of, starting from the chain head
+
+        Returns:
+            set: the state root hashes
+        """
+        roots = set()
+        try:
+            block = self._block_store.chain_head
+        except KeyError:
+            block = None
+        for _ in range(depth):
+            if block is None:
+                break
+            roots.add(block.state_root_hash)
+            try:
+                block = self._block_store[block.previous_block_id]
+            except KeyError:
+                block = None
+
+        for block in self._block_cache.peek_values():
+            roots.add(block.state_root_hash)
+        return roots
+
     def start(self):
         if self._publisher_thread is None and self._chain_thread is None:
             self._init_subprocesses()
@@ -0,0 +1,109 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+# pylint: disable=no-name-in-module
+from collections.abc import MutableMapping
+
+from sawtooth_validator.database.lmdb_nolock_database import BLOCK_DATABASE
+from sawtooth_validator.database.lmdb_nolock_database import CHAIN_DATABASE
+from sawtooth_validator.protobuf.block_pb2 import Block
+
+CHAIN_HEAD_KEY = "chain_head_id"
+
+
+class LMDBBlockStore(MutableMapping):
+    """
+    A block store kept in named databases of an LMDB environment, with the
+    same content as the dict block stores: the block ids mapped to a dict of
+    the block and its weight, and "chain_head_id" mapped to the id of the
+    chain head. The blocks and the chain head are in separate databases,
+    which update_chain() writes in a single transaction.
+    """
+    def __init__(self, environment):
+        self._environment = environment
+        self._blocks = environment.open_database(BLOCK_DATABASE)
+        self._chain = environment.open_database(CHAIN_DATABASE)
+
+    def __setitem__(self, key, value):
+        if key == CHAIN_HEAD_KEY:
+            self._chain.set(key, value)
+        else:
+            self._blocks.set(key, self._pack(value))
+
+    def __getitem__(self, key):
+        if key == CHAIN_HEAD_KEY:
+            value = self._chain.get(key)
+        else:
+            value = self._blocks.get(key)
+        if value is None:
+            raise KeyError(key)
+        if key == CHAIN_HEAD_KEY:
+            return value
+        return self._unpack(value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key == CHAIN_HEAD_KEY:
+            self._chain.delete(key)
+        else:
+            self._blocks.delete(key)
+
+    def __contains__(self, key):
+        if key == CHAIN_HEAD_KEY:
+            return key in self._chain
+        return key in self._blocks
+
+    def __iter__(self):
+        return iter(self._chain.keys() + self._blocks.keys())
+
+    def __len__(self):
+        return len(self._chain) + len(self._blocks)
+
+    def update_chain(self, blocks, removed_ids, chain_head_id):
+        """
+        Stores blocks, removes others and sets the chain head, in a single
+        transaction which is flushed to disk with any state written before
+        it, so that after a crash the chain head and its blocks are either
+        all present with their state, or not at all.
+
+        Args:
+            blocks (list): (block id, dict of the block and its weight)
+                tuples
+            removed_ids (list): the ids of the blocks to remove
+            chain_head_id (str): the id of the new chain head
+        """
+        with self._environment.write_txn() as txn:
+            for block_id, value in blocks:
+                txn.set(self._blocks, block_id, self._pack(value))
+            for block_id in removed_ids:
+                txn.delete(self._blocks, block_id)
+            txn.set(self._chain, CHAIN_HEAD_KEY, chain_head_id)
+
+    @staticmethod
+    def _pack(value):
+        return {
+            "block": value["block"].SerializeToString(),
+            "weight": value["weight"]
+        }
+
+    @staticmethod
+    def _unpack(value):
+        block = Block()
+        block.ParseFromString(value["block"])
+        return {
+            "block": block,
+            "weight": value["weight"]
+        }
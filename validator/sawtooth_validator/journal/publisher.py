@@ -60,6 +60,11 @@ class BlockPublisher(object):
             previous_block_id=chain_head.header_signature)
         self._consensus.initialize_block(block_header)
 
+        # the contexts of the previous scheduler are not used anymore,
+        # whether its block was published or abandoned
+        if self._scheduler is not None:
+            self._transaction_executor.release_scheduler(self._scheduler)
+
         # create a new scheduler
         # TBD move factory in to executor for easier mocking --
         # Yes I want to make fun of it.
@@ -69,6 +69,14 @@ class TimedCache(MutableMapping):
     def cache(self):
         return self._cache
 
+    def peek_values(self):
+        """
+        Returns a snapshot of the cached values, without marking them as
+        accessed, so that reading them does not extend their lifetime.
+        """
+        with self._lock:
+            return [v.value for v in self._cache.values()]
+
     @property
     def keep_time(self):
         return self._keep_time
@@ -19,6 +19,12 @@ import argparse
 from sawtooth_validator.server.core import Validator
 from sawtooth_validator.server.log import init_console_logging
 from sawtooth_validator.exceptions import GenesisError
+from sawtooth_validator.execution.context_manager import \
+    DEFAULT_READER_THREADS
+from sawtooth_validator.execution.executor import SCHEDULERS
+from sawtooth_validator.execution.executor import SERIAL_SCHEDULER
+from sawtooth_validator.state.node_codec import CBOR_NODE_FORMAT
+from sawtooth_validator.state.node_codec import NODE_FORMATS
 
 
 def parse_args(args):
@@ -37,6 +43,45 @@ def parse_args(args):
                         help='A list of peers to attempt to connect to '
                              'in the format tcp://hostname:port',
                         nargs='+')
+    parser.add_argument('--state-node-format',
+                        help='The encoding of the nodes of the state trie. '
+                             'The state root hashes depend on it, so all the '
+                             'validators of a network must use the same one',
+                        choices=NODE_FORMATS,
+                        default=CBOR_NODE_FORMAT)
+    parser.add_argument('--compress-state-paths',
+                        help='Store the state trie with path compression. '
+                             'The state root hashes depend on it, so all the '
+                             'validators of a network must use the same '
+                             'setting',
+                        action='store_true')
+    parser.add_argument('--state-write-behind',
+                        help='Write the state trie nodes to disk on a '
+                             'background thread; blocks are committed once '
+                             'their state is written',
+                        action='store_true')
+    parser.add_argument('--state-overlay',
+                        help='Keep the state computed by each transaction '
+                             'in memory, and only write the state of the '
+                             'blocks which are committed',
+                        action='store_true')
+    parser.add_argument('--compact-database',
+                        help='Reclaim the free pages of the database file '
+                             'before starting, by replacing it with a '
+                             'compacted copy',
+                        action='store_true')
+    parser.add_argument('--context-readers',
+                        help='The number of threads reading the state the '
+                             'transactions being executed depend on',
+                        type=int,
+                        default=DEFAULT_READER_THREADS)
+    parser.add_argument('--scheduler',
+                        help='How the transactions of a block are '
+                             'scheduled: serial executes them one at a '
+                             'time, parallel executes those which do not '
+                             'conflict concurrently, with the same results',
+                        choices=SCHEDULERS,
+                        default=SERIAL_SCHEDULER)
     parser.add_argument('-v', '--verbose',
                         action='count',
                         default=0,
@@ -53,7 +98,14 @@ def main(args=sys.argv[1:]):
 
     validator = Validator(opts.network_endpoint,
                           opts.component_endpoint,
-                          opts.peers)
+                          opts.peers,
+                          node_format=opts.state_node_format,
+                          compress_paths=opts.compress_state_paths,
+                          write_behind=opts.state_write_behind,
+                          compact_database=opts.compact_database,
+                          context_readers=opts.context_readers,
+                          state_overlay=opts.state_overlay,
+                          scheduler_type=opts.scheduler)
 
     try:
         validator.start()
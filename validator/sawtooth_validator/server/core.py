@@ -21,10 +21,17 @@ import os
 import time
 
 from sawtooth_validator.execution.context_manager import ContextManager
-from sawtooth_validator.database.lmdb_nolock_database import LMDBNoLockDatabase
+from sawtooth_validator.execution.context_manager import \
+    DEFAULT_READER_THREADS
+from sawtooth_validator.database.database import CachedDatabase
+from sawtooth_validator.database.lmdb_nolock_database import DURABILITY_BLOCK
+from sawtooth_validator.database.lmdb_nolock_database import compact_file
+from sawtooth_validator.database.lmdb_nolock_database import LMDBEnvironment
+from sawtooth_validator.database.lmdb_nolock_database import STATE_DATABASE
 from sawtooth_validator.journal.consensus.dev_mode import dev_mode_consensus
 from sawtooth_validator.journal.genesis import GenesisController
 from sawtooth_validator.journal.journal import Journal
+from sawtooth_validator.journal.lmdb_block_store import LMDBBlockStore
 from sawtooth_validator.protobuf import validator_pb2
 from sawtooth_validator.execution import tp_state_handlers
 from sawtooth_validator.journal.completer import CompleterGossipHandler
@@ -33,10 +40,17 @@ from sawtooth_validator.journal.completer import \
 from sawtooth_validator.journal.completer import Completer
 from sawtooth_validator.networking.dispatch import Dispatcher
 from sawtooth_validator.journal.block_sender import BroadcastBlockSender
+from sawtooth_validator.execution.executor import SERIAL_SCHEDULER
 from sawtooth_validator.execution.executor import TransactionExecutor
 from sawtooth_validator.execution.processor_handlers import \
     ProcessorRegisterHandler
 from sawtooth_validator.state import client_handlers
+from sawtooth_validator.state.node_cache import NodeCache
+from sawtooth_validator.state.node_codec import CBOR_NODE_FORMAT
+from sawtooth_validator.state.pruner import DEFAULT_RETAINED_BLOCKS
+from sawtooth_validator.state.pruner import PrunableDatabase
+from sawtooth_validator.state.pruner import StatePruner
+from sawtooth_validator.state.write_behind import WriteBehindDatabase
 from sawtooth_validator.gossip import signature_verifier
 from sawtooth_validator.networking.interconnect import Interconnect
 from sawtooth_validator.gossip.gossip import Gossip
@@ -50,23 +64,57 @@ LOGGER = logging.getLogger(__name__)
 
 
 class Validator(object):
-    def __init__(self, network_endpoint, component_endpoint, peer_list):
+    def __init__(self, network_endpoint, component_endpoint, peer_list,
+                 node_format=CBOR_NODE_FORMAT, compress_paths=False,
+                 write_behind=False, compact_database=False,
+                 context_readers=DEFAULT_READER_THREADS,
+                 state_overlay=False, scheduler_type=SERIAL_SCHEDULER):
         data_dir = os.path.expanduser('~')
         db_filename = os.path.join(data_dir,
-                                   'merkle-{}.lmdb'.format(
+                                   'validator-{}.lmdb'.format(
                                        network_endpoint[-2:]))
         LOGGER.debug('database file is %s', db_filename)
+        if compact_database and os.path.isfile(db_filename):
+            self._compact_database(db_filename)
+
+        # the state and the blocks are named databases of a single file, so
+        # that a block, the chain head and the state they refer to are
+        # committed and flushed to disk together. State is made durable when
+        # a block is committed, so the many writes made while executing the
+        # transactions of a block do not each wait for a flush to disk.
+        # the file is kept across restarts, and may hold an imported state
+        # snapshot
+        self._lmdb_env = LMDBEnvironment(db_filename, 'c',
+                                         durability=DURABILITY_BLOCK)
+        lmdb = self._lmdb_env.open_database(STATE_DATABASE, raw=True)
+        # encoded merkle nodes, for the readers which miss the node cache
+        self._state_cache = CachedDatabase(lmdb)
+        # with write-behind, the executor does not wait for the disk on its
+        # writes; blocks wait for it before their commit, so the client state
+        # handlers, which read the state of committed blocks, read through
+        # the cache only
+        self._state_writer = None
+        nodes_db = self._state_cache
+        if write_behind:
+            self._state_writer = WriteBehindDatabase(self._state_cache)
+            nodes_db = self._state_writer
+        # state written through this wrapper is safe from concurrent pruning
+        state_db = PrunableDatabase(nodes_db)
+        # decoded merkle nodes are shared by the executor and the client
+        # state handlers
+        node_cache = NodeCache()
+        # the process pool is shared by signature verification and the
+        # hashing of large state updates
+        process_pool = ProcessPoolExecutor(max_workers=3)
+        context_manager = ContextManager(state_db,
+                                         node_cache=node_cache,
+                                         hash_executor=process_pool,
+                                         node_format=node_format,
+                                         compress_paths=compress_paths,
+                                         reader_threads=context_readers,
+                                         state_overlay=state_overlay)
 
-        lmdb = LMDBNoLockDatabase(db_filename, 'n')
-        context_manager = ContextManager(lmdb)
-
-        block_db_filename = os.path.join(data_dir, 'block.lmdb')
-        LOGGER.debug('block store file is %s', block_db_filename)
-        block_store = {}
-        # block_store = LMDBNoLockDatabase(block_db_filename, 'n')
-        block_store = {}
-        # this is not currently being used but will be something like this
-        # in the future, when Journal takes a block_store that isn't a dict
+        block_store = LMDBBlockStore(self._lmdb_env)
 
         # setup network
         self._dispatcher = Dispatcher()
@@ -74,7 +122,6 @@ class Validator(object):
         completer = Completer(block_store)
 
         thread_pool = ThreadPoolExecutor(max_workers=10)
-        process_pool = ProcessPoolExecutor(max_workers=3)
 
         self._dispatcher.add_handler(
             validator_pb2.Message.TP_STATE_GET_REQUEST,
@@ -88,16 +135,19 @@ class Validator(object):
 
         self._dispatcher.add_handler(
             validator_pb2.Message.CLIENT_STATE_GET_REQUEST,
-            client_handlers.StateGetRequestHandler(lmdb),
+            client_handlers.StateGetRequestHandler(self._state_cache,
+                                                   node_cache),
             thread_pool)
 
         self._dispatcher.add_handler(
             validator_pb2.Message.CLIENT_STATE_LIST_REQUEST,
-            client_handlers.StateListRequestHandler(lmdb),
+            client_handlers.StateListRequestHandler(self._state_cache,
+                                                    node_cache),
             thread_pool)
 
         self._service = Interconnect(component_endpoint, self._dispatcher)
-        executor = TransactionExecutor(self._service, context_manager)
+        executor = TransactionExecutor(self._service, context_manager,
+                                       scheduler_type=scheduler_type)
 
         self._dispatcher.add_handler(
             validator_pb2.Message.TP_REGISTER_REQUEST,
@@ -161,14 +211,20 @@ class Validator(object):
             block_store=block_store,
             block_sender=block_sender,
             transaction_executor=executor,
-            squash_handler=context_manager.get_squash_handler())
+            squash_handler=context_manager.get_squash_handler(),
+            on_block_committed=self._on_block_committed,
+            state_barrier=self._write_state)
+
+        self._context_manager = context_manager
+        self._state_pruner = StatePruner(state_db, self._get_retained_roots)
 
         self._genesis_controller = GenesisController(
             context_manager=context_manager,
             transaction_executor=executor,
             completer=completer,
             block_store=block_store,
-            data_dir=data_dir
+            data_dir=data_dir,
+            state_barrier=self._write_state
         )
 
         completer.set_on_batch_received(self._journal.on_batch_received)
@@ -186,12 +242,26 @@ class Validator(object):
 
         self._dispatcher.add_handler(
             validator_pb2.Message.CLIENT_STATE_GET_REQUEST,
-            client_handlers.StateGetRequestHandler(lmdb),
+            client_handlers.StateGetRequestHandler(self._state_cache,
+                                                   node_cache),
             thread_pool)
 
         self._dispatcher.add_handler(
             validator_pb2.Message.CLIENT_STATE_LIST_REQUEST,
-            client_handlers.StateListRequestHandler(lmdb),
+            client_handlers.StateListRequestHandler(self._state_cache,
+                                                    node_cache),
+            thread_pool)
+
+        self._dispatcher.add_handler(
+            validator_pb2.Message.CLIENT_STATE_DIFF_REQUEST,
+            client_handlers.StateDiffRequestHandler(self._state_cache,
+                                                    node_cache),
+            thread_pool)
+
+        self._dispatcher.add_handler(
+            validator_pb2.Message.CLIENT_STATE_PROOF_REQUEST,
+            client_handlers.StateProofRequestHandler(self._state_cache,
+                                                     node_cache),
             thread_pool)
 
         self._dispatcher.add_handler(
@@ -209,6 +279,42 @@ class Validator(object):
             client_handlers.StateCurrentRequestHandler(
                 self._journal.get_current_root), thread_pool)
 
+    @staticmethod
+    def _compact_database(db_filename):
+        # the file is not open yet, so it can be replaced by its copy
+        start = time.time()
+        size, compacted_size = compact_file(db_filename)
+        LOGGER.info('Compacted %s from %s to %s bytes in %.1fs, reclaiming '
+                    '%s bytes', db_filename, size, compacted_size,
+                    time.time() - start, size - compacted_size)
+
+    def _write_state(self, state_roots):
+        # the states kept in memory are written, and then the writes still
+        # queued, before the blocks are committed
+        for state_root in state_roots:
+            self._context_manager.flush_state(state_root)
+        if self._state_writer is not None:
+            self._state_writer.barrier()
+
+    def _on_block_committed(self, block):
+        # the block store flushed the block, and the state before it
+        LOGGER.debug("Database writes after block %s: %s",
+                     block, self._lmdb_env.metrics)
+        LOGGER.debug("State cache after block %s: %s",
+                     block, self._state_cache.metrics)
+        LOGGER.debug("Context value cache after block %s: %s",
+                     block, self._context_manager.value_cache.metrics)
+        LOGGER.debug("Context prefetch after block %s: %s",
+                     block, self._context_manager.prefetch_metrics)
+        LOGGER.debug("Contexts after block %s: %s",
+                     block, self._context_manager.context_metrics)
+        if self._context_manager.overlay_metrics is not None:
+            LOGGER.debug("State overlay after block %s: %s",
+                         block, self._context_manager.overlay_metrics)
+        if self._state_writer is not None:
+            LOGGER.debug("State write-behind after block %s: %s",
+                         block, self._state_writer.metrics)
+
     def start(self):
         self._dispatcher.start()
         self._service.start()
@@ -222,8 +328,20 @@ class Validator(object):
         self._network.start(daemon=True)
         self._gossip.start()
         self._journal.start()
+        self._state_pruner.start()
+
+    def _get_retained_roots(self):
+        # the roots of the recent blocks, and those still in use by the
+        # scheduler and the publisher
+        roots = self._journal.get_state_roots(DEFAULT_RETAINED_BLOCKS)
+        roots.update(self._context_manager.collect_in_flight_roots())
+        return roots
 
     def stop(self):
         self._service.stop()
         self._network.stop()
         self._journal.stop()
+        self._state_pruner.stop()
+        if self._state_writer is not None:
+            self._state_writer.stop()
+        self._lmdb_env.sync()
@@ -13,6 +13,8 @@
 # limitations under the License.
 # ------------------------------------------------------------------------------
 
+from contextlib import contextmanager
+from itertools import islice
 import logging
 # pylint: disable=import-error,no-name-in-module
 # needed for google.protobuf import
@@ -32,6 +34,17 @@ from sawtooth_validator.protobuf import validator_pb2
 LOGGER = logging.getLogger(__name__)
 
 
+@contextmanager
+def _pinned_tree(database, merkle_root, node_cache):
+    """Opens a MerkleDatabase on a state root for the duration of a query.
+    Each query has its own tree, as concurrent queries read different roots,
+    and all its reads run within a single read transaction of the database.
+    The decoded nodes are shared between queries through the node cache.
+    """
+    with database.read_txn() as snapshot:
+        yield MerkleDatabase(snapshot, merkle_root, node_cache=node_cache)
+
+
 class StateCurrentRequestHandler(Handler):
     def __init__(self, current_root_func):
         self._current_root_func = current_root_func
@@ -61,17 +74,31 @@ class StateCurrentRequestHandler(Handler):
 
 
 class StateListRequestHandler(Handler):
-    def __init__(self, database):
-        self._tree = MerkleDatabase(database)
+    def __init__(self, database, node_cache=None):
+        self._database = database
+        self._node_cache = node_cache
 
     def handle(self, identity, message_content):
         request = client_pb2.ClientStateListRequest()
         resp_proto = client_pb2.ClientStateListResponse
         status = resp_proto.OK
+        page, rest = [], []
 
         try:
             request.ParseFromString(message_content)
-            self._tree.set_merkle_root(request.merkle_root)
+            with _pinned_tree(self._database, request.merkle_root,
+                              self._node_cache) as tree:
+                # the leaves are read lazily, so a missing node may only be
+                # found while they are consumed
+                leaves = tree.iter_leaves(request.prefix, request.start)
+                if request.limit:
+                    # one more leaf than requested gives the next page's
+                    # start
+                    leaves = list(islice(leaves, request.limit + 1))
+                    page = leaves[:request.limit]
+                    rest = leaves[request.limit:]
+                else:
+                    page = list(leaves)
         except KeyError as e:
             status = resp_proto.NORESOURCE
             LOGGER.debug(e)
@@ -80,18 +107,16 @@ class StateListRequestHandler(Handler):
             LOGGER.info("Expected protobuf of class %s failed to "
                         "deserialize", request)
 
+        if status == resp_proto.OK and len(page) == 0:
+            status = resp_proto.NORESOURCE
+
         if status != resp_proto.OK:
             response = resp_proto(status=status)
         else:
-            prefix = request.prefix
-            leaves = self._tree.leaves(prefix)
-
-            if len(leaves) == 0:
-                status = resp_proto.NORESOURCE
-                response = resp_proto(status=status)
-            else:
-                entries = [Entry(address=a, data=v) for a, v in leaves.items()]
-                response = resp_proto(status=status, entries=entries)
+            entries = [Entry(address=a, data=v) for a, v in page]
+            response = resp_proto(status=status, entries=entries)
+            if rest:
+                response.next = rest[0][0]
 
         return HandlerResult(
             status=HandlerStatus.RETURN,
@@ -99,9 +124,60 @@ class StateListRequestHandler(Handler):
             message_type=validator_pb2.Message.CLIENT_STATE_LIST_RESPONSE)
 
 
+class StateDiffRequestHandler(Handler):
+    def __init__(self, database, node_cache=None):
+        self._database = database
+        self._node_cache = node_cache
+
+    def handle(self, identity, message_content):
+        request = client_pb2.ClientStateDiffRequest()
+        resp_proto = client_pb2.ClientStateDiffResponse
+        change_proto = client_pb2.ClientStateChange
+        status = resp_proto.OK
+        changes = []
+
+        try:
+            request.ParseFromString(message_content)
+            with _pinned_tree(self._database, request.old_merkle_root,
+                              self._node_cache) as tree:
+                for address, old, new in tree.diff(request.old_merkle_root,
+                                                   request.new_merkle_root,
+                                                   request.prefix):
+                    if old is None:
+                        changes.append(change_proto(
+                            address=address, type=change_proto.ADDED,
+                            new_data=new))
+                    elif new is None:
+                        changes.append(change_proto(
+                            address=address, type=change_proto.DELETED,
+                            old_data=old))
+                    else:
+                        changes.append(change_proto(
+                            address=address, type=change_proto.MODIFIED,
+                            old_data=old, new_data=new))
+        except KeyError as e:
+            status = resp_proto.NORESOURCE
+            LOGGER.debug(e)
+        except DecodeError:
+            status = resp_proto.ERROR
+            LOGGER.info("Expected protobuf of class %s failed to "
+                        "deserialize", request)
+
+        if status != resp_proto.OK:
+            response = resp_proto(status=status)
+        else:
+            response = resp_proto(status=status, changes=changes)
+
+        return HandlerResult(
+            status=HandlerStatus.RETURN,
+            message_out=response,
+            message_type=validator_pb2.Message.CLIENT_STATE_DIFF_RESPONSE)
+
+
 class StateGetRequestHandler(Handler):
-    def __init__(self, database):
-        self._tree = MerkleDatabase(database)
+    def __init__(self, database, node_cache=None):
+        self._database = database
+        self._node_cache = node_cache
 
     def handle(self, identity, message_content):
         request = client_pb2.ClientStateGetRequest()
@@ -110,7 +186,53 @@ class StateGetRequestHandler(Handler):
 
         try:
             request.ParseFromString(message_content)
-            self._tree.set_merkle_root(request.merkle_root)
+            with _pinned_tree(self._database, request.merkle_root,
+                              self._node_cache) as tree:
+                try:
+                    value = tree.get(request.address)
+                except KeyError:
+                    status = resp_proto.NORESOURCE
+                    LOGGER.debug("No entry at state address %s",
+                                 request.address)
+                except ValueError:
+                    status = resp_proto.NONLEAF
+                    LOGGER.debug("Node at state address %s is a nonleaf",
+                                 request.address)
+        except KeyError as e:
+            status = resp_proto.NORESOURCE
+            LOGGER.debug(e)
+        except DecodeError:
+            status = resp_proto.ERROR
+            LOGGER.info("Expected protobuf of class %s failed to "
+                        "deserialize", request)
+
+        response = resp_proto(status=status)
+        if status == resp_proto.OK:
+            response.value = value
+
+        return HandlerResult(
+            status=HandlerStatus.RETURN,
+            message_out=response,
+            message_type=validator_pb2.Message.CLIENT_STATE_GET_RESPONSE)
+
+
+class StateProofRequestHandler(Handler):
+    def __init__(self, database, node_cache=None):
+        self._database = database
+        self._node_cache = node_cache
+
+    def handle(self, identity, message_content):
+        request = client_pb2.ClientStateProofRequest()
+        resp_proto = client_pb2.ClientStateProofResponse
+        status = resp_proto.OK
+        value = None
+        proof = []
+
+        try:
+            request.ParseFromString(message_content)
+            with _pinned_tree(self._database, request.merkle_root,
+                              self._node_cache) as tree:
+                value, proof = tree.get_value_and_proof(request.address)
         except KeyError as e:
             status = resp_proto.NORESOURCE
             LOGGER.debug(e)
@@ -122,24 +244,14 @@ class StateGetRequestHandler(Handler):
         if status != resp_proto.OK:
             response = resp_proto(status=status)
         else:
-            address = request.address
-            try:
-                value = self._tree.get(address)
-            except KeyError:
-                status = resp_proto.NORESOURCE
-                LOGGER.debug("No entry at state address %s", address)
-            except ValueError:
-                status = resp_proto.NONLEAF
-                LOGGER.debug("Node at state address %s is a nonleaf", address)
-
-            response = resp_proto(status=status)
-            if status == resp_proto.OK:
+            response = resp_proto(status=status, proof=proof)
+            if value is not None:
                 response.value = value
 
         return HandlerResult(
             status=HandlerStatus.RETURN,
             message_out=response,
-            message_type=validator_pb2.Message.CLIENT_STATE_GET_RESPONSE)
+            message_type=validator_pb2.Message.CLIENT_STATE_PROOF_RESPONSE)
 
 
 class BlockListRequestHandler(Handler):
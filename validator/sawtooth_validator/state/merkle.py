@@ -13,11 +13,15 @@
 # limitations under the License.
 # ------------------------------------------------------------------------------
 
-import copy
+from functools import partial
 import logging
 import hashlib
 import cbor
 
+from sawtooth_validator.state.node_codec import CBOR_NODE_FORMAT
+from sawtooth_validator.state.node_codec import decode_node
+from sawtooth_validator.state.node_codec import encode_node
+
 LOGGER = logging.getLogger(__name__)
 
 INIT_ROOT_KEY = ''
@@ -29,31 +33,171 @@ NODE_PROTO = {"v": None,
 
 TOKEN_SIZE = 2
 
+# the minimum number of addresses in an update before dirty subtrees are
+# hashed with the hash executor, and the number of subtrees to aim for
+PARALLEL_HASH_THRESHOLD = 1000
+PARALLEL_HASH_SUBTREES = 16
+
+
+def _encode(value):
+    return cbor.dumps(value, sort_keys=True)
+
+
+def _child_label(children, path):
+    """Returns the label of the child edge which path may continue on, or
+    None. The caller checks that the label actually matches path.
+
+    Sibling edges always start with distinct tokens. Edges are a single
+    token long, unless the trie is path compressed.
+    """
+    token = path[:TOKEN_SIZE]
+    if token in children:
+        return token
+    for label in children:
+        if label.startswith(token):
+            return label
+    return None
+
+
+def _common_prefix(label, path):
+    """Returns the longest common prefix of label and path which is made of
+    whole tokens.
+    """
+    length = 0
+    for label_char, path_char in zip(label, path):
+        if label_char != path_char:
+            break
+        length += 1
+    return label[:length - length % TOKEN_SIZE]
+
+
+def _hash_dirty_node(node, batch, node_format):
+    """Encodes and hashes a node of an update overlay, after recursively
+    doing the same for its dirty children, and replaces the dirty children
+    with their hashes. The (hash, encoded node) pairs are appended to batch.
+
+    Returns:
+        str: the hash of the node
+    """
+    children = node['c']
+    for token, child in children.items():
+        if isinstance(child, dict):
+            children[token] = _hash_dirty_node(child, batch, node_format)
+
+    packed = encode_node(node, node_format)
+    key_hash = MerkleDatabase.hash(packed)
+    batch.append((key_hash, packed))
+    return key_hash
+
+
+def _hash_dirty_subtree(node, node_format=CBOR_NODE_FORMAT):
+    """Hashes a subtree of an update overlay. This is a module level function
+    so that it can be run by a process pool.
+
+    Returns:
+        tuple: the hash of the subtree root and the list of
+            (hash, encoded node) pairs for the subtree
+    """
+    batch = []
+    key_hash = _hash_dirty_node(node, batch, node_format)
+    return key_hash, batch
+
 
 class MerkleDatabase(object):
-    def __init__(self, database, merkle_root=INIT_ROOT_KEY):
+    def __init__(self, database, merkle_root=INIT_ROOT_KEY, node_cache=None,
+                 hash_executor=None, node_format=CBOR_NODE_FORMAT,
+                 compress_paths=False):
+        """
+
+        Args:
+            database (database.Database): the store of the encoded nodes
+            merkle_root (str): the hash of the root node
+            node_cache (NodeCache): an optional cache of decoded nodes,
+                which may be shared between MerkleDatabase instances
+            hash_executor (concurrent.futures.Executor): an optional
+                executor, typically a process pool, used to hash the
+                subtrees of large updates concurrently
+            node_format (str): the format new nodes are written in, one of
+                node_codec.NODE_FORMATS. Nodes in any format can be read.
+            compress_paths (bool): whether chains of single child nodes are
+                collapsed into a single edge when writing, so that a leaf
+                sits a handful of nodes below the root instead of one node
+                per token. Tries in either mode can be read, but a trie
+                should always be written in the same mode, as the roots of
+                the two modes differ.
+        """
         self._database = database
+        self._node_cache = node_cache
+        self._hash_executor = hash_executor
+        self._node_format = node_format
+        self._compress_paths = compress_paths
         self.set_merkle_root(merkle_root)
 
     def __iter__(self):
-        for item in self._yield_iter('', self._root_hash):
+        for item in self._yield_iter(''):
             yield item
 
-    def _yield_iter(self, path, hash_key):
+    def _yield_iter(self, prefix, start=''):
         try:
-            node = self._get_by_addr(path)
+            subtrees = self._find_subtrees(prefix)
         except KeyError:
-            raise StopIteration()
+            return
 
-        if path == INIT_ROOT_KEY:
-            node = self._get_by_hash(hash_key)
+        for path, node in subtrees:
+            for item in self._yield_subtree(path, node, start):
+                yield item
 
-        if node["v"] is not None:
+    def _yield_subtree(self, path, node, start=''):
+        if node["v"] is not None and path >= start:
             yield (path, self._decode(node["v"]))
 
-        for child in node["c"]:
-            for value in self._yield_iter(path + child, node["c"][child]):
-                yield value
+        for label in sorted(node["c"]):
+            child_path = path + label
+            # every address below the child sorts before start
+            if child_path < start and not start.startswith(child_path):
+                continue
+            for item in self._yield_subtree(
+                    child_path, self._get_by_hash(node["c"][label]), start):
+                yield item
+
+    def iter_leaves(self, prefix='', start=''):
+        """Lazily yields the values under a prefix, in address order. Only
+        the nodes on the path to start, and those of the addresses actually
+        consumed, are read.
+
+        Args:
+            prefix (str): the prefix of the addresses to yield
+            start (str): the first address to yield, when present. Subtrees
+                whose addresses all sort before start are skipped.
+
+        Yields:
+            tuple: (address, value)
+        """
+        for item in self._yield_iter(prefix, start):
+            yield item
+
+    def _find_subtrees(self, prefix):
+        """Returns the paths and the nodes of the shallowest nodes whose
+        paths start with prefix, in path order. In a path compressed trie
+        the prefix may end in the middle of an edge. A prefix ending in the
+        middle of a token may match several child edges.
+        """
+        node = self._root_node
+        path = ''
+        while len(path) < len(prefix):
+            rest = prefix[len(path):]
+            if len(rest) < TOKEN_SIZE:
+                return [(path + label, self._get_by_hash(node['c'][label]))
+                        for label in sorted(node['c'])
+                        if label.startswith(rest)]
+            label = _child_label(node['c'], rest)
+            if label is None or not (rest.startswith(label) or
+                                     label.startswith(rest)):
+                raise KeyError("invalid prefix {} "
+                               "from root {}".format(prefix, self._root_hash))
+            path += label
+            node = self._get_by_hash(node['c'][label])
+        return [(path, node)]
 
     def get_merkle_root(self):
         return self._root_hash
@@ -71,17 +215,104 @@ class MerkleDatabase(object):
         return hashlib.sha512(stuff).hexdigest()[:64]
 
     def _get_by_hash(self, key_hash):
-        if key_hash in self._database:
-            return self._decode(self._database.get(key_hash))
-        else:
+        if self._node_cache is not None:
+            node = self._node_cache.get(key_hash)
+            if node is not None:
+                return node
+
+        packed = self._database.get(key_hash)
+        if packed is None:
             raise KeyError("hash {} not found in database".format(key_hash))
 
+        node = self._decode_node(packed)
+        if self._node_cache is not None:
+            self._node_cache.put(key_hash, node, len(packed))
+        return node
+
+    def _get_many_by_hash(self, key_hashes):
+        """Returns a dict of hash to decoded node for the given hashes. The
+        nodes which are not cached are read with a single batch read.
+        """
+        nodes = {}
+        missing = []
+        for key_hash in key_hashes:
+            node = None
+            if self._node_cache is not None:
+                node = self._node_cache.get(key_hash)
+            if node is not None:
+                nodes[key_hash] = node
+            else:
+                missing.append(key_hash)
+
+        if missing:
+            # the nodes are decoded within a single read, from buffers of the
+            # database rather than copies
+            with self._database.read_txn() as txn:
+                for key_hash in missing:
+                    packed = txn.get(key_hash)
+                    if packed is None:
+                        continue
+                    node = self._decode_node(packed)
+                    if self._node_cache is not None:
+                        self._node_cache.put(key_hash, node, len(packed))
+                    nodes[key_hash] = node
+
+            if len(nodes) != len(key_hashes):
+                raise KeyError("hashes {} not found in database".format(
+                    [h for h in missing if h not in nodes]))
+
+        return nodes
+
+    @staticmethod
+    def _copy_node(node):
+        # nodes may be shared through the node cache, so they are copied
+        # before being modified
+        return {"v": node["v"], "c": dict(node["c"])}
+
     def __getitem__(self, address):
         return self.get(address)
 
     def get(self, address):
         return self._decode(self.get_node(address).get('v'))
 
+    def get_many(self, addresses):
+        """Retrieves the values of several addresses at once.
+
+        The addresses are walked down the trie together, one level at a
+        time, so the nodes on a prefix shared by several addresses are only
+        read once, and the nodes needed at each level are fetched with a
+        single batch read.
+
+        Args:
+            addresses (list): the addresses to retrieve
+
+        Returns:
+            dict: address to value, for the addresses which have a value
+        """
+        values = {}
+        # (address, position in the address, node) still being walked
+        walking = [(address, 0, self._root_node)
+                   for address in sorted(set(addresses))]
+        while walking:
+            next_hashes = []
+            for address, position, node in walking:
+                if position >= len(address):
+                    if node['v'] is not None:
+                        values[address] = self._decode(node['v'])
+                    continue
+
+                rest = address[position:]
+                label = _child_label(node['c'], rest)
+                if label is not None and rest.startswith(label):
+                    next_hashes.append((address, position + len(label),
+                                        node['c'][label]))
+
+            nodes = self._get_many_by_hash({h for _, _, h in next_hashes})
+            walking = [(address, position, nodes[h])
+                       for address, position, h in next_hashes]
+
+        return values
+
     def get_node(self, address):
         return self._get_by_addr(address)
 
@@ -91,86 +322,87 @@ class MerkleDatabase(object):
     def set(self, address, value):
         return self._set_by_addr(address, value)
 
-    def _tokenize_address(self, address):
-        return [address[i:i + TOKEN_SIZE]
-                for i in range(0, len(address), TOKEN_SIZE)]
-
     def _get_by_addr(self, address):
-        tokens = self._tokenize_address(address)
-
         node = self._root_node
-
-        for token in tokens:
-            if token in node['c']:
-                node = self._get_by_hash(node['c'][token])
-            else:
+        rest = address
+        while rest:
+            label = _child_label(node['c'], rest)
+            if label is None or not rest.startswith(label):
                 raise KeyError("invalid address {} "
                                "from root {}".format(address,
                                                      self._root_hash))
+            node = self._get_by_hash(node['c'][label])
+            rest = rest[len(label):]
         return node
 
-    def _get_path_by_addr(self, address, return_empty=False):
-        tokens = self._tokenize_address(address)
-        node = copy.deepcopy(self._root_node)
-        path = ''
-        nodes = {}
-
-        nodes[path] = node
-        new_branch = False
-
-        for token in tokens:
-            if token in node['c'] and not new_branch:
-                path = path + token
-                node = self._get_by_hash(node['c'][token])
-                nodes[path] = node
-            else:
-                if return_empty:
-                    path = path + token
-                    nodes[path] = {"v": None, "c": {}}
-                    new_branch = True
-                else:
-                    raise KeyError("invalid address {} "
-                                   "from root {}".format(address,
-                                                         self._root_hash))
-        return nodes
-
     def _decode(self, encoded):
         return cbor.loads(encoded)
 
     def _encode(self, value):
-        return cbor.dumps(value, sort_keys=True)
+        return _encode(value)
+
+    @staticmethod
+    def _decode_node(packed):
+        return decode_node(packed)
 
-    def _encode_and_hash(self, value):
-        packed = self._encode(value)
-        return (MerkleDatabase.hash(packed), packed)
+    def _encode_node(self, node):
+        return encode_node(node, self._node_format)
 
     def delete(self, address):
-        path_map = self._get_path_by_addr(address)
+        """Removes the value of an address, along with the nodes left
+        without a value or children. In a path compressed trie, a node left
+        with a single child and no value is merged into its parent edge.
 
-        batch = []
-        leaf_branch = True
-        for path in sorted(path_map, key=len, reverse=True):
-            parent_address = path[:-TOKEN_SIZE]
-            path_branch = path[-TOKEN_SIZE:]
-
-            if len(path_map[path]['c']) > 0 or path == '':
-                leaf_branch = False
-
-            if not leaf_branch:
-                (hash_key, packed) = self._encode_and_hash(path_map[path])
-                batch.append((hash_key, packed))
-                if path != '':
-                    path_map[parent_address]['c'][path_branch] = hash_key
-            else:
-                if path != '':
-                    del path_map[parent_address]['c'][path_branch]
+        Returns:
+            str: the new state root
 
-        self._database.set_batch(batch)
+        Raises:
+            KeyError: if there is no node at the address
+        """
+        root = self._copy_node(self._root_node)
+        # (parent, label) of each node on the path to the address
+        edges = []
+        node = root
+        rest = address
+        while rest:
+            label = _child_label(node['c'], rest)
+            if label is None or not rest.startswith(label):
+                raise KeyError("invalid address {} "
+                               "from root {}".format(address,
+                                                     self._root_hash))
+            child = self._copy_node(self._get_by_hash(node['c'][label]))
+            node['c'][label] = child
+            edges.append((node, label))
+            node = child
+            rest = rest[len(label):]
+
+        node['v'] = None
+        for parent, label in reversed(edges):
+            child = parent['c'][label]
+            if child['v'] is not None:
+                break
+            if not child['c']:
+                del parent['c'][label]
+                continue
+            if self._compress_paths and len(child['c']) == 1:
+                (child_label, grandchild), = child['c'].items()
+                del parent['c'][label]
+                parent['c'][label + child_label] = grandchild
+            break
 
-        return hash_key
+        batch = []
+        key_hash = _hash_dirty_node(root, batch, self._node_format)
+        self._database.set_batch(batch)
+        return key_hash
 
     def update(self, set_items, virtual=True):
-        """
+        """Sets the values of several addresses, returning the new root.
+
+        The modified part of the trie is first built in memory as an overlay
+        of dirty nodes over the existing trie. The dirty nodes are then
+        encoded and hashed bottom-up, each exactly once. When a hash
+        executor was given and enough addresses are updated, disjoint dirty
+        subtrees are hashed concurrently by the executor.
 
         Args:
             set_items (dict): dict key, values where keys are addresses
@@ -179,73 +411,125 @@ class MerkleDatabase(object):
         Returns:
             the state root after the operations
         """
-        path_map = {}
-        batch = []
-
-        for set_address in set_items:
-            path_map.update(self._get_path_by_addr(set_address,
-                                                   return_empty=True))
-            path_map[set_address]["v"] = self._encode(set_items[set_address])
+        root = self._copy_node(self._root_node)
+        for address, value in set_items.items():
+            node = root
+            rest = address
+            while rest:
+                label = _child_label(node['c'], rest)
+                if label is None:
+                    # a new branch, which is a single edge in a path
+                    # compressed trie
+                    label = rest if self._compress_paths \
+                        else rest[:TOKEN_SIZE]
+                    child = {"v": None, "c": {}}
+                    node['c'][label] = child
+                elif not rest.startswith(label):
+                    # the address leaves a compressed edge part way, so the
+                    # edge is split at a new branch node
+                    common = _common_prefix(label, rest)
+                    child = {"v": None, "c": {label[len(common):]:
+                                              node['c'].pop(label)}}
+                    label = common
+                    node['c'][label] = child
+                else:
+                    child = node['c'][label]
+                    if not isinstance(child, dict):
+                        child = self._copy_node(self._get_by_hash(child))
+                        node['c'][label] = child
+                node = child
+                rest = rest[len(label):]
+            node['v'] = self._encode(value)
 
-        # Rebuild the hashes to the new root
-        for path in sorted(path_map, key=len, reverse=True):
-            (key_hash, packed) = self._encode_and_hash(path_map[path])
-            batch.append((key_hash, packed))
-            if path != '':
-                parent_address = path[:-TOKEN_SIZE]
-                path_branch = path[-TOKEN_SIZE:]
-                path_map[parent_address]['c'][path_branch] = key_hash
+        batch = []
+        if self._hash_executor is not None and \
+                len(set_items) >= PARALLEL_HASH_THRESHOLD:
+            self._hash_subtrees_in_parallel(root, batch)
+        key_hash = _hash_dirty_node(root, batch, self._node_format)
 
         if not virtual:
             # Apply all new hash, value pairs to the database
             self._database.set_batch(batch)
         return key_hash
 
+    def _hash_subtrees_in_parallel(self, root, batch):
+        """Hashes disjoint dirty subtrees of the overlay with the hash
+        executor, replacing each of them by its hash in its parent.
+        """
+        # Descend from the root until there are enough dirty subtrees to
+        # keep the executor busy. Addresses share namespace prefixes, so
+        # the top levels of the overlay usually have a single dirty child.
+        frontier = [(None, None, root)]
+        expanded = True
+        while expanded and len(frontier) < PARALLEL_HASH_SUBTREES:
+            expanded = False
+            next_frontier = []
+            for parent, token, node in frontier:
+                dirty = [(node, t, c) for t, c in node['c'].items()
+                         if isinstance(c, dict)]
+                if dirty:
+                    next_frontier.extend(dirty)
+                    expanded = True
+                else:
+                    next_frontier.append((parent, token, node))
+            frontier = next_frontier
+
+        frontier = [entry for entry in frontier if entry[0] is not None]
+        subtrees = [node for _, _, node in frontier]
+        results = self._hash_executor.map(
+            partial(_hash_dirty_subtree, node_format=self._node_format),
+            subtrees)
+        for (parent, token, _), (key_hash, subtree_batch) in zip(frontier,
+                                                                 results):
+            parent['c'][token] = key_hash
+            batch.extend(subtree_batch)
+
     def _set_by_addr(self, address, value):
-        tokens = self._tokenize_address(address)
-        path_addresses = [''.join(tokens[0:i]) for i in range(len(tokens),
-                                                              0,
-                                                              -1)]
+        return self.update({address: value}, virtual=False)
 
-        path_map = self._get_path_by_addr(address, return_empty=True)
+    def _set_kv(self, node):
+        packed = self._encode_node(node)
+        hashed_key = MerkleDatabase.hash(packed)
+        self._database.set(hashed_key, packed)
+        return hashed_key
 
-        # Set the value in the leaf node
-        path_map[path_addresses[0]]["v"] = self._encode(value)
+    def migrate(self, node_format, batch_size=10000):
+        """Re-encodes every node reachable from the current root in another
+        node format and writes them to the database. Node hashes depend on
+        the format, so the migrated trie has a different root; the nodes of
+        the current trie are left in place.
 
-        child = path_map[path_addresses[0]]
+        Args:
+            node_format (str): the format to re-encode the nodes in
+            batch_size (int): the number of nodes written per batch
 
+        Returns:
+            str: the root of the migrated trie
+        """
+        migrated = {}
         batch = []
-        for path_address in path_addresses:
-            (key_hash, packed) = self._encode_and_hash(child)
-            parent_address = path_address[:-TOKEN_SIZE]
-            path_branch = path_address[-TOKEN_SIZE:]
-            path_map[parent_address]["c"][path_branch] = key_hash
-            batch.append((key_hash, packed))
-            child = path_map[parent_address]
-
-        # Update the child of the root node to the prior hash
-        root_node = copy.deepcopy(self._root_node)
-        root_node["c"][tokens[0]] = key_hash
-        (root_hash, packed) = self._encode_and_hash(root_node)
-
-        batch.append((root_hash, packed))
 
+        def _migrate(key_hash):
+            if key_hash in migrated:
+                return migrated[key_hash]
+            node = self._get_by_hash(key_hash)
+            new_node = {
+                "v": node["v"],
+                "c": {token: _migrate(child)
+                      for token, child in node["c"].items()}
+            }
+            packed = encode_node(new_node, node_format)
+            new_hash = MerkleDatabase.hash(packed)
+            batch.append((new_hash, packed))
+            if len(batch) >= batch_size:
+                self._database.set_batch(batch)
+                del batch[:]
+            migrated[key_hash] = new_hash
+            return new_hash
+
+        new_root = _migrate(self._root_hash)
         self._database.set_batch(batch)
-
-        return root_hash
-
-    def _get_kv(self, key):
-        packed = self._database.get(key)
-        if packed is not None:
-            return self._decode(packed)
-        else:
-            return None
-
-    def _set_kv(self, value):
-        packed = self._encode(value)
-        hashed_key = MerkleDatabase.hash(packed)
-        self._database.set(hashed_key, packed)
-        return hashed_key
+        return new_root
 
     def addresses(self):
         addresses = []
@@ -256,9 +540,145 @@ class MerkleDatabase(object):
 
     def leaves(self, prefix):
         leaves = {}
-        for address, value in self._yield_iter(prefix, self._root_hash):
+        for address, value in self._yield_iter(prefix):
             leaves[address] = value
         return leaves
 
+    def get_proof(self, address):
+        """Returns a proof of the value of an address, or of its absence,
+        under the current root: the encoded nodes on the path from the root
+        to the address. Each node holds the hashes of its children, so the
+        proof can be checked against the root alone, with
+        sawtooth_sdk.client.proof.verify_proof().
+
+        The path stops at the last node on the way to the address when the
+        address has no node.
+
+        Args:
+            address (str): the address to prove the value of
+
+        Returns:
+            list: the encoded nodes, the root first
+        """
+        return self.get_value_and_proof(address)[1]
+
+    def get_value_and_proof(self, address):
+        """Returns the value of an address along with its proof (see
+        get_proof()), reading the path to the address once.
+
+        Args:
+            address (str): the address to prove the value of
+
+        Returns:
+            tuple: the value, or None if the address has no node or its
+                node has no value, and the list of encoded nodes
+        """
+        node = self._root_node
+        proof = [self._get_packed(self._root_hash, node)]
+        rest = address
+        while rest:
+            label = _child_label(node['c'], rest)
+            if label is None or not rest.startswith(label):
+                break
+            child_hash = node['c'][label]
+            node = self._get_by_hash(child_hash)
+            proof.append(self._get_packed(child_hash, node))
+            rest = rest[len(label):]
+
+        value = None
+        if not rest and node['v'] is not None:
+            value = self._decode(node['v'])
+        return value, proof
+
+    def _get_packed(self, key_hash, node):
+        """Returns the encoded form of a decoded node. Encodings are
+        canonical, so a node written in the format of this trie, typically
+        found in the node cache, is re-encoded rather than read again.
+        """
+        packed = self._encode_node(node)
+        if MerkleDatabase.hash(packed) == key_hash:
+            return packed
+
+        packed = self._database.get(key_hash)
+        if packed is None:
+            raise KeyError("hash {} not found in database".format(key_hash))
+        return bytes(packed)
+
+    def diff(self, root_a, root_b, prefix=''):
+        """Yields the addresses whose values differ between two state roots.
+
+        Both tries are walked together, and the subtrees which have the
+        same hash in both are skipped, so the cost of a diff depends on the
+        number of changes rather than on the size of the state. The tries
+        may have been written in different modes: where their edges do not
+        line up, the walk continues from the middle of the longer edge.
+
+        Args:
+            root_a (str): the old state root
+            root_b (str): the new state root
+            prefix (str): only addresses starting with prefix are compared
+
+        Yields:
+            tuple: (address, old value, new value), in address order. The
+                old value is None for an added address, and the new value
+                is None for a deleted one.
+
+        Raises:
+            KeyError: if a node of either trie is missing
+        """
+        # a side of the walk is the remaining part of the edge being
+        # followed, and the hash of the node it leads to. An empty label
+        # means the side is at the node itself.
+        for item in self._diff_sides('', ('', root_a), ('', root_b), prefix):
+            yield item
+
+    def _diff_sides(self, path, side_a, side_b, prefix):
+        if side_a == side_b:
+            return
+
+        value_a, children_a = self._open_side(side_a)
+        value_b, children_b = self._open_side(side_b)
+
+        if value_a != value_b and path.startswith(prefix):
+            yield (path,
+                   self._decode(value_a) if value_a is not None else None,
+                   self._decode(value_b) if value_b is not None else None)
+
+        for token in sorted(set(children_a) | set(children_b)):
+            label_a, hash_a = children_a.get(token, (None, None))
+            label_b, hash_b = children_b.get(token, (None, None))
+            if label_a is None:
+                step = label_b
+            elif label_b is None:
+                step = label_a
+            else:
+                step = _common_prefix(label_a, label_b)
+
+            child_path = path + step
+            if not (child_path.startswith(prefix) or
+                    prefix.startswith(child_path)):
+                continue
+
+            child_a = None if label_a is None \
+                else (label_a[len(step):], hash_a)
+            child_b = None if label_b is None \
+                else (label_b[len(step):], hash_b)
+            for item in self._diff_sides(child_path, child_a, child_b,
+                                         prefix):
+                yield item
+
+    def _open_side(self, side):
+        """Returns the value and the children, as a dict of first token to
+        (label, hash), of a side of a diff.
+        """
+        if side is None:
+            return None, {}
+        label, key_hash = side
+        if label:
+            return None, {label[:TOKEN_SIZE]: (label, key_hash)}
+        node = self._get_by_hash(key_hash)
+        return node['v'], {child_label[:TOKEN_SIZE]: (child_label, child_hash)
+                           for child_label, child_hash in node['c'].items()}
+
     def close(self):
         self._database.close()
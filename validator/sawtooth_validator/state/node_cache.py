@@ -0,0 +1,132 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+from collections import OrderedDict
+from threading import Lock
+
+# 64MB of encoded nodes
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class NodeCache(object):
+    """A size-bounded LRU cache of decoded Merkle trie nodes, keyed by the
+    node hash.
+
+    Trie nodes are content-addressed, so a cached node can never become
+    stale and the cache never needs to be invalidated; entries only leave
+    the cache when the byte budget is exceeded. The size of an entry is
+    approximated by the length of its encoded form.
+
+    The decoded nodes handed out by the cache are shared between all
+    readers and must be treated as immutable.
+
+    Attributes:
+        _lock (threading.Lock): guards the entries and the counters.
+        _nodes (OrderedDict): node hash to (node, size) in LRU order, the
+            least recently used entry first.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """Constructor for the NodeCache class.
+
+        Args:
+            max_bytes (int): the budget, in encoded bytes, of the nodes kept
+                in the cache.
+        """
+        self._lock = Lock()
+        self._nodes = OrderedDict()
+        self._max_bytes = max_bytes
+        self._size_bytes = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._nodes)
+
+    def __contains__(self, key_hash):
+        with self._lock:
+            return key_hash in self._nodes
+
+    def get(self, key_hash):
+        """Returns the decoded node stored under the hash, marking it as the
+        most recently used, or None if it is not cached.
+
+        Args:
+            key_hash (str): the hash of the node
+        """
+        with self._lock:
+            entry = self._nodes.get(key_hash)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._nodes.move_to_end(key_hash)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key_hash, node, size):
+        """Adds a decoded node to the cache, evicting the least recently used
+        nodes as needed to stay within the byte budget.
+
+        Args:
+            key_hash (str): the hash of the node
+            node (dict): the decoded node
+            size (int): the size of the encoded node, in bytes
+        """
+        if size > self._max_bytes:
+            return
+
+        with self._lock:
+            if key_hash in self._nodes:
+                self._nodes.move_to_end(key_hash)
+                return
+
+            self._nodes[key_hash] = (node, size)
+            self._size_bytes += size
+
+            while self._size_bytes > self._max_bytes:
+                _, (_, evicted_size) = self._nodes.popitem(last=False)
+                self._size_bytes -= evicted_size
+                self._evictions += 1
+
+    def clear(self):
+        """Removes all the nodes from the cache. The counters are kept.
+        """
+        with self._lock:
+            self._nodes.clear()
+            self._size_bytes = 0
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @property
+    def size_bytes(self):
+        with self._lock:
+            return self._size_bytes
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def evictions(self):
+        return self._evictions
@@ -0,0 +1,230 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Encodings of Merkle trie nodes.
+
+A decoded node is a dict {"v": value, "c": {token: child_hash}}, where the
+value is the CBOR encoded state value (or None) and the tokens and hashes
+are hex strings.
+
+Two node formats are supported:
+
+    CBOR_NODE_FORMAT: the decoded dict, CBOR encoded with sorted keys.
+
+    COMPACT_NODE_FORMAT: a binary layout made of
+        - a version byte (COMPACT_VERSION)
+        - a flags byte
+        - the child tokens, either as a 256 bit bitmap when the node has
+          many children (FLAG_DENSE) or as a count byte followed by one
+          byte per token. The edges of path compressed tries may be
+          labelled with several tokens (FLAG_LABELS), in which case a
+          varint count is followed by each label, as a length byte and
+          the label bytes.
+        - the 32 byte raw hash of each child, in token order
+        - when the node has a value (FLAG_VALUE), a varint length followed
+          by the value bytes
+
+Both encodings are canonical, so the hash of a node only depends on its
+content and on the format. decode_node() reads either format, so a trie
+can be read regardless of the format its nodes were written in.
+"""
+
+from itertools import chain
+from operator import getitem
+
+import cbor
+
+CBOR_NODE_FORMAT = 'cbor'
+COMPACT_NODE_FORMAT = 'compact'
+
+NODE_FORMATS = [CBOR_NODE_FORMAT, COMPACT_NODE_FORMAT]
+
+COMPACT_VERSION = 0x01
+
+FLAG_DENSE = 0x01
+FLAG_VALUE = 0x02
+FLAG_LABELS = 0x04
+
+# nodes with at least this many children store their tokens as a bitmap
+_DENSE_CHILDREN = 32
+
+_TOKEN_BYTES = {'{:02x}'.format(i): i for i in range(256)}
+_TOKEN_NAMES = ['{:02x}'.format(i) for i in range(256)]
+# the set bits of each bitmap byte, most significant first
+_BITMAP_BITS = [[bit for bit in range(8) if byte & (0x80 >> bit)]
+                for byte in range(256)]
+# the tokens of each byte value at each of the 32 bitmap positions
+_BITMAP_TOKENS = [[tuple(_TOKEN_NAMES[(i << 3) + bit]
+                         for bit in _BITMAP_BITS[byte])
+                   for byte in range(256)]
+                  for i in range(32)]
+# the slices of the hex string of the child hashes
+_HASH_SLICES = [slice(i, i + 64) for i in range(0, 64 * 256, 64)]
+
+
+def encode_node(node, node_format=CBOR_NODE_FORMAT):
+    """Encodes a node in the given format.
+
+    Args:
+        node (dict): the decoded node
+        node_format (str): one of NODE_FORMATS
+
+    Returns:
+        bytes: the encoded node
+
+    Raises:
+        ValueError: if the node cannot be represented in the format
+    """
+    if node_format == COMPACT_NODE_FORMAT:
+        return _encode_compact(node)
+    if node_format == CBOR_NODE_FORMAT:
+        return cbor.dumps(node, sort_keys=True)
+    raise ValueError("unknown node format {}".format(node_format))
+
+
+def decode_node(packed):
+    """Decodes a node encoded in any of the supported formats.
+
+    Args:
+        packed (bytes): the encoded node, or a buffer of it
+
+    Returns:
+        dict: the decoded node
+    """
+    if packed[0] == COMPACT_VERSION:
+        return _decode_compact(packed)
+    return cbor.loads(bytes(packed))
+
+
+def _encode_compact(node):
+    children = node['c']
+    value = node['v']
+
+    tokens = sorted(children)
+    flags = 0
+    if all(token in _TOKEN_BYTES for token in tokens):
+        token_bytes = bytes(_TOKEN_BYTES[token] for token in tokens)
+        if len(tokens) >= _DENSE_CHILDREN:
+            flags |= FLAG_DENSE
+    else:
+        flags |= FLAG_LABELS
+        token_bytes = None
+    if value is not None:
+        flags |= FLAG_VALUE
+
+    encoded = bytearray((COMPACT_VERSION, flags))
+    if flags & FLAG_LABELS:
+        encoded += _encode_varint(len(tokens))
+        for label in tokens:
+            label_bytes = _label_bytes(label)
+            encoded.append(len(label_bytes))
+            encoded += label_bytes
+    elif flags & FLAG_DENSE:
+        bitmap = bytearray(32)
+        for token_byte in token_bytes:
+            bitmap[token_byte >> 3] |= 0x80 >> (token_byte & 0x07)
+        encoded += bitmap
+    else:
+        encoded.append(len(token_bytes))
+        encoded += token_bytes
+
+    for token in tokens:
+        child_hash = bytes.fromhex(children[token])
+        if len(child_hash) != 32:
+            raise ValueError("compact nodes require 32 byte child hashes: "
+                             "{}".format(children[token]))
+        encoded += child_hash
+
+    if value is not None:
+        encoded += _encode_varint(len(value))
+        encoded += value
+
+    return bytes(encoded)
+
+
+def _label_bytes(label):
+    try:
+        label_bytes = bytes.fromhex(label)
+    except ValueError:
+        label_bytes = None
+    if not label_bytes or len(label_bytes) > 0xff or \
+            label_bytes.hex() != label:
+        raise ValueError("compact nodes require lowercase hex labels of 1 to "
+                         "255 bytes: {}".format(label))
+    return label_bytes
+
+
+def _decode_compact(packed):
+    # packed may be a buffer which is only valid for the current read, so
+    # nothing decoded refers to it. The tokens and hashes are looked up and
+    # sliced with map() rather than per child Python code, as it is what
+    # makes this decoding slower than the CBOR one.
+    flags = packed[1]
+    if flags & FLAG_LABELS:
+        count, pos = _decode_varint(packed, 2)
+        tokens = []
+        for _ in range(count):
+            length = packed[pos]
+            tokens.append(packed[pos + 1:pos + 1 + length].hex())
+            pos += 1 + length
+    elif flags & FLAG_DENSE:
+        tokens = list(chain.from_iterable(
+            map(getitem, _BITMAP_TOKENS, packed[2:34])))
+        count = len(tokens)
+        pos = 34
+    else:
+        count = packed[2]
+        pos = 3 + count
+        tokens = map(_TOKEN_NAMES.__getitem__, packed[3:pos])
+
+    if count:
+        end = pos + 32 * count
+        hashes = packed[pos:end].hex()
+        children = dict(zip(tokens,
+                            map(hashes.__getitem__, _HASH_SLICES[:count])))
+        pos = end
+    else:
+        children = {}
+
+    value = None
+    if flags & FLAG_VALUE:
+        length = packed[pos]
+        if length & 0x80:
+            length, pos = _decode_varint(packed, pos)
+        else:
+            pos += 1
+        value = bytes(packed[pos:pos + length])
+
+    return {"v": value, "c": children}
+
+
+def _encode_varint(value):
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return encoded
+
+
+def _decode_varint(packed, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = packed[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
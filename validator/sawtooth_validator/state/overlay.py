@@ -0,0 +1,291 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+from contextlib import contextmanager
+import logging
+from threading import Lock
+
+from sawtooth_validator.database import database
+from sawtooth_validator.state.node_codec import decode_node
+
+LOGGER = logging.getLogger(__name__)
+
+# the number of flushes a layer which is not flushed survives
+DEFAULT_RETAINED_FLUSHES = 2
+
+
+class StateOverlay(database.Database):
+    """Keeps the Merkle trie nodes written by the updates of the state in
+    memory, until the state they belong to is flushed to the database.
+
+    Each update adds a layer holding the nodes it wrote, on top of the
+    layer of the state root it was made on, so the states computed while
+    executing a block form a chain of layers, one per transaction, on top
+    of a state of the database. Reads see the nodes of every layer, and
+    then the database.
+
+    flush() writes the nodes of a state which are not in the database yet,
+    typically when its block is committed: the nodes of the intermediate
+    states of the block which the final state no longer references are
+    never written. The layers of the states which are never flushed, such
+    as those of abandoned candidate blocks, are dropped after a few
+    flushes, unless they are still in use.
+
+    Attributes:
+        _flush_lock (threading.Lock): serializes the flushes.
+        _lock (threading.Lock): guards the attributes below.
+        _nodes (dict): the encoded nodes of the layers, by key, as
+            [encoded node, number of layers holding it] lists.
+        _layers (dict): the _Layer of each state root.
+        _flushes (int): the number of flushes.
+    """
+
+    def __init__(self, database_, retained_flushes=DEFAULT_RETAINED_FLUSHES):
+        """
+        Args:
+            database_ (Database): the database of the nodes
+            retained_flushes (int): the number of flushes the layers which
+                are not flushed survive
+        """
+        super(StateOverlay, self).__init__()
+        self._database = database_
+        self._retained_flushes = retained_flushes
+        self._flush_lock = Lock()
+        self._lock = Lock()
+        self._nodes = {}
+        self._layers = {}
+        self._flushes = 0
+
+        self._flushed_nodes = 0
+        self._dropped_layers = 0
+
+    def __len__(self):
+        return len(self._database)
+
+    def __contains__(self, key):
+        return key in self._nodes or key in self._database
+
+    def get(self, key):
+        entry = self._nodes.get(key)
+        if entry is not None:
+            return entry[0]
+        return self._database.get(key)
+
+    def get_batch(self, keys):
+        result = []
+        missing = []
+        for key in keys:
+            entry = self._nodes.get(key)
+            if entry is not None:
+                result.append((key, entry[0]))
+            else:
+                missing.append(key)
+        if missing:
+            result.extend(self._database.get_batch(missing))
+        return result
+
+    @contextmanager
+    def read_txn(self):
+        yield self
+
+    def set(self, key, value):
+        raise NotImplementedError(
+            "nodes are added to the overlay by layers, see new_layer()")
+
+    def set_batch(self, kvpairs):
+        raise NotImplementedError(
+            "nodes are added to the overlay by layers, see new_layer()")
+
+    def sync(self):
+        self._database.sync()
+
+    def close(self):
+        self._database.close()
+
+    def keys(self):
+        return self._database.keys()
+
+    def new_layer(self):
+        """Returns the database of an update: it reads the overlay, and
+        keeps the nodes written, which add_layer() adds to the overlay.
+        """
+        return _LayerDatabase(self)
+
+    def add_layer(self, parent_root, state_root, layer_database):
+        """Adds the nodes written by an update to the overlay.
+
+        Args:
+            parent_root (str): the state root the update was made on
+            state_root (str): the state root the update made
+            layer_database: the database of the update, from new_layer()
+        """
+        # pylint: disable=protected-access
+        nodes = layer_database._nodes
+        with self._lock:
+            if state_root in self._layers or state_root == parent_root:
+                # the same state was computed again
+                return
+            for key, packed in nodes.items():
+                entry = self._nodes.get(key)
+                if entry is None:
+                    self._nodes[key] = [packed, 1]
+                else:
+                    entry[1] += 1
+            self._layers[state_root] = _Layer(parent_root, list(nodes),
+                                              self._flushes)
+
+    def flush(self, state_root, in_use_roots=()):
+        """Writes the nodes of a state which are only in the overlay to the
+        database, then drops the layers which are not retained.
+
+        Args:
+            state_root (str): the state root to write the state of
+            in_use_roots (iterable): state roots still in use, whose layers
+                and those under them are kept
+
+        Returns:
+            int: the number of nodes written
+
+        Raises:
+            KeyError: if the state is neither in the overlay nor in the
+                database
+        """
+        with self._flush_lock:
+            written = self._unflushed_nodes(state_root)
+            if written:
+                self._database.set_batch(written)
+            elif state_root not in self._database:
+                raise KeyError("state root {} is not in the overlay nor in "
+                               "the database".format(state_root))
+
+            with self._lock:
+                self._flushes += 1
+                self._flushed_nodes += len(written)
+                self._drop_layers(state_root, set(in_use_roots))
+        return len(written)
+
+    def _unflushed_nodes(self, state_root):
+        # the nodes are only dropped by flushes, so they can be read
+        # without the lock
+        written = []
+        pending = [state_root]
+        seen = set(pending)
+        while pending:
+            key = pending.pop()
+            entry = self._nodes.get(key)
+            if entry is None:
+                # the node, and the nodes under it, are in the database
+                continue
+            written.append((key, entry[0]))
+            for child in decode_node(entry[0])['c'].values():
+                if child not in seen:
+                    seen.add(child)
+                    pending.append(child)
+        return written
+
+    def _drop_layers(self, flushed_root, in_use_roots):
+        # the layers under the flushed state are in the database now, as far
+        # as it references them
+        dropped = set()
+        root = flushed_root
+        while root in self._layers:
+            dropped.add(root)
+            root = self._layers[root].parent
+
+        oldest = self._flushes - self._retained_flushes
+        dropped.update(root for root, layer in self._layers.items()
+                       if layer.flushes < oldest)
+
+        # the layers of the states in use, and those under them, are kept
+        for root in in_use_roots:
+            while root in self._layers and root in dropped:
+                dropped.discard(root)
+                root = self._layers[root].parent
+
+        for root in dropped:
+            for key in self._layers.pop(root).keys:
+                entry = self._nodes[key]
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._nodes[key]
+        self._dropped_layers += len(dropped)
+
+    def base_roots(self):
+        """Returns the state roots of the database the layers are on. The
+        nodes of the layers only reference the nodes of the database which
+        these states reference, so they must not be pruned.
+        """
+        with self._lock:
+            return set(layer.parent for layer in self._layers.values()
+                       if layer.parent not in self._layers)
+
+    @property
+    def metrics(self):
+        with self._lock:
+            return {
+                'layers': len(self._layers),
+                'nodes': len(self._nodes),
+                'flushes': self._flushes,
+                'flushed_nodes': self._flushed_nodes,
+                'dropped_layers': self._dropped_layers,
+            }
+
+
+class _Layer(object):
+    __slots__ = ['parent', 'keys', 'flushes']
+
+    def __init__(self, parent, keys, flushes):
+        self.parent = parent
+        self.keys = keys
+        self.flushes = flushes
+
+
+class _LayerDatabase(database.Database):
+    """The database of an update made on a StateOverlay, which reads the
+    overlay and keeps the nodes written.
+    """
+
+    def __init__(self, overlay):
+        super(_LayerDatabase, self).__init__()
+        self._overlay = overlay
+        self._nodes = {}
+
+    def __contains__(self, key):
+        return key in self._nodes or key in self._overlay
+
+    def get(self, key):
+        value = self._nodes.get(key)
+        if value is not None:
+            return value
+        return self._overlay.get(key)
+
+    def get_batch(self, keys):
+        result = []
+        missing = []
+        for key in keys:
+            value = self._nodes.get(key)
+            if value is not None:
+                result.append((key, value))
+            else:
+                missing.append(key)
+        if missing:
+            result.extend(self._overlay.get_batch(missing))
+        return result
+
+    def set(self, key, value):
+        self._nodes[key] = value
+
+    def set_batch(self, kvpairs):
+        self._nodes.update(kvpairs)
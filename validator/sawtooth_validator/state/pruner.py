@@ -0,0 +1,295 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+from functools import partial
+import logging
+from threading import Event
+from threading import Lock
+from threading import Thread
+import time
+
+from sawtooth_validator.database import database
+from sawtooth_validator.state.node_codec import decode_node
+
+LOGGER = logging.getLogger(__name__)
+
+# the number of nodes read or deleted at a time by the pruner
+DEFAULT_CHUNK_SIZE = 1000
+# the number of seconds between pruning cycles
+DEFAULT_INTERVAL = 60.0
+# the number of blocks of the current chain whose state is kept
+DEFAULT_RETAINED_BLOCKS = 100
+
+
+class PrunableDatabase(database.Database):
+    """Wraps the database of the Merkle trie nodes, so that the nodes written
+    while a pruning cycle is running are never deleted by that cycle.
+
+    Nodes are content-addressed: an update may write a node which already
+    exists and which the cycle found unreachable, making it reachable again.
+    A node written during the cycle may also point at existing nodes the
+    cycle found unreachable, such as those of a state root computed before
+    the cycle and not retained. Writes record their keys and nodes before
+    writing, and deletes first walk the nodes recorded since the previous
+    delete, then skip the recorded keys and the keys the walk reached, all
+    under the same lock. A node is thus either deleted before it is written
+    or referenced again, or not deleted at all.
+
+    Attributes:
+        _lock (threading.Lock): guards _written, _unwalked and the deletes.
+        _written (set): the keys written since tracking started, and the
+            keys of the existing nodes they reference, or None when no
+            pruning cycle is running.
+        _unwalked (list): the encoded nodes written since the previous
+            delete, whose references are not walked yet.
+    """
+
+    def __init__(self, database_):
+        super(PrunableDatabase, self).__init__()
+        self._database = database_
+        self._lock = Lock()
+        self._written = None
+        self._unwalked = []
+
+    def __len__(self):
+        return len(self._database)
+
+    def __contains__(self, key):
+        return key in self._database
+
+    def get(self, key):
+        return self._database.get(key)
+
+    def get_batch(self, keys):
+        return self._database.get_batch(keys)
+
+    def read_txn(self):
+        return self._database.read_txn()
+
+    def set(self, key, value):
+        with self._lock:
+            if self._written is not None:
+                self._written.add(key)
+                self._unwalked.append(value)
+        self._database.set(key, value)
+
+    def set_batch(self, kvpairs):
+        kvpairs = list(kvpairs)
+        with self._lock:
+            if self._written is not None:
+                self._written.update(key for key, _ in kvpairs)
+                self._unwalked.extend(value for _, value in kvpairs)
+        self._database.set_batch(kvpairs)
+
+    def delete(self, key):
+        self._database.delete(key)
+
+    def delete_batch(self, keys):
+        self._database.delete_batch(keys)
+
+    def sync(self):
+        self._database.sync()
+
+    def close(self):
+        self._database.close()
+
+    def keys(self):
+        return self._database.keys()
+
+    def start_tracking(self):
+        """Starts recording the keys which are written.
+        """
+        with self._lock:
+            self._written = set()
+
+    def stop_tracking(self):
+        """Stops recording the keys which are written, and forgets them.
+        """
+        with self._lock:
+            self._written = None
+            self._unwalked = []
+
+    def delete_unwritten(self, keys, get_referenced):
+        """Deletes the keys which were not written since tracking started,
+        nor referenced by the nodes written since then.
+
+        Args:
+            keys (list): the keys to delete
+            get_referenced (callable): called with the encoded nodes written
+                since the previous delete, it returns the keys of the
+                existing nodes they reference, directly or not, which must
+                be kept. It is called under the lock, so it must not write.
+
+        Returns:
+            int: the number of keys deleted
+        """
+        with self._lock:
+            if self._written is None:
+                raise ValueError("deletes require tracking to be started")
+            if self._unwalked:
+                self._written.update(get_referenced(self._unwalked))
+                self._unwalked = []
+            keys = [key for key in keys if key not in self._written]
+            self._database.delete_batch(keys)
+        return len(keys)
+
+
+class StatePruner(Thread):
+    """Reclaims the Merkle trie nodes which are not reachable from the state
+    roots the validator still needs, with a periodic mark-and-sweep run on
+    its own thread.
+
+    A cycle takes the set of keys in the database, marks the nodes
+    reachable from the retained roots, and deletes the rest in small
+    chunks. Nodes written during the cycle, and the nodes they reference,
+    are never deleted (see PrunableDatabase), so block validation and
+    publishing go on while the cycle runs, and the pruner yields between
+    chunks.
+    """
+
+    def __init__(self, prunable_database, get_retained_roots,
+                 interval=DEFAULT_INTERVAL, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Args:
+            prunable_database (PrunableDatabase): the database of the nodes
+            get_retained_roots (callable): returns the state roots to keep,
+                typically the roots of the last blocks of the chain and of
+                the blocks in the block cache. No node is pruned while it
+                returns no root.
+            interval (float): the number of seconds between cycles
+            chunk_size (int): the number of nodes read or deleted at a time
+        """
+        super(StatePruner, self).__init__(name='StatePruner')
+        self.daemon = True
+        self._database = prunable_database
+        self._get_retained_roots = get_retained_roots
+        self._interval = interval
+        self._chunk_size = chunk_size
+        self._stop_event = Event()
+
+        self._cycles = 0
+        self._pruned_nodes = 0
+        self._last_duration = 0.0
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            try:
+                self.prune()
+            # pylint: disable=broad-except
+            except Exception as exc:
+                LOGGER.exception(exc)
+                LOGGER.error("State pruning cycle failed")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def prune(self):
+        """Runs a pruning cycle.
+
+        Returns:
+            int: the number of nodes deleted
+        """
+        start = time.time()
+        self._database.start_tracking()
+        try:
+            roots = set(self._get_retained_roots())
+            if not roots:
+                return 0
+
+            unmarked = set(self._database.keys())
+            pruned = 0
+            if not self._mark(roots, unmarked):
+                return 0
+
+            deletable = list(unmarked)
+            for i in range(0, len(deletable), self._chunk_size):
+                if self._stop_event.is_set():
+                    break
+                pruned += self._database.delete_unwritten(
+                    deletable[i:i + self._chunk_size],
+                    partial(self._mark_referenced, unmarked))
+                # let the threads doing actual work run
+                time.sleep(0)
+        finally:
+            self._database.stop_tracking()
+
+        self._cycles += 1
+        self._pruned_nodes += pruned
+        self._last_duration = time.time() - start
+        LOGGER.info("Pruned %s state nodes in %.3fs, retaining %s roots",
+                    pruned, self._last_duration, len(roots))
+        return pruned
+
+    def _mark(self, roots, unmarked):
+        """Removes the nodes reachable from the roots from unmarked. Nodes
+        already missing from unmarked are either marked or were written
+        during the cycle, and are not walked.
+
+        Returns:
+            bool: False if the pruner was stopped before marking completed
+        """
+        pending = [root for root in roots if root in unmarked]
+        unmarked.difference_update(pending)
+        while pending:
+            if self._stop_event.is_set():
+                return False
+            chunk = pending[-self._chunk_size:]
+            del pending[-self._chunk_size:]
+
+            for _, packed in self._database.get_batch(chunk):
+                for child in decode_node(packed)['c'].values():
+                    if child in unmarked:
+                        unmarked.discard(child)
+                        pending.append(child)
+            time.sleep(0)
+        return True
+
+    def _mark_referenced(self, unmarked, written):
+        """Removes the nodes referenced by the written nodes, directly or
+        not, from unmarked. Unlike _mark(), it always completes, as the
+        nodes it returns are about to be deleted otherwise.
+
+        Args:
+            unmarked (set): the keys not reachable from the retained roots
+            written (list): the encoded nodes written during the cycle
+
+        Returns:
+            list: the keys removed from unmarked
+        """
+        referenced = []
+        packed_nodes = written
+        while packed_nodes:
+            children = []
+            for packed in packed_nodes:
+                for child in decode_node(packed)['c'].values():
+                    if child in unmarked:
+                        unmarked.discard(child)
+                        children.append(child)
+            referenced.extend(children)
+            packed_nodes = [packed for _, packed
+                            in self._database.get_batch(children)]
+        return referenced
+
+    @property
+    def cycles(self):
+        return self._cycles
+
+    @property
+    def pruned_nodes(self):
+        return self._pruned_nodes
+
+    @property
+    def last_duration(self):
+        return self._last_duration
@@ -0,0 +1,224 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Snapshots of the state under a single state root.
+
+A snapshot file is made of
+    - a header: SNAPSHOT_MAGIC, whose last byte is the format version,
+      followed by the 32 byte state root
+    - chunks of nodes, each made of a (node count, payload length) pair of
+      big endian uint32, the payload and the SHA-256 digest of the payload.
+      A node is stored as its 32 byte hash, a big endian uint32 length and
+      the encoded node, exactly as stored in the state database.
+    - an empty chunk, marking the end of the nodes, followed by the total
+      number of nodes as a big endian uint64
+
+The nodes are written children first, in depth-first order, so that the
+import can check each node against its hash and its children as soon as it
+is read, ending with the root.
+"""
+
+import hashlib
+import struct
+
+from sawtooth_validator.state.merkle import MerkleDatabase
+from sawtooth_validator.state.node_codec import decode_node
+
+SNAPSHOT_MAGIC = b'STSNAP\x00\x01'
+
+# the number of nodes per chunk of an exported snapshot
+DEFAULT_CHUNK_NODES = 10000
+# the number of nodes written per transaction by an import
+DEFAULT_BATCH_NODES = 100000
+
+_CHUNK_HEADER = struct.Struct('>II')
+_NODE_LENGTH = struct.Struct('>I')
+_NODE_COUNT = struct.Struct('>Q')
+_HASH_SIZE = 32
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def export_snapshot(database, state_root, out_file,
+                    chunk_nodes=DEFAULT_CHUNK_NODES):
+    """Writes every node reachable from a state root to a snapshot.
+
+    Args:
+        database (database.Database): the state database
+        state_root (str): the state root to export
+        out_file (file): a binary file to write the snapshot to
+        chunk_nodes (int): the number of nodes per chunk
+
+    Returns:
+        int: the number of nodes exported
+
+    Raises:
+        SnapshotError: if a node is missing from the database
+    """
+    out_file.write(SNAPSHOT_MAGIC)
+    out_file.write(bytes.fromhex(state_root))
+
+    count = 0
+    chunk = []
+    for key, packed in _iter_nodes_children_first(database, state_root):
+        chunk.append(bytes.fromhex(key))
+        chunk.append(_NODE_LENGTH.pack(len(packed)))
+        chunk.append(packed)
+        count += 1
+        if len(chunk) >= 3 * chunk_nodes:
+            _write_chunk(out_file, chunk)
+            chunk = []
+    if chunk:
+        _write_chunk(out_file, chunk)
+
+    out_file.write(_CHUNK_HEADER.pack(0, 0))
+    out_file.write(_NODE_COUNT.pack(count))
+    return count
+
+
+def _write_chunk(out_file, chunk):
+    payload = b''.join(chunk)
+    out_file.write(_CHUNK_HEADER.pack(len(chunk) // 3, len(payload)))
+    out_file.write(payload)
+    out_file.write(hashlib.sha256(payload).digest())
+
+
+def _iter_nodes_children_first(database, state_root):
+    """Yields (hash, encoded node) for the nodes reachable from the root,
+    each once, the children of a node before the node itself.
+    """
+    expanded = set()
+    # (hash, encoded node) pairs; the encoded node is None until the
+    # children of the node have been pushed
+    stack = [(state_root, None)]
+    while stack:
+        key, packed = stack.pop()
+        if packed is not None:
+            yield key, packed
+            continue
+        if key in expanded:
+            continue
+        expanded.add(key)
+
+        packed = database.get(key)
+        if packed is None:
+            raise SnapshotError("node {} is missing".format(key))
+        packed = bytes(packed)
+        stack.append((key, packed))
+        for child in sorted(decode_node(packed)['c'].values(), reverse=True):
+            if child not in expanded:
+                stack.append((child, None))
+
+
+def import_snapshot(database, in_file, state_root=None,
+                    batch_nodes=DEFAULT_BATCH_NODES):
+    """Loads a snapshot into a state database, checking the checksum of each
+    chunk, the hash and children of each node, and that the nodes form a
+    complete trie under the state root of the snapshot.
+
+    The import keeps the nodes which are not yet the child of a node read
+    after them on a stack. Children first and depth-first, the children of
+    a node which are not already in the database are on top of that stack
+    when the node is read. A child found neither there nor in the database
+    is missing, and a node left on the stack at the end is not reachable
+    from the state root. The memory used thus depends on the depth and
+    width of the trie, not on its size.
+
+    Nodes are written as they are checked, so a snapshot which fails to
+    import may leave some of its nodes in the database; as nodes are
+    content-addressed, they do not affect any other state.
+
+    Args:
+        database (database.Database): the state database
+        in_file (file): a binary file to read the snapshot from
+        state_root (str): the state root the snapshot is expected to have,
+            checked before any node is written
+        batch_nodes (int): the number of nodes written per set_batch()
+
+    Returns:
+        tuple: the state root and the number of nodes imported
+
+    Raises:
+        SnapshotError: if the snapshot is invalid, or does not have the
+            expected state root
+    """
+    magic = _read(in_file, len(SNAPSHOT_MAGIC))
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError("not a state snapshot, or an unsupported version")
+    snapshot_root = _read(in_file, _HASH_SIZE).hex()
+    if state_root is not None and state_root != snapshot_root:
+        raise SnapshotError("the snapshot has state root {}, expected {}"
+                            .format(snapshot_root, state_root))
+
+    count = 0
+    unclaimed = []
+    batch = {}
+    while True:
+        node_count, length = _CHUNK_HEADER.unpack(
+            _read(in_file, _CHUNK_HEADER.size))
+        if node_count == 0:
+            break
+
+        payload = _read(in_file, length)
+        if hashlib.sha256(payload).digest() != _read(in_file, _HASH_SIZE):
+            raise SnapshotError("chunk checksum mismatch after {} nodes"
+                                .format(count))
+
+        pos = 0
+        for _ in range(node_count):
+            key = payload[pos:pos + _HASH_SIZE].hex()
+            pos += _HASH_SIZE
+            node_length, = _NODE_LENGTH.unpack_from(payload, pos)
+            pos += _NODE_LENGTH.size
+            packed = payload[pos:pos + node_length]
+            pos += node_length
+
+            if MerkleDatabase.hash(packed) != key:
+                raise SnapshotError("node {} does not match its hash"
+                                    .format(key))
+            children = set(decode_node(packed)['c'].values())
+            while unclaimed and unclaimed[-1] in children:
+                children.discard(unclaimed.pop())
+            for child in children:
+                if child not in batch and child not in database:
+                    raise SnapshotError("node {} precedes its child {}"
+                                        .format(key, child))
+            unclaimed.append(key)
+            count += 1
+
+            batch[key] = packed
+            if len(batch) >= batch_nodes:
+                database.set_batch(list(batch.items()))
+                batch = {}
+
+    if batch:
+        database.set_batch(list(batch.items()))
+
+    total, = _NODE_COUNT.unpack(_read(in_file, _NODE_COUNT.size))
+    if total != count:
+        raise SnapshotError("expected {} nodes, read {}".format(
+            total, count))
+    if unclaimed != [snapshot_root]:
+        raise SnapshotError("the nodes do not form the trie of state root {}"
+                            .format(snapshot_root))
+    return snapshot_root, total
+
+
+def _read(in_file, size):
+    data = in_file.read(size)
+    if len(data) != size:
+        raise SnapshotError("truncated snapshot")
+    return data
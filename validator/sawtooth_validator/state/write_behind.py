@@ -0,0 +1,335 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+from contextlib import contextmanager
+import logging
+from threading import Condition
+from threading import Thread
+import time
+
+from sawtooth_validator.database import database
+
+LOGGER = logging.getLogger(__name__)
+
+# the number of queued nodes past which writes wait for the writer
+DEFAULT_MAX_PENDING_NODES = 100000
+# the number of seconds between attempts of a failed write
+RETRY_INTERVAL = 1.0
+
+
+class WriteBehindDatabase(database.Database):
+    """Wraps the database of the Merkle trie nodes, so that writes return
+    as soon as they are queued, while a background thread writes them to
+    the wrapped database.
+
+    Queued nodes are kept in an in-memory overlay, which reads consult
+    before the wrapped database, so a node is visible as soon as it is
+    queued. Nodes are content-addressed, so a key always has the same
+    value, and a node is dropped from the overlay once it is written.
+    Writes and deletes reach the wrapped database in the order they were
+    made. Writes wait when max_pending_nodes are queued, so the overlay
+    stays bounded when the disk falls behind.
+
+    barrier() returns once everything queued before it is written; a block
+    commit waits on it, so that a block is never durable before its state.
+
+    Attributes:
+        _cond (threading.Condition): guards the attributes below.
+        _overlay (dict): the queued nodes, by key, as (value, sequence
+            number of their latest write) tuples.
+        _queue (list): the queued writes, as (sequence number, kvpairs,
+            keys to delete) tuples.
+        _queued_seq (int): the sequence number of the last queued write.
+        _written_seq (int): the sequence number of the last written write.
+        _error (Exception): the error of the last write, while it is
+            retried, raised by the barriers waiting for it.
+    """
+
+    def __init__(self, database_,
+                 max_pending_nodes=DEFAULT_MAX_PENDING_NODES):
+        """
+        Args:
+            database_ (Database): the database the nodes are written to
+            max_pending_nodes (int): the number of queued nodes past which
+                writes wait for the writer
+        """
+        super(WriteBehindDatabase, self).__init__()
+        self._database = database_
+        self._max_pending_nodes = max_pending_nodes
+
+        self._cond = Condition()
+        self._overlay = {}
+        self._queue = []
+        self._pending_nodes = 0
+        self._queued_seq = 0
+        self._written_seq = 0
+        self._error = None
+        self._stopped = False
+
+        self._written_nodes = 0
+        self._writes = 0
+        self._max_pending = 0
+        self._barriers = 0
+        self._barrier_time = 0.0
+
+        self._writer = Thread(target=self._write_queued,
+                              name='StateWriteBehind')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def __len__(self):
+        self.barrier()
+        return len(self._database)
+
+    def __contains__(self, key):
+        with self._cond:
+            if key in self._overlay:
+                return True
+        return key in self._database
+
+    def get(self, key):
+        with self._cond:
+            queued = self._overlay.get(key)
+        if queued is not None:
+            return queued[0]
+        return self._database.get(key)
+
+    def get_batch(self, keys):
+        result, missing = self._get_queued(keys)
+        if missing:
+            result.extend(self._database.get_batch(missing))
+        return result
+
+    def _get_queued(self, keys):
+        result = []
+        missing = []
+        with self._cond:
+            for key in keys:
+                queued = self._overlay.get(key)
+                if queued is not None:
+                    result.append((key, queued[0]))
+                else:
+                    missing.append(key)
+        return result, missing
+
+    @contextmanager
+    def read_txn(self):
+        with self._database.read_txn() as txn:
+            yield _WriteBehindReader(self, txn)
+
+    def set(self, key, value):
+        self.set_batch([(key, value)])
+
+    def set_batch(self, kvpairs):
+        kvpairs = list(kvpairs)
+        if kvpairs:
+            self._enqueue(kvpairs, ())
+
+    def delete(self, key):
+        self.delete_batch([key])
+
+    def delete_batch(self, keys):
+        keys = list(keys)
+        if keys:
+            self._enqueue((), keys)
+
+    def _enqueue(self, kvpairs, keys):
+        with self._cond:
+            if self._stopped:
+                raise ValueError("writes to a stopped write-behind database")
+            while self._pending_nodes >= self._max_pending_nodes and \
+                    self._pending_nodes > 0:
+                self._cond.wait()
+            self._queued_seq += 1
+            for key, value in kvpairs:
+                self._overlay[key] = (value, self._queued_seq)
+            self._queue.append((self._queued_seq, kvpairs, keys))
+            self._pending_nodes += len(kvpairs) + len(keys)
+            self._max_pending = max(self._max_pending, self._pending_nodes)
+            self._cond.notify_all()
+
+    def _write_queued(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopped:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                queue = self._queue
+                self._queue = []
+
+            try:
+                written_nodes = self._write(queue)
+            # the error is raised by the barriers waiting for the writes
+            # pylint: disable=broad-except
+            except Exception as exc:
+                LOGGER.exception(exc)
+                LOGGER.error("Writing %s queued state writes failed",
+                             len(queue))
+                with self._cond:
+                    # the writes are retried, and their nodes stay in the
+                    # overlay, so the states referring to them remain
+                    # readable
+                    self._queue = queue + self._queue
+                    self._error = exc
+                    self._cond.notify_all()
+                    if self._stopped:
+                        LOGGER.error("Dropping %s queued state writes",
+                                     len(self._queue))
+                        return
+                    self._cond.wait(RETRY_INTERVAL)
+                continue
+
+            last_seq = queue[-1][0]
+            with self._cond:
+                for _, kvpairs, keys in queue:
+                    for key, _ in kvpairs:
+                        queued = self._overlay.get(key)
+                        if queued is not None and queued[1] <= last_seq:
+                            del self._overlay[key]
+                    self._pending_nodes -= len(kvpairs) + len(keys)
+                self._error = None
+                self._written_seq = last_seq
+                self._written_nodes += written_nodes
+                self._writes += 1
+                self._cond.notify_all()
+
+    def _write(self, queue):
+        # consecutive sets are written in one batch; a delete ends the batch
+        written_nodes = 0
+        kvpairs = []
+        for _, queued_pairs, keys in queue:
+            kvpairs.extend(queued_pairs)
+            if keys:
+                if kvpairs:
+                    self._database.set_batch(kvpairs)
+                    written_nodes += len(kvpairs)
+                    kvpairs = []
+                self._database.delete_batch(keys)
+        if kvpairs:
+            self._database.set_batch(kvpairs)
+            written_nodes += len(kvpairs)
+        return written_nodes
+
+    def barrier(self, timeout=None):
+        """Waits until the writes queued before the call are written to
+        the wrapped database.
+
+        Args:
+            timeout (float): the number of seconds to wait, or None to wait
+                until the writes are written
+
+        Returns:
+            bool: False if the timeout expired first, True otherwise
+
+        Raises:
+            Exception: the error of the last attempt to write them, while
+                the writer retries them
+        """
+        start = time.time()
+        with self._cond:
+            seq = self._queued_seq
+            done = self._cond.wait_for(
+                lambda: self._written_seq >= seq or self._error is not None,
+                timeout)
+            self._barriers += 1
+            self._barrier_time += time.time() - start
+            if self._written_seq >= seq:
+                return True
+            if self._error is not None:
+                raise self._error
+            return done
+
+    def sync(self):
+        self.barrier()
+        self._database.sync()
+
+    def stop(self):
+        """Writes the queued writes, and stops the writer. Later writes
+        raise a ValueError.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._writer.join()
+
+    def close(self):
+        self.stop()
+        self._database.close()
+
+    def keys(self):
+        self.barrier()
+        return self._database.keys()
+
+    @property
+    def metrics(self):
+        """The number of nodes queued and written, the number of writes to
+        the wrapped database, the largest number of queued nodes, and the
+        number of barriers with their mean wait in seconds.
+        """
+        with self._cond:
+            return {
+                'pending_nodes': self._pending_nodes,
+                'max_pending_nodes': self._max_pending,
+                'written_nodes': self._written_nodes,
+                'writes': self._writes,
+                'barriers': self._barriers,
+                'mean_barrier_wait':
+                    self._barrier_time / max(1, self._barriers),
+            }
+
+
+class _WriteBehindReader(object):
+    """The reader of WriteBehindDatabase.read_txn(), which reads the nodes
+    which are not queued within the read transaction of the wrapped
+    database.
+
+    A node queued when the transaction started may be written, and dropped
+    from the overlay, before it is read; it is then missing from the
+    transaction's snapshot, and is read from the wrapped database instead.
+    Nodes never change once written, so the reads stay consistent.
+    """
+    def __init__(self, write_behind, txn):
+        self._write_behind = write_behind
+        self._txn = txn
+
+    @contextmanager
+    def read_txn(self):
+        yield self
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key):
+        # pylint: disable=protected-access
+        result, _ = self._write_behind._get_queued([key])
+        if result:
+            return result[0][1]
+        value = self._txn.get(key)
+        if value is None:
+            value = self._write_behind._database.get(key)
+        return value
+
+    def get_batch(self, keys):
+        # pylint: disable=protected-access
+        result, missing = self._write_behind._get_queued(keys)
+        if missing:
+            found = self._txn.get_batch(missing)
+            result.extend(found)
+            if len(found) < len(missing):
+                found = set(key for key, _ in found)
+                result.extend(self._write_behind._database.get_batch(
+                    [key for key in missing if key not in found]))
+        return result
@@ -0,0 +1,264 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Compares the database backends under a Merkle trie workload, reporting
+the throughput, the latency percentiles of reads and writes, the size of
+the database files and the memory used, as JSON.
+
+Each backend first loads a state of --keys addresses. Then --threads
+threads each run --ops operations on it: reads of a random address under
+the current state root, or, with probability 1 - --read-ratio, updates of
+--batch addresses which make a new state root. Each backend runs in its
+own process, so that the memory figures are its own.
+
+Usage:
+    python3 bench_database_backends.py [--backends dict,lmdb-nolock,...]
+        [--keys N] [--value-size N] [--ops N] [--read-ratio R]
+        [--threads N] [--batch N] [--output results.json]
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import tempfile
+from threading import Lock
+from threading import Thread
+import time
+
+from sawtooth_validator.database.database import CachedDatabase
+from sawtooth_validator.database.dict_database import DictDatabase
+from sawtooth_validator.database.lmdb_database import LMDBDatabase
+from sawtooth_validator.database.lmdb_nolock_database import \
+    LMDBNoLockDatabase
+from sawtooth_validator.database.shelf_database import ShelfDatabase
+from sawtooth_validator.state.merkle import MerkleDatabase
+
+BACKENDS = {
+    'dict': lambda path: DictDatabase(),
+    'shelf': lambda path: ShelfDatabase(path, 'n'),
+    'lmdb': lambda path: LMDBDatabase(path, 'n'),
+    'lmdb-nolock': lambda path: LMDBNoLockDatabase(path, 'n'),
+    'lmdb-nolock-raw': lambda path: LMDBNoLockDatabase(path, 'n', raw=True),
+    'cached-lmdb-nolock-raw': lambda path: CachedDatabase(
+        LMDBNoLockDatabase(path, 'n', raw=True)),
+}
+
+
+def make_address(i):
+    return '1cf126' + hashlib.sha512(str(i).encode()).hexdigest()[:64]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[int(round(fraction * (len(sorted_values) - 1)))]
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'p50_ms': _ms(percentile(latencies, 0.50)),
+        'p99_ms': _ms(percentile(latencies, 0.99)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 4)
+
+
+def rss_bytes():
+    """Returns the resident memory of the process, from /proc where it is
+    available, and the peak resident memory otherwise.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # in KB on Linux, in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+def directory_size(path):
+    """Returns the disk space used by the files of a directory. LMDB files
+    are sparse files as large as their map size, so their apparent size
+    says nothing of the space used.
+    """
+    return sum(os.stat(os.path.join(root, name)).st_blocks * 512
+               for root, _, names in os.walk(path) for name in names)
+
+
+class Workload(object):
+    """The operations of the benchmark threads on a shared state. Reads use
+    the state root of the last write; writes are serialized, as block
+    execution serializes the updates of a state.
+    """
+
+    def __init__(self, database, args):
+        self._database = database
+        self._args = args
+        self._write_lock = Lock()
+        self._value = os.urandom(args.value_size)
+
+        tree = MerkleDatabase(database)
+        self._root = None
+        updates = {}
+        for i in range(args.keys):
+            updates[make_address(i)] = self._value
+            if len(updates) >= 1000:
+                self._update(tree, updates)
+                updates = {}
+        if updates or self._root is None:
+            self._update(tree, updates)
+        self._next_key = args.keys
+
+    def _update(self, tree, updates):
+        self._root = tree.update(updates, virtual=False)
+        tree.set_merkle_root(self._root)
+
+    def run_thread(self, seed, reads, writes):
+        rand = random.Random(seed)
+        tree = MerkleDatabase(self._database, self._root)
+        for _ in range(self._args.ops):
+            if rand.random() < self._args.read_ratio:
+                address = make_address(rand.randrange(self._args.keys))
+                start = time.perf_counter()
+                tree.set_merkle_root(self._root)
+                tree.get(address)
+                reads.append(time.perf_counter() - start)
+            else:
+                start = time.perf_counter()
+                with self._write_lock:
+                    updates = {}
+                    for _ in range(self._args.batch):
+                        # half of the writes modify existing addresses
+                        if rand.random() < 0.5:
+                            key = rand.randrange(self._args.keys)
+                        else:
+                            key = self._next_key
+                            self._next_key += 1
+                        updates[make_address(key)] = self._value
+                    tree.set_merkle_root(self._root)
+                    self._update(tree, updates)
+                writes.append(time.perf_counter() - start)
+
+
+def run_backend(name, args):
+    """Runs the workload on a backend, in a fresh process.
+
+    Returns:
+        dict: the results of the backend
+    """
+    temp_dir = tempfile.mkdtemp()
+    try:
+        database = BACKENDS[name](os.path.join(temp_dir, 'merkle.db'))
+        rss_before = rss_bytes()
+
+        start = time.perf_counter()
+        workload = Workload(database, args)
+        load_seconds = time.perf_counter() - start
+
+        reads = [[] for _ in range(args.threads)]
+        writes = [[] for _ in range(args.threads)]
+        threads = [Thread(target=workload.run_thread,
+                          args=(args.seed + i, reads[i], writes[i]))
+                   for i in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        # sync() is not implemented by every backend
+        try:
+            database.sync()
+        except NotImplementedError:
+            pass
+        reads = [latency for thread_reads in reads
+                 for latency in thread_reads]
+        writes = [latency for thread_writes in writes
+                  for latency in thread_writes]
+        result = {
+            'backend': name,
+            'load_seconds': round(load_seconds, 3),
+            'seconds': round(elapsed, 3),
+            'ops_per_sec': round((len(reads) + len(writes)) / elapsed, 1),
+            'reads': latency_summary(reads),
+            'writes': latency_summary(writes),
+            'file_bytes': directory_size(temp_dir),
+            'rss_bytes': rss_bytes(),
+            'rss_growth_bytes': rss_bytes() - rss_before,
+        }
+        database.close()
+        return result
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', default=','.join(sorted(BACKENDS)),
+                        help='comma separated backends, among {}'.format(
+                            ', '.join(sorted(BACKENDS))))
+    parser.add_argument('--keys', type=int, default=10000,
+                        help='the number of addresses in the loaded state')
+    parser.add_argument('--value-size', type=int, default=100,
+                        help='the size of the values, in bytes')
+    parser.add_argument('--ops', type=int, default=2000,
+                        help='the number of operations per thread')
+    parser.add_argument('--read-ratio', type=float, default=0.9,
+                        help='the share of the operations which are reads')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=10,
+                        help='the number of addresses per write')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output',
+                        help='the file to write the JSON results to, '
+                             'instead of the standard output')
+    args = parser.parse_args()
+
+    names = args.backends.split(',')
+    for name in names:
+        if name not in BACKENDS:
+            parser.error('unknown backend {}'.format(name))
+
+    results = []
+    for name in names:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results.append(pool.submit(run_backend, name, args).result())
+
+    report = {
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('backends', 'output')},
+        'python': platform.python_version(),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out_file:
+            out_file.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Measures the cost of reading and decoding a Merkle trie node from LMDB
+with CBOR encoded values and with raw values, decoding either a copy of the
+node or a buffer of it within a read transaction.
+
+Usage:
+    python3 bench_lmdb_raw.py [--keys N] [--reads N]
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from sawtooth_validator.database.dict_database import DictDatabase
+from sawtooth_validator.database.lmdb_nolock_database import \
+    LMDBNoLockDatabase
+from sawtooth_validator.state.merkle import MerkleDatabase
+from sawtooth_validator.state.node_codec import CBOR_NODE_FORMAT
+from sawtooth_validator.state.node_codec import COMPACT_NODE_FORMAT
+from sawtooth_validator.state.node_codec import decode_node
+
+
+def make_address(i):
+    return '1cf126' + hashlib.sha512(str(i).encode()).hexdigest()[:64]
+
+
+def fetch(database, keys):
+    start = time.perf_counter()
+    for key in keys:
+        database.get(key)
+    return time.perf_counter() - start
+
+
+def fetch_decode(database, keys):
+    start = time.perf_counter()
+    for key in keys:
+        decode_node(database.get(key))
+    return time.perf_counter() - start
+
+
+def fetch_decode_txn(database, keys):
+    start = time.perf_counter()
+    with database.read_txn() as txn:
+        for key in keys:
+            decode_node(txn.get(key))
+    return time.perf_counter() - start
+
+
+def run(directory, node_format, args):
+    nodes = DictDatabase()
+    tree = MerkleDatabase(nodes, node_format=node_format,
+                          compress_paths=True)
+    for first in range(0, args.keys, args.batch):
+        last = min(args.keys, first + args.batch)
+        tree.set_merkle_root(tree.update(
+            {make_address(i): i for i in range(first, last)},
+            virtual=False))
+    keys = nodes.keys()
+    rand = random.Random(1)
+    read_keys = [rand.choice(keys) for _ in range(args.reads)]
+
+    results = {}
+    for raw in [False, True]:
+        filename = os.path.join(directory, 'nodes.lmdb')
+        database = LMDBNoLockDatabase(filename, 'n', raw=raw)
+        database.set_batch((key, nodes.get(key)) for key in keys)
+        mode = 'raw' if raw else 'cbor'
+        reads = [('{} get'.format(mode), fetch),
+                 ('{} get+decode'.format(mode), fetch_decode)]
+        if raw:
+            reads.append(('raw read_txn+decode', fetch_decode_txn))
+        for name, read in reads:
+            read(database, read_keys)
+            results[name] = min(read(database, read_keys)
+                                for _ in range(args.rounds)) / args.reads
+        database.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--keys', type=int, default=50000,
+                        help='the number of addresses in the trie')
+    parser.add_argument('--batch', type=int, default=10000,
+                        help='the number of addresses per update while '
+                        'building the trie')
+    parser.add_argument('--reads', type=int, default=50000,
+                        help='the number of nodes read per round')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='the number of timed rounds, the best is kept')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        results = [(node_format, run(directory, node_format, args))
+                   for node_format in [CBOR_NODE_FORMAT, COMPACT_NODE_FORMAT]]
+    finally:
+        shutil.rmtree(directory)
+
+    print('{} addresses, {} random node reads, us per node'.format(
+        args.keys, args.reads))
+    print('  {:<24}'.format('') +
+          ''.join('{:>10}'.format(name) for name, _ in results))
+    for name in results[0][1]:
+        print('  {:<24}'.format(name) +
+              ''.join('{:>10.2f}'.format(result[name] * 1e6)
+                      for _, result in results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Compares path compressed and uncompressed Merkle tries: load time, read
+and update latency, nodes touched per read and database size.
+
+Usage:
+    python3 bench_merkle_compression.py [--keys N] [--reads N] [--updates N]
+        [--modes uncompressed compressed]
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from sawtooth_validator.database.lmdb_nolock_database import \
+    LMDBNoLockDatabase
+from sawtooth_validator.state.merkle import MerkleDatabase
+from sawtooth_validator.state.node_codec import COMPACT_NODE_FORMAT
+
+
+def make_address(i):
+    return '1cf126' + hashlib.sha512(str(i).encode()).hexdigest()[:64]
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def nodes_touched(tree, address):
+    """Returns the number of nodes read to reach the address from the root,
+    the root included.
+    """
+    node = tree.get_node('')
+    count = 1
+    rest = address
+    while rest:
+        label = next(label for label in node['c'] if rest.startswith(label))
+        node = tree._get_by_hash(node['c'][label])
+        rest = rest[len(label):]
+        count += 1
+    return count
+
+
+def run(directory, compress_paths, args):
+    filename = os.path.join(directory, 'merkle-{}.lmdb'.format(
+        'compressed' if compress_paths else 'uncompressed'))
+    database = LMDBNoLockDatabase(filename, 'n')
+    tree = MerkleDatabase(database, node_format=COMPACT_NODE_FORMAT,
+                          compress_paths=compress_paths)
+
+    start = time.perf_counter()
+    for first in range(0, args.keys, args.batch):
+        last = min(args.keys, first + args.batch)
+        tree.set_merkle_root(tree.update(
+            {make_address(i): i for i in range(first, last)}, virtual=False))
+    load_time = time.perf_counter() - start
+
+    rand = random.Random(1)
+    read_addresses = [make_address(rand.randrange(args.keys))
+                      for _ in range(args.reads)]
+    read_times = []
+    for address in read_addresses:
+        start = time.perf_counter()
+        tree.get(address)
+        read_times.append(time.perf_counter() - start)
+
+    update_times = []
+    for _ in range(args.rounds):
+        updates = {make_address(rand.randrange(args.keys)): -1
+                   for _ in range(args.updates)}
+        start = time.perf_counter()
+        tree.update(updates)
+        update_times.append(time.perf_counter() - start)
+
+    touched = [nodes_touched(tree, address)
+               for address in read_addresses[:100]]
+    entries = len(database)
+    database.close()
+    # the space used by the file, as the LMDB map is allocated sparsely
+    size = os.stat(filename).st_blocks * 512
+
+    return {
+        'load': load_time,
+        'read p50': percentile(read_times, 0.5) * 1000,
+        'read p99': percentile(read_times, 0.99) * 1000,
+        'update p50': percentile(update_times, 0.5) * 1000,
+        'nodes per read': sum(touched) / len(touched),
+        'db entries': entries,
+        'db MB': size / 1024 ** 2,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--keys', type=int, default=1000000,
+                        help='the number of addresses in the state')
+    parser.add_argument('--batch', type=int, default=10000,
+                        help='the number of addresses per update while '
+                        'loading the state')
+    parser.add_argument('--reads', type=int, default=10000,
+                        help='the number of single address reads timed')
+    parser.add_argument('--updates', type=int, default=1000,
+                        help='the number of addresses per timed update')
+    parser.add_argument('--rounds', type=int, default=10,
+                        help='the number of timed updates')
+    parser.add_argument('--modes', nargs='+',
+                        choices=['uncompressed', 'compressed'],
+                        default=['uncompressed', 'compressed'])
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        results = [(mode, run(directory, mode == 'compressed', args))
+                   for mode in args.modes]
+    finally:
+        shutil.rmtree(directory)
+
+    print('{} addresses, compact nodes, reads without a node cache'.format(
+        args.keys))
+    print('  {:<16}'.format('') +
+          ''.join('{:>14}'.format(name) for name, _ in results))
+    units = {'load': 's', 'read p50': 'ms', 'read p99': 'ms',
+             'update p50': 'ms'}
+    for metric in results[0][1]:
+        print('  {:<16}'.format('{} {}'.format(
+            metric, units.get(metric, '')).strip()) +
+            ''.join('{:>14.3f}'.format(result[metric])
+                    if isinstance(result[metric], float)
+                    else '{:>14}'.format(result[metric])
+                    for _, result in results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Measures the latency of generating and verifying the proof of a single
+address, with and without a node cache, and the size of the proofs.
+
+Usage:
+    python3 bench_merkle_proof.py [--keys N] [--lookups N]
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from sawtooth_sdk.client.proof import verify_proof
+from sawtooth_validator.database.lmdb_nolock_database import \
+    LMDBNoLockDatabase
+from sawtooth_validator.state.merkle import MerkleDatabase
+from sawtooth_validator.state.node_cache import NodeCache
+from sawtooth_validator.state.node_codec import COMPACT_NODE_FORMAT
+
+
+def make_address(i):
+    return '1cf126' + hashlib.sha512(str(i).encode()).hexdigest()[:64]
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def time_proofs(tree, addresses):
+    times = []
+    for address in addresses:
+        start = time.perf_counter()
+        tree.get_proof(address)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--keys', type=int, default=100000,
+                        help='the number of addresses in the state')
+    parser.add_argument('--batch', type=int, default=10000,
+                        help='the number of addresses per update while '
+                        'loading the state')
+    parser.add_argument('--lookups', type=int, default=10000,
+                        help='the number of proofs timed')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        database = LMDBNoLockDatabase(
+            os.path.join(directory, 'merkle.lmdb'), 'n')
+        tree = MerkleDatabase(database, node_format=COMPACT_NODE_FORMAT,
+                              compress_paths=True)
+        for first in range(0, args.keys, args.batch):
+            last = min(args.keys, first + args.batch)
+            tree.set_merkle_root(tree.update(
+                {make_address(i): i for i in range(first, last)},
+                virtual=False))
+        root = tree.get_merkle_root()
+
+        rand = random.Random(1)
+        indexes = [rand.randrange(args.keys) for _ in range(args.lookups)]
+        addresses = [make_address(i) for i in indexes]
+
+        results = [('no cache', time_proofs(tree, addresses))]
+        cached = MerkleDatabase(database, root, node_cache=NodeCache(),
+                                compress_paths=True)
+        # the first pass fills the cache
+        time_proofs(cached, addresses)
+        results.append(('warm cache', time_proofs(cached, addresses)))
+
+        proofs = [tree.get_proof(address) for address in addresses]
+        verify_times = []
+        for i, address, proof in zip(indexes, addresses, proofs):
+            start = time.perf_counter()
+            if not verify_proof(root, address, i, proof):
+                raise AssertionError('invalid proof of {}'.format(address))
+            verify_times.append(time.perf_counter() - start)
+        results.append(('verify', verify_times))
+
+        database.close()
+    finally:
+        shutil.rmtree(directory)
+
+    print('{} addresses, {} lookups, compact nodes, path compression'.format(
+        args.keys, args.lookups))
+    print('  {:<12}{:>10}{:>10}'.format('', 'p50 ms', 'p99 ms'))
+    for name, times in results:
+        print('  {:<12}{:>10.3f}{:>10.3f}'.format(
+            name, percentile(times, 0.5) * 1000,
+            percentile(times, 0.99) * 1000))
+    print('  nodes per proof {:.2f}, bytes per proof {:.0f}'.format(
+        sum(len(proof) for proof in proofs) / len(proofs),
+        sum(len(node) for proof in proofs for node in proof) / len(proofs)))
+
+
+if __name__ == '__main__':
+    main()
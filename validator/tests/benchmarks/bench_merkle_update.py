@@ -0,0 +1,147 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Compares MerkleDatabase.update against the previous path-map based
+update, serially and with subtrees hashed by a process pool.
+
+Usage:
+    python3 bench_merkle_update.py [--keys N] [--updates N] [--workers N]
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import time
+
+from sawtooth_validator.database.dict_database import DictDatabase
+from sawtooth_validator.state import merkle
+from sawtooth_validator.state.merkle import MerkleDatabase
+
+
+def _tokenize_address(address):
+    return [address[i:i + merkle.TOKEN_SIZE]
+            for i in range(0, len(address), merkle.TOKEN_SIZE)]
+
+
+def _get_path_by_addr(tree, address):
+    """Returns copies of the nodes on the path to address, keyed by their
+    path, with empty nodes for the part of the path not in the trie.
+    """
+    node = tree._get_by_hash(tree.get_merkle_root())
+    path = ''
+    nodes = {path: MerkleDatabase._copy_node(node)}
+    new_branch = False
+
+    for token in _tokenize_address(address):
+        path = path + token
+        if token in node['c'] and not new_branch:
+            node = tree._get_by_hash(node['c'][token])
+            nodes[path] = MerkleDatabase._copy_node(node)
+        else:
+            nodes[path] = {"v": None, "c": {}}
+            new_branch = True
+    return nodes
+
+
+def _encode_and_hash(tree, node):
+    packed = tree._encode_node(node)
+    return (MerkleDatabase.hash(packed), packed)
+
+
+def legacy_update(tree, set_items):
+    """The update algorithm MerkleDatabase used before the dirty node
+    overlay: a path map per address, re-hashed in order of path length.
+    """
+    path_map = {}
+    batch = []
+
+    for set_address in set_items:
+        path_map.update(_get_path_by_addr(tree, set_address))
+        path_map[set_address]["v"] = tree._encode(set_items[set_address])
+
+    for path in sorted(path_map, key=len, reverse=True):
+        (key_hash, packed) = _encode_and_hash(tree, path_map[path])
+        batch.append((key_hash, packed))
+        if path != '':
+            parent_address = path[:-merkle.TOKEN_SIZE]
+            path_branch = path[-merkle.TOKEN_SIZE:]
+            path_map[parent_address]['c'][path_branch] = key_hash
+    return key_hash
+
+
+def make_address(i):
+    # a common namespace prefix, as transaction families use
+    return '1cf126' + hashlib.sha512(str(i).encode()).hexdigest()[:64]
+
+
+def timed(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--keys', type=int, default=10000,
+                        help='the number of addresses in the base state')
+    parser.add_argument('--updates', type=int, default=5000,
+                        help='the number of addresses in the update')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='the size of the hashing process pool')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    database = DictDatabase()
+    tree = MerkleDatabase(database)
+    tree.set_merkle_root(tree.update(
+        {make_address(i): i for i in range(args.keys)}, virtual=False))
+
+    # half of the update modifies existing addresses, half adds new ones
+    first = args.keys - args.updates // 2
+    updates = {make_address(i): -i
+               for i in range(first, first + args.updates)}
+
+    legacy_time, legacy_root = timed(
+        lambda: legacy_update(tree, updates), args.repeat)
+    serial_time, serial_root = timed(
+        lambda: tree.update(updates), args.repeat)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        parallel_tree = MerkleDatabase(database, tree.get_merkle_root(),
+                                       hash_executor=pool)
+        # start the workers before timing
+        list(pool.map(abs, range(args.workers)))
+        parallel_time, parallel_root = timed(
+            lambda: parallel_tree.update(updates), args.repeat)
+
+    if not legacy_root == serial_root == parallel_root:
+        raise AssertionError('update engines produced different roots')
+
+    print('{} addresses updated over a {} address state'.format(
+        args.updates, args.keys))
+    for name, elapsed in [('legacy path map', legacy_time),
+                          ('dirty overlay', serial_time),
+                          ('dirty overlay, {} workers'.format(args.workers),
+                           parallel_time)]:
+        print('  {:<28} {:8.3f}s  {:10.0f} addresses/s'.format(
+            name, elapsed, args.updates / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Compares StateContext against the previous context, with one future and
+one condition per address, by the contexts created per second and the
+memory each one takes.
+
+Each context is created, has its inputs set as a reader thread sets them,
+and its outputs set as a transaction does, and its values are read back.
+
+Usage:
+    python3 bench_state_context.py [--contexts N] [--inputs N]
+        [--outputs N]
+"""
+
+import argparse
+import hashlib
+from threading import Condition
+import time
+import tracemalloc
+
+from sawtooth_validator.execution.context_manager import StateContext
+
+
+def make_address(i):
+    return '1cf126' + hashlib.sha512(str(i).encode()).hexdigest()[:64]
+
+
+class _LegacyFuture(object):
+    def __init__(self, address):
+        self.address = address
+        self._result = None
+        self._result_is_set = False
+        self._condition = Condition()
+
+    def result(self):
+        with self._condition:
+            if not self._result_is_set:
+                self._condition.wait(2)
+        return self._result
+
+    def set_result(self, result):
+        with self._condition:
+            self._result = result
+            self._result_is_set = True
+            self._condition.notify_all()
+
+
+class _LegacyContext(object):
+    """The context as it was: an id hashed from the time, and a future per
+    address.
+    """
+    def __init__(self, state_hash, read_list, write_list):
+        self._state_hash = state_hash
+        self._read_list = read_list
+        self._write_list = write_list
+        self._address_value_dict = {}
+        self._id = hashlib.sha256((str(state_hash) + ":" +
+                                  str(read_list + write_list) + ":" +
+                                  str(time.time())).encode()).hexdigest()
+        for add in read_list + write_list:
+            self._address_value_dict[add] = _LegacyFuture(add)
+
+    def set_futures(self, address_value_dict):
+        for add, val in address_value_dict.items():
+            self._address_value_dict.get(add).set_result(val)
+
+    def get_all_values(self):
+        return {add: future.result()
+                for add, future in self._address_value_dict.items()}
+
+
+def legacy_context(i, inputs, outputs):
+    context = _LegacyContext('root', inputs, outputs)
+    context.set_futures({address: i for address in inputs})
+    context.set_futures({address: i for address in outputs})
+    return context
+
+
+def slot_context(i, inputs, outputs):
+    context = StateContext('prefix-{:x}'.format(i), 'root', inputs, outputs)
+    context.set_prefetched({address: i for address in inputs})
+    context.set_values({address: i for address in outputs})
+    return context
+
+
+def contexts_per_sec(make_context, args, inputs, outputs):
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for i in range(args.contexts):
+            make_context(i, inputs, outputs).get_all_values()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return args.contexts / best
+
+
+def bytes_per_context(make_context, args, inputs, outputs):
+    """Returns the memory allocated per live context, the addresses aside,
+    as they are shared with the transactions.
+    """
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    contexts = [make_context(i, inputs, outputs)
+                for i in range(args.contexts)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del contexts
+    return (after - before) / args.contexts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--contexts', type=int, default=10000,
+                        help='the number of contexts created')
+    parser.add_argument('--inputs', type=int, default=4,
+                        help='the number of inputs of each context')
+    parser.add_argument('--outputs', type=int, default=2,
+                        help='the number of outputs of each context, '
+                             'among its inputs')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    inputs = [make_address(i) for i in range(args.inputs)]
+    outputs = inputs[:args.outputs]
+
+    print('{} contexts of {} inputs and {} outputs'.format(
+        args.contexts, args.inputs, args.outputs))
+    for name, make_context in [('legacy futures', legacy_context),
+                               ('slot array', slot_context)]:
+        print('  {:<16} {:10.0f} contexts/s  {:8.0f} bytes/context'.format(
+            name, contexts_per_sec(make_context, args, inputs, outputs),
+            bytes_per_context(make_context, args, inputs, outputs)))
+
+
+if __name__ == '__main__':
+    main()
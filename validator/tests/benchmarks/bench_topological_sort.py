@@ -0,0 +1,137 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Compares TopologicalSorter against the previous quadratic sorter, on
+the dependency graphs of blocks of 1k, 10k and 100k transactions.
+
+Each transaction uses --addresses-per-txn addresses drawn among --keys,
+and depends on the previous transaction using each of them, as the
+transactions of a block writing the same addresses do. The graph is built
+as the transactions arrive, then ordered.
+
+Usage:
+    python3 bench_topological_sort.py [--sizes 1000,10000,100000]
+        [--legacy-max N] [--keys N] [--addresses-per-txn N]
+"""
+
+import argparse
+import random
+import time
+
+from sawtooth_validator.execution.scheduler_parallel import TopologicalSorter
+
+
+class _LegacyTopologicalSorter:
+    """The sorter as it was: a scan of the identifiers for one without
+    predecessors at each step.
+    """
+    def __init__(self):
+        self._count = {}
+        self._successors = {}
+        self._identifiers = []
+
+    def _init(self, identifier):
+        if identifier not in self._count:
+            self._count[identifier] = 0
+        if identifier not in self._successors:
+            self._successors[identifier] = []
+        if identifier not in self._identifiers:
+            self._identifiers.append(identifier)
+
+    def add_relation(self, predecessor, successor):
+        self._init(predecessor)
+        self._init(successor)
+        self._count[successor] += 1
+        self._successors[predecessor].append(successor)
+
+    def order(self):
+        retval = []
+
+        while len(self._identifiers) > 0:
+            found = None
+            for identifier in self._identifiers:
+                if self._count[identifier] == 0:
+                    found = identifier
+                    break
+            if found is not None:
+                retval.append(found)
+                for successor in self._successors[found]:
+                    self._count[successor] -= 1
+
+                self._identifiers.remove(found)
+                del self._count[found]
+                del self._successors[found]
+            else:
+                raise Exception("non-acyclic graph detected, aborting")
+
+        return retval
+
+
+def make_relations(size, args):
+    """Returns the (predecessor, successor) relations of a block of size
+    transactions.
+    """
+    rand = random.Random(args.seed)
+    last_user = {}
+    relations = []
+    for txn in range(size):
+        identifier = 'txn-{}'.format(txn)
+        for key in rand.sample(range(args.keys), args.addresses_per_txn):
+            if key in last_user:
+                relations.append((last_user[key], identifier))
+            last_user[key] = identifier
+    return relations
+
+
+def timed(sorter_class, relations):
+    start = time.perf_counter()
+    sorter = sorter_class()
+    for predecessor, successor in relations:
+        sorter.add_relation(predecessor, successor)
+    added = time.perf_counter()
+    order = sorter.order()
+    done = time.perf_counter()
+    return added - start, done - added, order
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated numbers of transactions')
+    parser.add_argument('--legacy-max', type=int, default=10000,
+                        help='the largest block the previous sorter orders')
+    parser.add_argument('--keys', type=int, default=1000,
+                        help='the number of addresses used')
+    parser.add_argument('--addresses-per-txn', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        relations = make_relations(size, args)
+        print('{} transactions, {} relations'.format(size, len(relations)))
+        add_time, order_time, order = timed(TopologicalSorter, relations)
+        print('  {:<10} add {:8.3f}s  order {:8.3f}s'.format(
+            'indexed', add_time, order_time))
+        if size > args.legacy_max:
+            continue
+        add_time, order_time, legacy_order = timed(
+            _LegacyTopologicalSorter, relations)
+        print('  {:<10} add {:8.3f}s  order {:8.3f}s'.format(
+            'legacy', add_time, order_time))
+        if order != legacy_order:
+            raise AssertionError('sorters produced different orders')
+
+
+if __name__ == '__main__':
+    main()
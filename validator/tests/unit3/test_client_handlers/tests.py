@@ -0,0 +1,235 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sawtooth_sdk.client.proof import verify_proof
+from sawtooth_validator.database.dict_database import DictDatabase
+from sawtooth_validator.database.lmdb_nolock_database import \
+    LMDBNoLockDatabase
+from sawtooth_validator.protobuf import client_pb2
+from sawtooth_validator.state.client_handlers import StateDiffRequestHandler
+from sawtooth_validator.state.client_handlers import StateGetRequestHandler
+from sawtooth_validator.state.client_handlers import StateListRequestHandler
+from sawtooth_validator.state.client_handlers import \
+    StateProofRequestHandler
+from sawtooth_validator.state.merkle import MerkleDatabase
+
+
+def _address(name):
+    return MerkleDatabase.hash(name.encode())
+
+
+class TestStateDiffRequestHandler(unittest.TestCase):
+    def test_handle(self):
+        """Tests that the handler lists the changes between two roots, and
+        reports unknown roots as NORESOURCE.
+        """
+        database = DictDatabase()
+        tree = MerkleDatabase(database)
+        old_root = tree.update({_address('a'): b'1', _address('b'): b'2'},
+                               virtual=False)
+        tree.set_merkle_root(old_root)
+        tree.set_merkle_root(tree.update({_address('a'): b'3'},
+                                         virtual=False))
+        new_root = tree.delete(_address('b'))
+
+        handler = StateDiffRequestHandler(database)
+        request = client_pb2.ClientStateDiffRequest(
+            old_merkle_root=old_root, new_merkle_root=new_root)
+        response = client_pb2.ClientStateDiffResponse()
+        response.ParseFromString(handler.handle(
+            None, request.SerializeToString()).message_out.SerializeToString())
+
+        self.assertEqual(response.OK, response.status)
+        changes = {change.address: change for change in response.changes}
+        self.assertEqual(client_pb2.ClientStateChange.MODIFIED,
+                         changes[_address('a')].type)
+        self.assertEqual(b'3', changes[_address('a')].new_data)
+        self.assertEqual(client_pb2.ClientStateChange.DELETED,
+                         changes[_address('b')].type)
+        self.assertEqual(b'2', changes[_address('b')].old_data)
+
+        request.old_merkle_root = _address('missing')
+        result = handler.handle(None, request.SerializeToString())
+        self.assertEqual(response.NORESOURCE, result.message_out.status)
+
+
+class _CountingEnvironment(object):
+    """Counts the transactions begun on an LMDB environment.
+    """
+    def __init__(self, lmdb_env):
+        self._lmdb = lmdb_env
+        self.begun = 0
+
+    def begin(self, **kwargs):
+        self.begun += 1
+        return self._lmdb.begin(**kwargs)
+
+
+class TestStateGetRequestHandler(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_handle(self):
+        """Tests that the handler returns the value at an address, and the
+        statuses of absent addresses, interior nodes and unknown roots.
+        """
+        database = DictDatabase()
+        tree = MerkleDatabase(database)
+        root = tree.update({_address('a'): b'1'}, virtual=False)
+
+        handler = StateGetRequestHandler(database)
+        request = client_pb2.ClientStateGetRequest(
+            merkle_root=root, address=_address('a'))
+        response = handler.handle(None, request.SerializeToString()).message_out
+        self.assertEqual(response.OK, response.status)
+        self.assertEqual(b'1', response.value)
+
+        for address, status in [(_address('b'), response.NORESOURCE),
+                                (_address('a')[:2], response.NONLEAF)]:
+            request.address = address
+            response = handler.handle(
+                None, request.SerializeToString()).message_out
+            self.assertEqual(status, response.status)
+
+        request.merkle_root = _address('missing')
+        response = handler.handle(None, request.SerializeToString()).message_out
+        self.assertEqual(response.NORESOURCE, response.status)
+
+    def test_single_read_transaction(self):
+        """Tests that all the reads of a request run within a single read
+        transaction.
+        """
+        database = LMDBNoLockDatabase(
+            os.path.join(self._temp_dir, 'merkle.lmdb'), 'n', raw=True)
+        tree = MerkleDatabase(database)
+        updates = {_address(str(i)): str(i).encode() for i in range(25)}
+        root = tree.update(updates, virtual=False)
+        counting = _CountingEnvironment(database._lmdb)
+        database._lmdb = counting
+
+        request = client_pb2.ClientStateListRequest(merkle_root=root)
+        response = StateListRequestHandler(database).handle(
+            None, request.SerializeToString()).message_out
+        self.assertEqual(25, len(response.entries))
+
+        request = client_pb2.ClientStateGetRequest(
+            merkle_root=root, address=_address('7'))
+        response = StateGetRequestHandler(database).handle(
+            None, request.SerializeToString()).message_out
+        self.assertEqual(b'7', response.value)
+        self.assertEqual(2, counting.begun)
+        database._lmdb = counting._lmdb
+        database.close()
+
+
+class TestStateProofRequestHandler(unittest.TestCase):
+    def test_handle(self):
+        """Tests that the handler returns the value at an address with a
+        proof which verifies against the merkle root, an empty value with a
+        proof of absence for an absent address or an interior node, and
+        NORESOURCE for an unknown root.
+        """
+        database = DictDatabase()
+        tree = MerkleDatabase(database)
+        root = tree.update({_address('a'): b'1', _address('b'): b'2'},
+                           virtual=False)
+
+        handler = StateProofRequestHandler(database)
+        request = client_pb2.ClientStateProofRequest(
+            merkle_root=root, address=_address('a'))
+        response = handler.handle(None, request.SerializeToString()).message_out
+        self.assertEqual(response.OK, response.status)
+        self.assertEqual(b'1', response.value)
+        self.assertTrue(verify_proof(root, _address('a'), response.value,
+                                     list(response.proof)))
+
+        request.address = _address('c')
+        response = handler.handle(None, request.SerializeToString()).message_out
+        self.assertEqual(response.OK, response.status)
+        self.assertEqual(b'', response.value)
+        self.assertTrue(verify_proof(root, _address('c'), None,
+                                     list(response.proof)))
+
+        # an interior node, which has no value
+        request.address = _address('a')[:2]
+        response = handler.handle(None, request.SerializeToString()).message_out
+        self.assertEqual(response.OK, response.status)
+        self.assertEqual(b'', response.value)
+        self.assertTrue(verify_proof(root, request.address, None,
+                                     list(response.proof)))
+
+        request.merkle_root = _address('missing')
+        response = handler.handle(None, request.SerializeToString()).message_out
+        self.assertEqual(response.NORESOURCE, response.status)
+
+
+class TestStateListRequestHandler(unittest.TestCase):
+    def test_paging(self):
+        """Tests that the entries are listed in pages of limit entries, each
+        giving the start of the next one.
+        """
+        database = DictDatabase()
+        tree = MerkleDatabase(database)
+        updates = {_address(str(i)): str(i).encode() for i in range(25)}
+        root = tree.update(updates, virtual=False)
+
+        handler = StateListRequestHandler(database)
+        request = client_pb2.ClientStateListRequest(merkle_root=root,
+                                                    limit=10)
+        listed = []
+        pages = 0
+        while True:
+            result = handler.handle(None, request.SerializeToString())
+            response = result.message_out
+            self.assertEqual(response.OK, response.status)
+            listed.extend((e.address, e.data) for e in response.entries)
+            pages += 1
+            if not response.next:
+                break
+            request.start = response.next
+
+        self.assertEqual(3, pages)
+        self.assertEqual(sorted(updates.items()), listed)
+
+        # without a limit, everything is listed at once
+        request = client_pb2.ClientStateListRequest(merkle_root=root)
+        response = handler.handle(None,
+                                  request.SerializeToString()).message_out
+        self.assertEqual(25, len(response.entries))
+        self.assertEqual('', response.next)
+
+    def test_missing_node(self):
+        """Tests that a node missing below the root, which is only found
+        while the leaves are listed, is reported as NORESOURCE.
+        """
+        database = DictDatabase()
+        tree = MerkleDatabase(database)
+        root = tree.update({_address(str(i)): b'1' for i in range(5)},
+                           virtual=False)
+        tree.set_merkle_root(root)
+        database.delete(next(iter(tree.get_node('')['c'].values())))
+
+        handler = StateListRequestHandler(database)
+        request = client_pb2.ClientStateListRequest(merkle_root=root)
+        response = handler.handle(None, request.SerializeToString()).message_out
+        self.assertEqual(response.NORESOURCE, response.status)
@@ -0,0 +1,310 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+from threading import Event
+import time
+import unittest
+
+from sawtooth_validator.database.dict_database import DictDatabase
+from sawtooth_validator.execution.context_manager import \
+    AuthorizationException
+from sawtooth_validator.execution.context_manager import ContextManager
+from sawtooth_validator.execution.context_manager import StateContext
+from sawtooth_validator.execution.context_manager import StateValueCache
+from sawtooth_validator.state.merkle import MerkleDatabase
+
+
+def _address(name):
+    return MerkleDatabase.hash(name.encode())
+
+
+class TestContextManager(unittest.TestCase):
+    def setUp(self):
+        self.context_manager = ContextManager(DictDatabase())
+        self.first_root = self.context_manager.get_first_root()
+
+    def test_missing_state(self):
+        """Tests that the futures of a context whose state is missing are
+        resolved, and that the contexts created after it are still read.
+        """
+        address = _address('a')
+        squash = self.context_manager.get_squash_handler()
+        c_id = self.context_manager.create_context(
+            self.first_root, [address], [address])
+        self.context_manager.set(c_id, [{address: 1}])
+        root = squash(self.first_root, [c_id])
+
+        missing = self.context_manager.create_context(
+            MerkleDatabase.hash(b'missing'), [address], [address])
+        self.assertEqual([(address, None)],
+                         self.context_manager.get(missing, [address]))
+
+        c_id = self.context_manager.create_context(root, [address], [])
+        self.assertEqual([(address, 1)],
+                         self.context_manager.get(c_id, [address]))
+
+    def test_in_flight_roots(self):
+        """Tests that the roots of the existing contexts, and the roots
+        written since the previous call, are in flight.
+        """
+        address = _address('a')
+        squash = self.context_manager.get_squash_handler()
+        c_id = self.context_manager.create_context(
+            self.first_root, [address], [address])
+        self.context_manager.set(c_id, [{address: 1}])
+        root = squash(self.first_root, [c_id])
+
+        self.assertEqual({self.first_root, root},
+                         self.context_manager.collect_in_flight_roots())
+        self.context_manager.delete_context([c_id])
+        self.assertEqual(set(),
+                         self.context_manager.collect_in_flight_roots())
+
+    def test_value_cache(self):
+        """Tests that the values written by a squash, and those read by a
+        context, are read from the value cache by the next contexts on the
+        same root, and not for other roots.
+        """
+        first, second = _address('a'), _address('b')
+        squash = self.context_manager.get_squash_handler()
+        c_id = self.context_manager.create_context(
+            self.first_root, [first], [first])
+        # waits for the context's read
+        self.context_manager.get(c_id, [first])
+        self.context_manager.set(c_id, [{first: 1}])
+        root = squash(self.first_root, [c_id])
+        metrics = self.context_manager.value_cache.metrics
+
+        for _ in range(2):
+            c_id = self.context_manager.create_context(
+                root, [first, second], [])
+            self.assertEqual([(first, 1), (second, None)],
+                             self.context_manager.get(c_id, [first, second]))
+        # the written value is cached, and the missing one once read
+        self.assertEqual(metrics['hits'] + 3,
+                         self.context_manager.value_cache.metrics['hits'])
+        self.assertEqual(metrics['misses'] + 1,
+                         self.context_manager.value_cache.metrics['misses'])
+
+        c_id = self.context_manager.create_context(
+            self.first_root, [first], [])
+        self.assertEqual([(first, None)],
+                         self.context_manager.get(c_id, [first]))
+
+
+class TestContextLifecycle(unittest.TestCase):
+    def test_owned_contexts(self):
+        """Tests that deleting the contexts of an owner deletes those only,
+        and that the gauges follow.
+        """
+        context_manager = ContextManager(DictDatabase())
+        try:
+            address = _address('a')
+            root = context_manager.get_first_root()
+            owned = [context_manager.create_context(
+                root, [address], [address], owner='scheduler')
+                     for _ in range(3)]
+            other = context_manager.create_context(root, [address], [])
+            context_manager.get(other, [address])
+            context_manager.set(owned[0], [{address: b'value'}])
+            metrics = context_manager.context_metrics
+            self.assertEqual(4, metrics['live_contexts'])
+            self.assertEqual(1, metrics['owners'])
+            self.assertGreater(metrics['prefetched_bytes'], len(b'value'))
+
+            context_manager.delete_context([owned[1]])
+            self.assertEqual(
+                2, context_manager.delete_owned_contexts('scheduler'))
+            self.assertEqual(
+                0, context_manager.delete_owned_contexts('scheduler'))
+            self.assertEqual([], context_manager.get(owned[0], [address]))
+            self.assertEqual([(address, None)],
+                             context_manager.get(other, [address]))
+            metrics = context_manager.context_metrics
+            self.assertEqual(1, metrics['live_contexts'])
+            self.assertEqual(0, metrics['owners'])
+            self.assertEqual(2, metrics['released_contexts'])
+        finally:
+            context_manager.stop()
+
+    def test_expired_contexts(self):
+        """Tests that the contexts older than the TTL are deleted, and not
+        the younger ones.
+        """
+        context_manager = ContextManager(DictDatabase(), context_ttl=0.2)
+        try:
+            root = context_manager.get_first_root()
+            old = context_manager.create_context(root, [], [], owner='old')
+            time.sleep(0.25)
+            young = context_manager.create_context(root, [], [])
+            context_manager.delete_expired_contexts()
+            self.assertFalse(context_manager.set(old, []))
+            self.assertTrue(context_manager.set(young, []))
+            metrics = context_manager.context_metrics
+            self.assertEqual(1, metrics['expired_contexts'])
+            self.assertEqual(0, metrics['owners'])
+
+            # the sweeper deletes the young one in time
+            for _ in range(50):
+                if not context_manager.context_metrics['live_contexts']:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(
+                0, context_manager.context_metrics['live_contexts'])
+        finally:
+            context_manager.stop()
+
+
+class TestStateOverlayContexts(unittest.TestCase):
+    def test_flush_state(self):
+        """Tests that the states computed by squashes are readable by the
+        next contexts without being written, and that flush_state() writes
+        the final state only.
+        """
+        database = DictDatabase()
+        context_manager = ContextManager(database, state_overlay=True)
+        try:
+            address = _address('a')
+            squash = context_manager.get_squash_handler()
+            root = context_manager.get_first_root()
+            before = len(database)
+            for i in range(3):
+                c_id = context_manager.create_context(
+                    root, [address], [address])
+                self.assertEqual([(address, i or None)],
+                                 context_manager.get(c_id, [address]))
+                context_manager.set(c_id, [{address: i + 1}])
+                root = squash(root, [c_id])
+                context_manager.delete_context([c_id])
+            self.assertEqual(before, len(database))
+
+            context_manager.flush_state(root)
+            self.assertEqual(3, MerkleDatabase(database, root).get(address))
+            self.assertEqual(0, context_manager.overlay_metrics['layers'])
+        finally:
+            context_manager.stop()
+
+
+class _GatedDatabase(DictDatabase):
+    """A DictDatabase whose reads signal that they started, and wait for
+    the gate to open.
+    """
+    def __init__(self):
+        super(_GatedDatabase, self).__init__()
+        self.reading = Event()
+        self.gate = Event()
+        self.gate.set()
+
+    def get(self, key):
+        self.reading.set()
+        self.gate.wait()
+        return super(_GatedDatabase, self).get(key)
+
+    def get_batch(self, keys):
+        self.reading.set()
+        self.gate.wait()
+        return super(_GatedDatabase, self).get_batch(keys)
+
+
+class TestContextPrefetch(unittest.TestCase):
+    def test_coalesced_reads(self):
+        """Tests that an address being read for a context is not read again
+        for the contexts created meanwhile, by the other readers, and that
+        their futures are all set by the first read.
+        """
+        database = _GatedDatabase()
+        address = _address('a')
+        root = MerkleDatabase(database).update({address: 1}, virtual=False)
+        context_manager = ContextManager(database, reader_threads=2)
+        try:
+            database.gate.clear()
+            database.reading.clear()
+            first = context_manager.create_context(root, [address], [])
+            self.assertTrue(database.reading.wait(5))
+
+            others = [context_manager.create_context(root, [address], [])
+                      for _ in range(3)]
+            deadline = time.time() + 5
+            while context_manager.prefetch_metrics[
+                    'coalesced_addresses'] < 1 and time.time() < deadline:
+                time.sleep(0.01)
+            database.gate.set()
+
+            for c_id in [first] + others:
+                self.assertEqual([(address, 1)],
+                                 context_manager.get(c_id, [address]))
+            # the batches are counted once their futures are set
+            while context_manager.prefetch_metrics[
+                    'prefetched_contexts'] < 4 and time.time() < deadline:
+                time.sleep(0.01)
+            metrics = context_manager.prefetch_metrics
+            self.assertEqual(1, metrics['read_addresses'])
+            self.assertGreaterEqual(metrics['coalesced_addresses'], 1)
+            self.assertEqual(4, metrics['prefetched_contexts'])
+            self.assertEqual(0, metrics['queue_depth'])
+        finally:
+            database.gate.set()
+            context_manager.stop()
+
+
+class TestStateContext(unittest.TestCase):
+    def test_values(self):
+        """Tests that the inputs of a context are readable once all are
+        read, and that the reads do not overwrite what the transaction set.
+        """
+        first, second, third = _address('a'), _address('b'), _address('c')
+        context = StateContext('id', 'root', [first, second], [second, third])
+        context.set_values({second: 2})
+        context.set_prefetched({second: 20})
+        self.assertEqual([(second, 2)], context.get_values([second]))
+
+        context.set_prefetched({first: 1})
+        self.assertEqual([(first, 1), (second, 2)],
+                         context.get_values([first, second]))
+        self.assertEqual({second: 2, third: None},
+                         context.get_writable_values())
+        with self.assertRaises(AuthorizationException):
+            context.get_values([third])
+
+    def test_unique_ids(self):
+        context_manager = ContextManager(DictDatabase())
+        try:
+            root = context_manager.get_first_root()
+            ids = set(context_manager.create_context(root, [], [])
+                      for _ in range(100))
+            self.assertEqual(100, len(ids))
+        finally:
+            context_manager.stop()
+
+
+class TestStateValueCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        """Tests that the least recently used entries are evicted past the
+        byte budget, and that missing addresses are cached.
+        """
+        cache = StateValueCache(max_bytes=30)
+        cache.put_many('root', [('a', b'123456789'), ('b', None)])
+        self.assertEqual(({'a': b'123456789', 'b': None}, ['c']),
+                         cache.get_many('root', ['a', 'b', 'c']))
+        self.assertEqual(({}, ['a']), cache.get_many('other', ['a']))
+
+        cache.get_many('root', ['a'])
+        cache.put_many('root', [('c', b'123456789'), ('d', b'123456789')])
+        # b was the least recently used
+        self.assertEqual(({'a': b'123456789', 'c': b'123456789',
+                           'd': b'123456789'}, ['b']),
+                         cache.get_many('root', ['a', 'b', 'c', 'd']))
+        self.assertEqual(1, cache.metrics['evictions'])
+        self.assertEqual(30, cache.size_bytes)
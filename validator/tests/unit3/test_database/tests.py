@@ -0,0 +1,395 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+from threading import Event
+from threading import Thread
+import time
+import unittest
+from unittest.mock import patch
+
+import cbor
+
+from sawtooth_validator.database import lmdb_nolock_database
+from sawtooth_validator.database.database import CachedDatabase
+from sawtooth_validator.database.dict_database import DictDatabase
+from sawtooth_validator.database.lmdb_nolock_database import \
+    DURABILITY_BLOCK
+from sawtooth_validator.database.lmdb_nolock_database import \
+    DURABILITY_INTERVAL
+from sawtooth_validator.database.lmdb_nolock_database import \
+    LMDBEnvironment
+from sawtooth_validator.database.lmdb_nolock_database import \
+    LMDBNoLockDatabase
+
+
+class TestLMDBNoLockDatabase(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._filename = os.path.join(self._temp_dir, 'test.lmdb')
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_raw(self):
+        """Tests that raw values are stored as they are, that the raw marker
+        is not listed, and that raw databases can't be opened in the default
+        mode.
+        """
+        database = LMDBNoLockDatabase(self._filename, 'n', raw=True)
+        database.set_batch([('a', b'1'), ('b', b'2')])
+        database.set('c', b'3')
+
+        self.assertEqual(b'1', database.get('a'))
+        self.assertEqual([('a', b'1'), ('c', b'3')],
+                         database.get_batch(['a', 'c', 'd']))
+        self.assertEqual(3, len(database))
+        self.assertEqual(['a', 'b', 'c'], database.keys())
+        with database.read_txn() as txn:
+            value = txn.get('b')
+            self.assertIsInstance(value, memoryview)
+            self.assertEqual(b'2', bytes(value))
+            self.assertIsNone(txn.get('d'))
+        database.close()
+
+        with self.assertRaises(ValueError):
+            LMDBNoLockDatabase(self._filename, 'c')
+
+    def test_read_txn_snapshot(self):
+        """Tests that the read transactions opened on a thread while one is
+        open share it, and see the database as it was when it began.
+        """
+        database = LMDBNoLockDatabase(self._filename, 'n', raw=True)
+        database.set('a', b'1')
+
+        with database.read_txn() as snapshot:
+            self.assertEqual(b'1', bytes(snapshot.get('a')))
+            writer = Thread(target=database.set_batch,
+                            args=([('a', b'2'), ('b', b'3')],))
+            writer.start()
+            writer.join()
+
+            with snapshot.read_txn() as nested:
+                self.assertIs(snapshot, nested)
+                self.assertEqual(b'1', bytes(nested.get('a')))
+            self.assertNotIn('b', snapshot)
+            self.assertEqual([('a', b'1')],
+                             [(k, bytes(v)) for k, v
+                              in snapshot.get_batch(['a', 'b'])])
+
+        with database.read_txn() as snapshot:
+            self.assertEqual(b'2', bytes(snapshot.get('a')))
+            self.assertIn('b', snapshot)
+        database.close()
+
+    def test_migration(self):
+        """Tests that a database of CBOR encoded values opened in raw mode
+        has its values decoded, resuming an interrupted migration.
+        """
+        values = {'{:04}'.format(i): str(i).encode() for i in range(25)}
+        database = LMDBNoLockDatabase(self._filename, 'n')
+        database.set_batch(values.items())
+        database.close()
+
+        loads = cbor.loads
+        calls = []
+
+        def failing_loads(packed):
+            calls.append(packed)
+            if len(calls) == 15:
+                raise RuntimeError('interrupted')
+            return loads(packed)
+
+        with patch.object(lmdb_nolock_database, 'MIGRATION_CHUNK_SIZE', 4):
+            with patch.object(lmdb_nolock_database.cbor, 'loads',
+                              side_effect=failing_loads):
+                with self.assertRaises(RuntimeError):
+                    LMDBNoLockDatabase(self._filename, 'c', raw=True)
+
+            database = LMDBNoLockDatabase(self._filename, 'c', raw=True)
+
+        self.assertEqual(sorted(values.items()),
+                         database.get_batch(sorted(values)))
+        self.assertEqual(len(values), len(database))
+        database.close()
+
+    def test_group_commit(self):
+        """Tests that writes queued while a commit is being flushed are
+        committed together, in one write transaction.
+        """
+        database = LMDBNoLockDatabase(self._filename, 'n', raw=True)
+        environment = database.environment
+        sync = environment.sync
+        flushing = Event()
+        release = Event()
+
+        def blocking_sync():
+            if not flushing.is_set():
+                flushing.set()
+                release.wait()
+            sync()
+
+        with patch.object(environment, 'sync', side_effect=blocking_sync):
+            first = Thread(target=database.set, args=('first', b'0'))
+            first.start()
+            flushing.wait()
+
+            writers = [Thread(target=database.set_batch,
+                              args=([(str(i), str(i).encode())],))
+                       for i in range(5)]
+            for writer in writers:
+                writer.start()
+            while len(environment._pending) < len(writers):
+                time.sleep(0.01)
+            release.set()
+
+            first.join()
+            for writer in writers:
+                writer.join()
+
+        metrics = database.metrics
+        self.assertEqual(2, metrics['commits'])
+        self.assertEqual(6, metrics['committed_writes'])
+        self.assertEqual(5, metrics['max_batch_size'])
+        self.assertEqual(2, metrics['syncs'])
+        self.assertEqual(['0', '1', '2', '3', '4', 'first'], database.keys())
+        database.close()
+
+    def test_durability(self):
+        """Tests that writes are only flushed by sync() at block commit, and
+        periodically with an interval.
+        """
+        database = LMDBNoLockDatabase(self._filename, 'n', raw=True,
+                                      durability=DURABILITY_BLOCK)
+        database.set_batch([('a', b'1')])
+        database.delete('a')
+        self.assertEqual(2, database.metrics['commits'])
+        self.assertEqual(0, database.metrics['syncs'])
+        database.sync()
+        self.assertEqual(1, database.metrics['syncs'])
+        database.close()
+
+        database = LMDBNoLockDatabase(self._filename, 'n', raw=True,
+                                      durability=DURABILITY_INTERVAL,
+                                      sync_interval=0.01)
+        database.set('a', b'1')
+        deadline = time.time() + 5
+        while database.metrics['syncs'] == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertGreater(database.metrics['syncs'], 0)
+        database.close()
+
+        with self.assertRaises(ValueError):
+            LMDBNoLockDatabase(self._filename, 'n', durability='never')
+
+
+class TestLMDBEnvironment(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._filename = os.path.join(self._temp_dir, 'test.lmdb')
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_named_databases(self):
+        """Tests that the named databases of a file have their own keys and
+        value encodings, and that a read-only file is not modified.
+        """
+        environment = LMDBEnvironment(self._filename, 'n')
+        first = environment.open_database('first', raw=True)
+        second = environment.open_database('second')
+        first.set('a', b'1')
+        second.set('a', {'value': 2})
+        self.assertEqual(b'1', first.get('a'))
+        self.assertEqual({'value': 2}, second.get('a'))
+        self.assertEqual(['a'], first.keys())
+        self.assertEqual(1, len(second))
+        environment.close()
+
+        environment = LMDBEnvironment(self._filename, 'r')
+        with self.assertRaises(ValueError):
+            # a read-only file can't be migrated to raw values
+            environment.open_database('second', raw=True)
+        with self.assertRaises(ValueError):
+            environment.open_database('third')
+        self.assertEqual(b'1',
+                         environment.open_database('first', raw=True).get('a'))
+        environment.close()
+
+    def test_write_txn(self):
+        """Tests that the writes of a transaction over several databases are
+        only visible once it completes, are committed in a single flushed
+        commit, and are discarded when it fails.
+        """
+        environment = LMDBEnvironment(self._filename, 'n',
+                                      durability=DURABILITY_BLOCK)
+        first = environment.open_database('first', raw=True)
+        second = environment.open_database('second')
+        first.set('gone', b'0')
+        self.assertEqual(0, environment.metrics['syncs'])
+
+        with environment.write_txn() as txn:
+            txn.set(first, 'a', b'1')
+            txn.set(second, 'b', 2)
+            txn.delete(first, 'gone')
+            self.assertIsNone(first.get('a'))
+        self.assertEqual(b'1', first.get('a'))
+        self.assertEqual(2, second.get('b'))
+        self.assertIsNone(first.get('gone'))
+        self.assertEqual(2, environment.metrics['commits'])
+        self.assertEqual(1, environment.metrics['syncs'])
+
+        with self.assertRaises(RuntimeError):
+            with environment.write_txn() as txn:
+                txn.set(first, 'c', b'3')
+                txn.set(second, 'c', 3)
+                raise RuntimeError('failed')
+        self.assertIsNone(first.get('c'))
+        self.assertIsNone(second.get('c'))
+        environment.close()
+
+    def test_compact_file(self):
+        """Tests that compacting a file reclaims the pages freed by deletes,
+        keeps its databases whole, and leaves the file alone when the copy
+        is written to another file, even while the file is in use.
+        """
+        environment = LMDBEnvironment(self._filename, 'n')
+        first = environment.open_database('first', raw=True)
+        second = environment.open_database('second')
+        first.set_batch([(str(i), os.urandom(500)) for i in range(5000)])
+        first.delete_batch([str(i) for i in range(100, 5000)])
+        second.set('a', {'value': 2})
+        expected = {key: bytes(first.get(key)) for key in first.keys()}
+
+        # the copy is a snapshot, so it can be taken while the file is used
+        online = os.path.join(self._temp_dir, 'online.lmdb')
+        environment.copy(online)
+        second.set('b', 3)
+        environment.close()
+
+        size = lmdb_nolock_database.file_size(self._filename)
+        output = os.path.join(self._temp_dir, 'copy.lmdb')
+        sizes = lmdb_nolock_database.compact_file(self._filename, output)
+        self.assertEqual((size, lmdb_nolock_database.file_size(output)),
+                         sizes)
+        self.assertLess(sizes[1], size)
+        self.assertEqual(size,
+                         lmdb_nolock_database.file_size(self._filename))
+
+        size, compacted_size = lmdb_nolock_database.compact_file(
+            self._filename)
+        self.assertLess(compacted_size, size)
+        self.assertFalse(os.path.exists(self._filename + '.compact'))
+
+        for filename in (self._filename, output, online):
+            environment = LMDBEnvironment(filename, 'r')
+            first = environment.open_database('first', raw=True)
+            self.assertEqual(
+                expected,
+                {key: bytes(first.get(key)) for key in first.keys()})
+            second = environment.open_database('second')
+            self.assertEqual({'value': 2}, second.get('a'))
+            # the online copy misses the writes made after it
+            self.assertEqual(None if filename == online else 3,
+                             second.get('b'))
+            environment.close()
+
+
+class TestCachedDatabase(unittest.TestCase):
+    def test_read_through(self):
+        """Tests that values read, written or read in a read transaction are
+        cached, that deletes remove them, and that the reads are counted.
+        """
+        database = DictDatabase()
+        database.set('a', b'1')
+        cache = CachedDatabase(database)
+
+        self.assertEqual(b'1', cache.get('a'))
+        self.assertEqual(b'1', cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(2, cache.misses)
+
+        cache.set_batch([('b', b'2'), ('c', b'3')])
+        # served by the cache, although the database no longer has it
+        database.delete('c')
+        self.assertEqual([('b', b'2'), ('c', b'3')],
+                         cache.get_batch(['b', 'c']))
+        with cache.read_txn() as txn:
+            self.assertEqual(b'1', txn.get('a'))
+        self.assertEqual(4, cache.hits)
+        self.assertAlmostEqual(4 / 6, cache.hit_ratio)
+
+        cache.delete_batch(['a', 'b'])
+        self.assertNotIn('a', cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.metrics['entries'])
+
+    def test_byte_budget(self):
+        """Tests that the least recently used values are evicted to keep the
+        cached values within the byte budget.
+        """
+        database = DictDatabase()
+        cache = CachedDatabase(database, max_bytes=10, stripes=1)
+        cache.set('a', b'1234')
+        cache.set('b', b'1234')
+        cache.get('a')
+        cache.set('c', b'1234')
+        # too large to be cached
+        cache.set('d', b'12345678901')
+
+        database.delete('b')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(b'1234', cache.get('a'))
+        self.assertEqual(8, cache.size_bytes)
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual(b'12345678901', cache.get('d'))
+
+    def test_delete_during_read(self):
+        """Tests that a value read from the database while it is deleted is
+        not cached.
+        """
+        class DeletedWhileRead(DictDatabase):
+            def get(self, key):
+                value = super(DeletedWhileRead, self).get(key)
+                cache.delete(key)
+                return value
+
+        database = DeletedWhileRead()
+        cache = CachedDatabase(database)
+        database.set('a', b'1')
+        self.assertEqual(b'1', cache.get('a'))
+        self.assertNotIn('a', cache)
+
+    def test_raw_buffers(self):
+        """Tests that the buffers of a raw LMDB read transaction are cached
+        as copies.
+        """
+        temp_dir = tempfile.mkdtemp()
+        try:
+            database = LMDBNoLockDatabase(
+                os.path.join(temp_dir, 'test.lmdb'), 'n', raw=True)
+            database.set('a', b'1')
+            cache = CachedDatabase(database)
+            with cache.read_txn() as txn:
+                self.assertEqual(b'1', txn.get('a'))
+            database.delete('a')
+            self.assertEqual(b'1', cache.get('a'))
+            self.assertIsInstance(cache.get('a'), bytes)
+            database.close()
+        finally:
+            shutil.rmtree(temp_dir)
@@ -114,6 +114,9 @@ class MockTransactionExecutor(object):
     def execute(self, scheduler, state_hash=None):
         pass
 
+    def release_scheduler(self, scheduler):
+        pass
+
 
 class MockBlockSender(BlockSender):
     def __init__(self):
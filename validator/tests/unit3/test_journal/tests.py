@@ -14,13 +14,18 @@
 # ------------------------------------------------------------------------------
 
 import logging
+import os
+import shutil
 import sys
+import tempfile
 import unittest
 
+from sawtooth_validator.database.lmdb_nolock_database import LMDBEnvironment
 from sawtooth_validator.journal.publisher import BlockPublisher
 from sawtooth_validator.journal.chain import ChainController
 from sawtooth_validator.journal.journal import Journal
 from sawtooth_validator.journal.block_cache import BlockCache
+from sawtooth_validator.journal.block_store_adapter import BlockStoreAdapter
 from sawtooth_validator.journal.block_wrapper import BlockWrapper
 from sawtooth_validator.journal.consensus.test_mode.test_mode_consensus \
     import \
@@ -30,6 +35,7 @@ from sawtooth_validator.journal.consensus.test_mode.test_mode_consensus \
     BlockVerifier as TestModeVerifier
 from sawtooth_validator.journal.consensus.test_mode \
     import test_mode_consensus
+from sawtooth_validator.journal.lmdb_block_store import LMDBBlockStore
 from sawtooth_validator.journal.timed_cache import TimedCache
 from sawtooth_validator.protobuf.batch_pb2 import Batch
 from sawtooth_validator.protobuf.block_pb2 import BlockHeader
@@ -119,6 +125,8 @@ class TestChainController(unittest.TestCase):
         def chain_updated(head):
             pass
 
+        self.committed = []
+
         self.chain_ctrl = ChainController(
             consensus=TestModeVerifier(),
             block_cache=self.blocks.block_cache,
@@ -126,7 +134,8 @@ class TestChainController(unittest.TestCase):
             executor=self.executor,
             transaction_executor=MockTransactionExecutor(),
             on_chain_updated=chain_updated,
-            squash_handler=None)
+            squash_handler=None,
+            on_block_committed=self.committed.append)
 
     def test_simple_case(self):
         # TEST Run the simple case
@@ -135,6 +144,8 @@ class TestChainController(unittest.TestCase):
         self.executor.process_all()
         assert(self.chain_ctrl.chain_head.block.header_signature ==
                block_1.header_signature)
+        assert([block.header_signature for block in self.committed] ==
+               [block_1.header_signature])
 
     def test_alternate_genesis(self):
         # TEST Run generate and alternate genesis block
@@ -198,6 +209,46 @@ class TestChainController(unittest.TestCase):
     # print(journal.chain_head, new_block)
 
 
+class TestLMDBBlockStore(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._filename = os.path.join(self._temp_dir, 'validator.lmdb')
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_update_chain(self):
+        """Tests that the blocks and the chain head are stored, replaced
+        and reloaded through the block store adapter.
+        """
+        btm = BlockTreeManager()
+        chain = btm.generate_chain(btm.chain_head, 3)
+        fork = btm.generate_chain(chain[0], 1)
+
+        environment = LMDBEnvironment(self._filename, 'n')
+        block_store = BlockStoreAdapter(LMDBBlockStore(environment))
+        block_store.update_chain([chain[1], chain[0]], [])
+        self.assertEqual(chain[1].identifier,
+                         block_store.chain_head.identifier)
+
+        block_store.update_chain([chain[2], fork[0]], [chain[1]])
+        self.assertNotIn(chain[1].identifier, block_store)
+        # three blocks and the chain head
+        self.assertEqual(4, len(block_store.store))
+        environment.close()
+
+        environment = LMDBEnvironment(self._filename, 'c')
+        block_store = BlockStoreAdapter(LMDBBlockStore(environment))
+        head = block_store.chain_head
+        self.assertEqual(chain[2].identifier, head.identifier)
+        self.assertEqual(chain[2].block, head.block)
+        self.assertEqual(fork[0].identifier,
+                         block_store[fork[0].identifier].identifier)
+        with self.assertRaises(KeyError):
+            block_store[chain[1].identifier]
+        environment.close()
+
+
 class TestJournal(unittest.TestCase):
     def setUp(self):
         self.gossip = MockNetwork()
@@ -289,6 +340,18 @@ class TestTimedCache(unittest.TestCase):
         self.assertFalse("test" in bc)
         self.assertTrue("test2" in bc)
 
+    def test_peek_values(self):
+        """ Test that peeking at the values does not extend their
+        lifetime in the cache.
+        """
+        bc = TimedCache(keep_time=1)
+
+        bc["test"] = "value"
+        bc.cache["test"].timestamp = bc.cache["test"].timestamp - 2
+        self.assertEqual(["value"], bc.peek_values())
+        bc.purge_expired()
+        self.assertFalse("test" in bc)
+
     def test_access_update(self):
 
         bc = TimedCache(keep_time=1)
@@ -14,6 +14,7 @@
 # ------------------------------------------------------------------------------
 
 import hashlib
+import random
 import unittest
 import bitcoin
 
@@ -21,6 +22,7 @@ import sawtooth_validator.protobuf.batch_pb2 as batch_pb2
 import sawtooth_validator.protobuf.transaction_pb2 as transaction_pb2
 
 from sawtooth_validator.execution.context_manager import ContextManager
+from sawtooth_validator.execution.scheduler_parallel import ParallelScheduler
 from sawtooth_validator.execution.scheduler_parallel import RadixTree
 from sawtooth_validator.execution.scheduler_parallel import TopologicalSorter
 from sawtooth_validator.execution.scheduler_serial import SerialScheduler
@@ -29,7 +31,8 @@ from sawtooth_validator.database import dict_database
 
 
 
-def create_transaction(name, private_key, public_key):
+def create_transaction(name, private_key, public_key, inputs=None,
+                       outputs=None):
     payload = name
     addr = '000000' + hashlib.sha512(name.encode()).hexdigest()
 
@@ -37,8 +40,8 @@ def create_transaction(name, private_key, public_key):
         signer_pubkey=public_key,
         family_name='scheduler_test',
         family_version='1.0',
-        inputs=[addr],
-        outputs=[addr],
+        inputs=[addr] if inputs is None else inputs,
+        outputs=[addr] if outputs is None else outputs,
         dependencies=[],
         payload_encoding="application/cbor",
         payload_sha512=hashlib.sha512(payload.encode()).hexdigest(),
@@ -299,6 +302,151 @@ class TestSerialScheduler(unittest.TestCase):
         self.assertIsNone(batch2_result.state_hash)
 
 
+def _address(name):
+    return '000000' + hashlib.sha512(name.encode()).hexdigest()
+
+
+class TestParallelScheduler(unittest.TestCase):
+    def setUp(self):
+        self.private_key = bitcoin.random_key()
+        self.public_key = bitcoin.encode_pubkey(
+            bitcoin.privkey_to_pubkey(self.private_key), "hex")
+
+    def _batch(self, txns):
+        """Creates a batch of (name, inputs, outputs) transactions."""
+        return create_batch(
+            transactions=[create_transaction(
+                name=name,
+                private_key=self.private_key,
+                public_key=self.public_key,
+                inputs=inputs,
+                outputs=outputs) for name, inputs, outputs in txns],
+            private_key=self.private_key,
+            public_key=self.public_key)
+
+    def test_concurrent_transactions(self):
+        """Tests that the transactions which do not conflict are returned
+        together, and that a transaction writing an address, or a prefix
+        of an address, another one uses waits until that one is applied.
+        """
+        context_manager = ContextManager(dict_database.DictDatabase())
+        first_state_root = context_manager.get_first_root()
+        scheduler = ParallelScheduler(
+            context_manager.get_squash_handler(), first_state_root)
+
+        a, b, c = _address('a'), _address('b'), _address('c')
+        scheduler.add_batch(self._batch([
+            ('1', [a], [a]),
+            ('2', [b], [b]),
+            ('3', [a], [c]),
+            ('4', [c], [c[:8]]),
+            ('5', [_address('d')], []),
+        ]))
+        scheduler.finalize()
+
+        first = [scheduler.next_transaction() for _ in range(3)]
+        self.assertEqual([b'1', b'2', b'5'],
+                         [txn_info.txn.payload for txn_info in first])
+        self.assertIsNone(scheduler.next_transaction())
+        for txn_info in first:
+            self.assertEqual(first_state_root, txn_info.state_hash)
+
+        # 3 waits for 1; 4 waits for 3
+        scheduler.set_transaction_execution_result(
+            first[1].txn.header_signature, False, None)
+        self.assertIsNone(scheduler.next_transaction())
+        scheduler.set_transaction_execution_result(
+            first[0].txn.header_signature, False, None)
+        third = scheduler.next_transaction()
+        self.assertEqual(b'3', third.txn.payload)
+        self.assertIsNone(scheduler.next_transaction())
+        scheduler.set_transaction_execution_result(
+            third.txn.header_signature, False, None)
+        fourth = scheduler.next_transaction()
+        self.assertEqual(b'4', fourth.txn.payload)
+
+        self.assertFalse(scheduler.complete(block=False))
+        for txn_info in [first[2], fourth]:
+            scheduler.set_transaction_execution_result(
+                txn_info.txn.header_signature, False, None)
+        self.assertTrue(scheduler.complete(block=False))
+        self.assertEqual(5, scheduler.count())
+
+    def _execute(self, scheduler, context_manager, concurrently, rand):
+        """Executes the transactions of a scheduler: each one adds the
+        values of its inputs, plus one, to its outputs, unless its name
+        starts with 'invalid'. Transactions returned together are executed
+        in a random order.
+        """
+        while not scheduler.complete(block=False):
+            txn_infos = []
+            txn_info = scheduler.next_transaction()
+            while txn_info is not None:
+                txn_infos.append(txn_info)
+                if not concurrently:
+                    break
+                txn_info = scheduler.next_transaction()
+            rand.shuffle(txn_infos)
+
+            for txn_info in txn_infos:
+                header = transaction_pb2.TransactionHeader()
+                header.ParseFromString(txn_info.txn.header)
+                c_id = context_manager.create_context(
+                    txn_info.state_hash, list(header.inputs),
+                    list(header.outputs))
+                if txn_info.txn.payload.startswith(b'invalid'):
+                    context_manager.delete_context([c_id])
+                    scheduler.set_transaction_execution_result(
+                        txn_info.txn.header_signature, False, None)
+                    continue
+                total = sum(value or 0 for _, value in context_manager.get(
+                    c_id, list(header.inputs)))
+                context_manager.set(
+                    c_id, [{address: total + 1}
+                           for address in header.outputs])
+                scheduler.set_transaction_execution_result(
+                    txn_info.txn.header_signature, True, c_id)
+
+    def test_serial_results(self):
+        """Tests that the parallel scheduler gives the batch results of the
+        serial scheduler, executing the transactions it returns together
+        in random orders.
+        """
+        rand = random.Random(0)
+        addresses = [_address(str(i)) for i in range(6)]
+        batches = []
+        for i in range(12):
+            txns = []
+            for j in range(rand.randint(1, 4)):
+                name = '{}-{}'.format(i, j)
+                if rand.random() < 0.1:
+                    name = 'invalid-' + name
+                txns.append((name,
+                             rand.sample(addresses, rand.randint(1, 3)),
+                             rand.sample(addresses, rand.randint(0, 2))))
+            batches.append(self._batch(txns))
+
+        results = []
+        for scheduler_class, concurrently in [(SerialScheduler, False),
+                                              (ParallelScheduler, True)]:
+            context_manager = ContextManager(dict_database.DictDatabase())
+            scheduler = scheduler_class(context_manager.get_squash_handler(),
+                                        context_manager.get_first_root())
+            for batch in batches:
+                scheduler.add_batch(batch)
+            scheduler.finalize()
+            self._execute(scheduler, context_manager, concurrently, rand)
+            results.append([
+                (result.is_valid, result.state_hash) for result in [
+                    scheduler.get_batch_execution_result(
+                        batch.header_signature) for batch in batches]])
+            context_manager.stop()
+
+        self.assertEqual(results[0], results[1])
+        self.assertIn(True, [is_valid for is_valid, _ in results[1]])
+        self.assertIn(False, [is_valid for is_valid, _ in results[1]])
+
+
 class TestRadixTree(unittest.TestCase):
 
     def test_radix_tree(self):
@@ -414,3 +562,21 @@ class TestTopologicalSorter(unittest.TestCase):
         self.assertEqual(
             sorter.order(),
             ['9', '2', '1', '3', '7', '5', '8', '4', '6'])
+
+    def test_incremental_relations(self):
+        """Tests that relations added after an order are taken into
+        account, that identifiers without relations keep their insertion
+        order, and that a cycle is detected.
+        """
+        sorter = TopologicalSorter()
+        sorter.add_identifier('a')
+        sorter.add_relation('c', 'b')
+        self.assertEqual(['a', 'c', 'b'], sorter.order())
+
+        sorter.add_relation('b', 'a')
+        sorter.add_identifier('d')
+        self.assertEqual(['c', 'b', 'a', 'd'], sorter.order())
+
+        sorter.add_relation('a', 'c')
+        with self.assertRaises(Exception):
+            sorter.order()
@@ -0,0 +1,814 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+from concurrent.futures import ProcessPoolExecutor
+import io
+import os
+import shutil
+import tempfile
+from threading import Event
+import time
+import unittest
+from unittest.mock import patch
+
+from sawtooth_sdk.client.proof import verify_proof
+from sawtooth_validator.database.dict_database import DictDatabase
+from sawtooth_validator.database.lmdb_nolock_database import \
+    LMDBNoLockDatabase
+from sawtooth_validator.state.merkle import MerkleDatabase
+from sawtooth_validator.state.node_cache import NodeCache
+from sawtooth_validator.state.node_codec import CBOR_NODE_FORMAT
+from sawtooth_validator.state.node_codec import COMPACT_NODE_FORMAT
+from sawtooth_validator.state.node_codec import decode_node
+from sawtooth_validator.state.node_codec import encode_node
+from sawtooth_validator.state.overlay import StateOverlay
+from sawtooth_validator.state.pruner import PrunableDatabase
+from sawtooth_validator.state.pruner import StatePruner
+from sawtooth_validator.state import snapshot
+from sawtooth_validator.state.snapshot import SnapshotError
+from sawtooth_validator.state.snapshot import export_snapshot
+from sawtooth_validator.state.snapshot import import_snapshot
+from sawtooth_validator.state.write_behind import WriteBehindDatabase
+
+
+def _address(name):
+    return MerkleDatabase.hash(name.encode())
+
+
+class TestNodeCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        """Tests that the least recently used nodes are evicted once the byte
+        budget is exceeded, and that the counters are maintained.
+        """
+        cache = NodeCache(max_bytes=30)
+        cache.put('a', {'v': 1}, 10)
+        cache.put('b', {'v': 2}, 10)
+        cache.put('c', {'v': 3}, 10)
+
+        # touch 'a', so that 'b' is the least recently used
+        self.assertEqual({'v': 1}, cache.get('a'))
+        cache.put('d', {'v': 4}, 10)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertIn('a', cache)
+        self.assertIn('d', cache)
+        self.assertEqual(30, cache.size_bytes)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(1, cache.evictions)
+
+    def test_merkle_reads_use_cache(self):
+        """Tests that a MerkleDatabase sharing a NodeCache returns the same
+        values as one without, and that repeated reads are served from the
+        cache.
+        """
+        database = DictDatabase()
+        cache = NodeCache()
+        tree = MerkleDatabase(database, node_cache=cache)
+
+        updates = {_address(str(i)): i for i in range(10)}
+        root = tree.update(updates, virtual=False)
+        tree.set_merkle_root(root)
+
+        uncached = MerkleDatabase(database, root)
+        for address, value in updates.items():
+            self.assertEqual(value, tree.get(address))
+            self.assertEqual(value, uncached.get(address))
+
+        misses = cache.misses
+        for address in updates:
+            tree.get(address)
+        self.assertEqual(misses, cache.misses)
+
+        # updating through the cached tree must not modify cached nodes
+        new_root = tree.update({_address('0'): 'zero'}, virtual=False)
+        self.assertEqual(0, tree.get(_address('0')))
+        tree.set_merkle_root(new_root)
+        self.assertEqual('zero', tree.get(_address('0')))
+
+
+class TestMerkleGetMany(unittest.TestCase):
+    def test_get_many(self):
+        """Tests that get_many returns the same values as individual gets,
+        omits addresses without a value, and reads each shared node once.
+        """
+        database = DictDatabase()
+        tree = MerkleDatabase(database)
+
+        updates = {_address(str(i)): i for i in range(50)}
+        # an address nested below another one
+        nested = list(updates)[0] + 'ab'
+        updates[nested] = 'nested'
+        tree.set_merkle_root(tree.update(updates, virtual=False))
+
+        missing = _address('missing')
+        prefix = list(updates)[1][:6]
+        values = tree.get_many(list(updates) + [missing, prefix])
+
+        self.assertEqual(updates, values)
+        for address, value in values.items():
+            self.assertEqual(value, tree.get(address))
+
+        cache = NodeCache()
+        cached_tree = MerkleDatabase(database, tree.get_merkle_root(),
+                                     node_cache=cache)
+        cached_tree.get_many(list(updates))
+        self.assertEqual(0, cache.hits)
+
+
+class TestMerkleUpdate(unittest.TestCase):
+    def test_update_matches_set(self):
+        """Tests that a single update produces the same root as setting the
+        addresses one at a time, and that a virtual update writes nothing.
+        """
+        updates = {_address(str(i)): i for i in range(100)}
+
+        tree = MerkleDatabase(DictDatabase())
+        for address, value in updates.items():
+            tree.set_merkle_root(tree.set(address, value))
+
+        database = DictDatabase()
+        batch_tree = MerkleDatabase(database)
+        virtual_root = batch_tree.update(updates)
+        self.assertNotIn(virtual_root, database)
+
+        root = batch_tree.update(updates, virtual=False)
+        self.assertEqual(virtual_root, root)
+        self.assertEqual(tree.get_merkle_root(), root)
+
+    def test_parallel_update(self):
+        """Tests that hashing dirty subtrees in a process pool produces the
+        same root and nodes as hashing them serially.
+        """
+        base = {_address(str(i)): i for i in range(100)}
+        updates = {_address(str(i)): -i for i in range(50, 150)}
+
+        serial_db = DictDatabase()
+        serial_tree = MerkleDatabase(serial_db)
+        serial_tree.set_merkle_root(serial_tree.update(base, virtual=False))
+        serial_root = serial_tree.update(updates, virtual=False)
+
+        with ProcessPoolExecutor(max_workers=2) as pool, \
+                patch('sawtooth_validator.state.merkle.'
+                      'PARALLEL_HASH_THRESHOLD', 10):
+            parallel_db = DictDatabase()
+            parallel_tree = MerkleDatabase(parallel_db, hash_executor=pool)
+            parallel_tree.set_merkle_root(
+                parallel_tree.update(base, virtual=False))
+            parallel_root = parallel_tree.update(updates, virtual=False)
+
+        self.assertEqual(serial_root, parallel_root)
+        parallel_tree.set_merkle_root(parallel_root)
+        expected = dict(base)
+        expected.update(updates)
+        self.assertEqual(expected, parallel_tree.leaves(''))
+
+
+class TestNodeCodec(unittest.TestCase):
+    def test_round_trip(self):
+        """Tests that sparse, dense, leaf and path compressed nodes decode to
+        the node they were encoded from, in both formats, and that the
+        compact encoding is smaller.
+        """
+        child = _address('child')[:64]
+        sparse = {"v": None, "c": {'0a': child, 'ff': child}}
+        dense = {"v": None,
+                 "c": {'{:02x}'.format(i): child for i in range(0, 256, 3)}}
+        leaf = {"v": b'\x00' * 300, "c": {}}
+        # a path compressed node, with edges of several tokens
+        labelled = {"v": b'\x01', "c": {'0a1b2c': child, 'ff': child}}
+
+        for node in (sparse, dense, leaf, labelled):
+            cbor_packed = encode_node(node, CBOR_NODE_FORMAT)
+            compact_packed = encode_node(node, COMPACT_NODE_FORMAT)
+            self.assertEqual(node, decode_node(cbor_packed))
+            self.assertEqual(node, decode_node(compact_packed))
+            self.assertEqual(node, decode_node(memoryview(compact_packed)))
+            self.assertLess(len(compact_packed), len(cbor_packed))
+
+        with self.assertRaises(ValueError):
+            encode_node({"v": None, "c": {'A0': child}}, COMPACT_NODE_FORMAT)
+        with self.assertRaises(ValueError):
+            encode_node(sparse, 'unknown')
+
+    def test_migrate(self):
+        """Tests that a trie migrated to the compact format holds the same
+        leaves, that its root is deterministic, and that updating the
+        migrated trie produces the same root as building it in the compact
+        format from scratch.
+        """
+        updates = {_address(str(i)): i for i in range(100)}
+
+        database = DictDatabase()
+        tree = MerkleDatabase(database)
+        tree.set_merkle_root(tree.update(updates, virtual=False))
+
+        compact_root = tree.migrate(COMPACT_NODE_FORMAT)
+        self.assertNotEqual(tree.get_merkle_root(), compact_root)
+
+        compact_tree = MerkleDatabase(DictDatabase(),
+                                      node_format=COMPACT_NODE_FORMAT)
+        self.assertEqual(compact_root,
+                         compact_tree.update(updates, virtual=False))
+
+        migrated = MerkleDatabase(database, compact_root,
+                                  node_format=COMPACT_NODE_FORMAT)
+        self.assertEqual(updates, migrated.leaves(''))
+
+        more = {_address(str(i)): -i for i in range(50, 150)}
+        compact_tree.set_merkle_root(compact_root)
+        self.assertEqual(compact_tree.update(more), migrated.update(more))
+
+
+class TestPathCompression(unittest.TestCase):
+    def _depth(self, tree, address):
+        node = tree.get_node('')
+        depth = 0
+        rest = address
+        while rest:
+            label = next(label for label in node['c']
+                         if rest.startswith(label))
+            node = tree._get_by_hash(node['c'][label])
+            rest = rest[len(label):]
+            depth += 1
+        return depth
+
+    def test_compressed_reads(self):
+        """Tests that a path compressed trie holds the same values as an
+        uncompressed one, with leaves a few nodes below the root, and that
+        prefixes ending in the middle of an edge or of a token can be
+        listed.
+        """
+        updates = {_address(str(i)): i for i in range(200)}
+        # nested addresses, which split compressed edges
+        updates[_address('0')[:10]] = 'short'
+        updates[_address('0')[:40]] = 'middle'
+
+        tree = MerkleDatabase(DictDatabase())
+        tree.set_merkle_root(tree.update(updates, virtual=False))
+        compressed = MerkleDatabase(DictDatabase(), compress_paths=True)
+        compressed.set_merkle_root(compressed.update(updates, virtual=False))
+
+        self.assertEqual(updates, compressed.leaves(''))
+        self.assertEqual(updates, compressed.get_many(list(updates)))
+        for address, value in updates.items():
+            self.assertEqual(value, compressed.get(address))
+
+        for prefix in (_address('1')[:3], _address('1')[:20]):
+            self.assertEqual(tree.leaves(prefix), compressed.leaves(prefix))
+        # prefixes ending in the middle of a token match several edges
+        for prefix in ('', '1', _address('0')[:7], _address('0')[:9],
+                       _address('0')[:41]):
+            expected = {address: value for address, value in updates.items()
+                        if address.startswith(prefix)}
+            self.assertEqual(expected, tree.leaves(prefix))
+            self.assertEqual(expected, compressed.leaves(prefix))
+        self.assertEqual({}, compressed.leaves('zz'))
+        with self.assertRaises(KeyError):
+            compressed.get(_address('1')[:20])
+
+        address = _address('1')
+        self.assertEqual(len(address) // 2, self._depth(tree, address))
+        self.assertLess(self._depth(compressed, address), 5)
+
+    def test_compressed_root_is_canonical(self):
+        """Tests that the root of a path compressed trie only depends on its
+        content, whatever the order of the updates and deletes that built
+        it.
+        """
+        first = {_address(str(i)): i for i in range(100)}
+        second = {_address(str(i)): -i for i in range(50, 150)}
+        deleted = [_address(str(i)) for i in range(0, 150, 3)]
+
+        tree = MerkleDatabase(DictDatabase(), compress_paths=True)
+        tree.set_merkle_root(tree.update(first, virtual=False))
+        tree.set_merkle_root(tree.update(second, virtual=False))
+        for address in deleted:
+            tree.set_merkle_root(tree.delete(address))
+
+        expected = dict(first)
+        expected.update(second)
+        for address in deleted:
+            del expected[address]
+
+        fresh = MerkleDatabase(DictDatabase(), compress_paths=True)
+        self.assertEqual(fresh.update(expected), tree.get_merkle_root())
+        self.assertEqual(expected, tree.leaves(''))
+
+        with self.assertRaises(KeyError):
+            tree.delete(deleted[0])
+
+    def test_delete(self):
+        """Tests that deleting addresses from an uncompressed trie gives the
+        root of a trie built without them, and that a value above other
+        addresses can be deleted.
+        """
+        updates = {_address(str(i)): i for i in range(20)}
+        parent = _address('0')[:20]
+        updates[parent] = 'parent'
+
+        tree = MerkleDatabase(DictDatabase())
+        tree.set_merkle_root(tree.update(updates, virtual=False))
+        tree.set_merkle_root(tree.delete(parent))
+        tree.set_merkle_root(tree.delete(_address('1')))
+
+        del updates[parent]
+        del updates[_address('1')]
+        fresh = MerkleDatabase(DictDatabase())
+        self.assertEqual(fresh.update(updates), tree.get_merkle_root())
+
+
+class TestStatePruner(unittest.TestCase):
+    def test_prune(self):
+        """Tests that a pruning cycle deletes the nodes only reachable from
+        abandoned roots, and keeps the retained tries whole.
+        """
+        database = PrunableDatabase(DictDatabase())
+        tree = MerkleDatabase(database, compress_paths=True)
+        roots = []
+        for i in range(5):
+            roots.append(tree.update(
+                {_address('{}-{}'.format(i, j)): j for j in range(20)},
+                virtual=False))
+            tree.set_merkle_root(roots[-1])
+
+        retained = roots[-2:]
+        pruner = StatePruner(database, lambda: retained)
+        before = len(database)
+        pruned = pruner.prune()
+
+        self.assertGreater(pruned, 0)
+        self.assertEqual(before - pruned, len(database))
+        self.assertEqual(pruned, pruner.pruned_nodes)
+        for root in retained:
+            tree.set_merkle_root(root)
+            self.assertEqual(20 * (roots.index(root) + 1),
+                             len(tree.leaves('')))
+        with self.assertRaises(KeyError):
+            tree.set_merkle_root(roots[0])
+
+        # nothing is left to prune, and nothing is pruned without roots
+        self.assertEqual(0, pruner.prune())
+        self.assertEqual(0, StatePruner(database, lambda: []).prune())
+
+    def test_writes_during_cycle(self):
+        """Tests that nodes written while a cycle runs are not deleted, even
+        when they existed before the cycle and were unreachable from the
+        retained roots.
+        """
+        database = PrunableDatabase(DictDatabase())
+        tree = MerkleDatabase(database)
+        old = {_address(str(i)): i for i in range(20)}
+        old_root = tree.update(old, virtual=False)
+        new_root = tree.update({_address('new'): 0}, virtual=False)
+
+        def get_retained_roots():
+            # rewrites the nodes of the abandoned state, as an update
+            # computing the same state concurrently would
+            self.assertEqual(old_root, tree.update(old, virtual=False))
+            return [new_root]
+
+        StatePruner(database, get_retained_roots).prune()
+
+        tree.set_merkle_root(old_root)
+        self.assertEqual(old, tree.leaves(''))
+
+    def test_writes_on_unretained_root(self):
+        """Tests that the existing nodes referenced by the nodes written
+        while a cycle runs are not deleted, when the state they were written
+        on top of is not retained.
+        """
+        database = PrunableDatabase(DictDatabase())
+        tree = MerkleDatabase(database)
+        retained_root = tree.update({_address('retained'): 0}, virtual=False)
+        # the root of a squash, written before the cycle and not retained
+        first = {_address(str(i)): i for i in range(20)}
+        first_root = tree.update(first, virtual=False)
+        second_roots = []
+
+        def get_retained_roots():
+            # the next squash writes its state on top of the first one
+            tree.set_merkle_root(first_root)
+            second_roots.append(
+                tree.update({_address('second'): 1}, virtual=False))
+            return [retained_root]
+
+        pruner = StatePruner(database, get_retained_roots, chunk_size=5)
+        self.assertGreater(pruner.prune(), 0)
+
+        expected = dict(first)
+        expected[_address('second')] = 1
+        tree = MerkleDatabase(database, second_roots[0])
+        self.assertEqual(expected, tree.leaves(''))
+        for address, value in expected.items():
+            self.assertEqual(value, tree.get(address))
+
+
+class _GatedDatabase(DictDatabase):
+    """A DictDatabase whose writes wait for the gate to open, and fail
+    while failures are left.
+    """
+    def __init__(self):
+        super(_GatedDatabase, self).__init__()
+        self.gate = Event()
+        self.gate.set()
+        self.failures = 0
+
+    def set_batch(self, kvpairs):
+        self.gate.wait()
+        if self.failures:
+            self.failures -= 1
+            raise IOError("disk full")
+        super(_GatedDatabase, self).set_batch(kvpairs)
+
+
+class TestWriteBehindDatabase(unittest.TestCase):
+    def test_reads_before_write(self):
+        """Tests that written nodes are readable while they are queued, and
+        that barrier() returns once they are in the wrapped database.
+        """
+        wrapped = _GatedDatabase()
+        wrapped.gate.clear()
+        database = WriteBehindDatabase(wrapped)
+        try:
+            tree = MerkleDatabase(database)
+            expected = {_address(str(i)): i for i in range(20)}
+            root = tree.update(expected, virtual=False)
+
+            self.assertEqual(0, len(wrapped))
+            self.assertFalse(database.barrier(timeout=0.05))
+            tree = MerkleDatabase(database, root)
+            self.assertEqual(expected, tree.leaves(''))
+            with database.read_txn() as reader:
+                self.assertEqual(expected,
+                                 MerkleDatabase(reader, root).leaves(''))
+
+            wrapped.gate.set()
+            self.assertTrue(database.barrier())
+            self.assertEqual(0, database.metrics['pending_nodes'])
+            tree = MerkleDatabase(wrapped, root)
+            self.assertEqual(expected, tree.leaves(''))
+        finally:
+            database.close()
+
+    def test_failed_write(self):
+        """Tests that a barrier raises the error of a failed write, and
+        that the write is retried.
+        """
+        wrapped = _GatedDatabase()
+        wrapped.gate.clear()
+        wrapped.failures = 1
+        database = WriteBehindDatabase(wrapped)
+        try:
+            with patch('sawtooth_validator.state.write_behind.RETRY_INTERVAL',
+                       0.01):
+                root = MerkleDatabase(database).update(
+                    {_address('a'): 1}, virtual=False)
+                wrapped.gate.set()
+                with self.assertRaises(IOError):
+                    database.barrier()
+                # the node stays readable while the write is retried
+                self.assertEqual(1, MerkleDatabase(database, root).get(
+                    _address('a')))
+
+                for _ in range(100):
+                    try:
+                        database.barrier()
+                        break
+                    except IOError:
+                        time.sleep(0.01)
+            self.assertEqual(1, MerkleDatabase(wrapped, root).get(
+                _address('a')))
+        finally:
+            database.close()
+
+
+class TestStateOverlay(unittest.TestCase):
+    def _update(self, overlay, state_root, updates):
+        layer = overlay.new_layer()
+        new_root = MerkleDatabase(layer, state_root).update(updates,
+                                                            virtual=False)
+        overlay.add_layer(state_root, new_root, layer)
+        return new_root
+
+    def test_flush(self):
+        """Tests that the states of the layers are readable before they are
+        written, and that a flush writes the nodes of a state which are not
+        in the database, and none of the intermediate states.
+        """
+        database = DictDatabase()
+        base = MerkleDatabase(database).update(
+            {_address(str(i)): i for i in range(20)}, virtual=False)
+        before = len(database)
+        overlay = StateOverlay(database)
+
+        roots = [base]
+        for i in range(5):
+            roots.append(self._update(overlay, roots[-1],
+                                      {_address('0'): 100 + i}))
+        self.assertEqual(before, len(database))
+        self.assertEqual(104, MerkleDatabase(overlay, roots[-1]).get(
+            _address('0')))
+        self.assertEqual(101, MerkleDatabase(overlay, roots[2]).get(
+            _address('0')))
+
+        written = overlay.flush(roots[-1])
+        self.assertEqual(before + written, len(database))
+        tree = MerkleDatabase(database, roots[-1])
+        self.assertEqual(104, tree.get(_address('0')))
+        self.assertEqual(19, tree.get(_address('19')))
+        with self.assertRaises(KeyError):
+            MerkleDatabase(database, roots[2])
+        self.assertEqual(0, overlay.metrics['layers'])
+        self.assertEqual(0, overlay.metrics['nodes'])
+
+        # a state already in the database has nothing to write
+        self.assertEqual(0, overlay.flush(base))
+        with self.assertRaises(KeyError):
+            overlay.flush(MerkleDatabase.hash(b'unknown'))
+
+    def test_abandoned_layers(self):
+        """Tests that the layers which are not flushed are dropped after a
+        few flushes, unless their state is in use.
+        """
+        database = DictDatabase()
+        base = MerkleDatabase(database).get_merkle_root()
+        overlay = StateOverlay(database, retained_flushes=1)
+        abandoned = self._update(overlay, base, {_address('a'): 1})
+        in_use = self._update(overlay, abandoned, {_address('b'): 2})
+        self.assertEqual({base}, overlay.base_roots())
+
+        for i in range(3):
+            committed = self._update(overlay, base, {_address('c'): i})
+            overlay.flush(committed, in_use_roots=[in_use])
+        self.assertEqual(2, MerkleDatabase(overlay, in_use).get(
+            _address('b')))
+        self.assertEqual(2, overlay.metrics['layers'])
+
+        overlay.flush(committed)
+        overlay.flush(committed)
+        self.assertEqual(0, overlay.metrics['layers'])
+        with self.assertRaises(KeyError):
+            MerkleDatabase(overlay, in_use)
+
+
+class TestMerkleDiff(unittest.TestCase):
+    def _expected_diff(self, old, new, prefix=''):
+        return sorted(
+            (address, old.get(address), new.get(address))
+            for address in set(old) | set(new)
+            if address.startswith(prefix) and
+            old.get(address) != new.get(address))
+
+    def test_diff(self):
+        """Tests that diff yields the added, modified and deleted addresses
+        in order, in both modes and across modes, and only reads the nodes
+        on the changed paths.
+        """
+        old = {_address(str(i)): i for i in range(100)}
+        new = dict(old)
+        new.update({_address(str(i)): -i for i in range(90, 110)})
+        for i in range(0, 10):
+            del new[_address(str(i))]
+        # an address above others, set in new only
+        new[_address('50')[:10]] = 'nested'
+
+        for compress_a, compress_b in [(False, False), (True, True),
+                                       (False, True)]:
+            database = DictDatabase()
+            tree_a = MerkleDatabase(database, compress_paths=compress_a)
+            root_a = tree_a.update(old, virtual=False)
+            tree_b = MerkleDatabase(database, compress_paths=compress_b)
+            root_b = tree_b.update(new, virtual=False)
+
+            self.assertEqual(self._expected_diff(old, new),
+                             list(tree_a.diff(root_a, root_b)))
+            self.assertEqual(self._expected_diff(new, old),
+                             list(tree_a.diff(root_b, root_a)))
+            self.assertEqual([], list(tree_a.diff(root_a, root_a)))
+
+            prefix = _address('95')[:3]
+            self.assertEqual(self._expected_diff(old, new, prefix),
+                             list(tree_a.diff(root_a, root_b, prefix)))
+
+        # a single change only walks the path to that address
+        cache = NodeCache()
+        tree = MerkleDatabase(database, root_b, node_cache=cache,
+                              compress_paths=True)
+        root_c = tree.update({_address('5'): 'changed'}, virtual=False)
+        tree.set_merkle_root(root_c)
+        cache.clear()
+        changes = tree.diff(root_b, root_c)
+        self.assertEqual((_address('5'), None, 'changed'), next(changes))
+        self.assertLess(len(cache), 20)
+
+
+class TestMerkleProof(unittest.TestCase):
+    def test_get_proof(self):
+        """Tests that the proofs of present and absent addresses verify
+        against the state root, in both modes and node formats, and that
+        proofs of other values, other roots or altered nodes do not.
+        """
+        values = {_address(str(i)): str(i).encode() for i in range(200)}
+        # an address above others
+        values[_address('7')[:10]] = b'nested'
+
+        for compress_paths in [False, True]:
+            for node_format in [CBOR_NODE_FORMAT, COMPACT_NODE_FORMAT]:
+                tree = MerkleDatabase(DictDatabase(), node_format=node_format,
+                                      compress_paths=compress_paths)
+                root = tree.update(values, virtual=False)
+                tree.set_merkle_root(root)
+
+                for address, value in values.items():
+                    proof = tree.get_proof(address)
+                    self.assertEqual((value, proof),
+                                     tree.get_value_and_proof(address))
+                    self.assertTrue(
+                        verify_proof(root, address, value, proof))
+                    self.assertFalse(
+                        verify_proof(root, address, b'other', proof))
+                    self.assertFalse(verify_proof(root, address, None, proof))
+
+                absent = _address('absent')
+                proof = tree.get_proof(absent)
+                self.assertEqual((None, proof),
+                                 tree.get_value_and_proof(absent))
+                self.assertTrue(verify_proof(root, absent, None, proof))
+                self.assertFalse(verify_proof(root, absent, b'0', proof))
+
+                address = _address('0')
+                proof = tree.get_proof(address)
+                self.assertFalse(verify_proof(
+                    _address('root'), address, b'0', proof))
+                self.assertFalse(verify_proof(
+                    root, address, b'0', proof[:-1]))
+                self.assertFalse(verify_proof(root, address, b'0', []))
+                tampered = bytearray(proof[-1])
+                tampered[-1] ^= 0x01
+                self.assertFalse(verify_proof(
+                    root, address, b'0', proof[:-1] + [bytes(tampered)]))
+
+    def test_get_proof_node_cache(self):
+        """Tests that proofs are served from the node cache.
+        """
+        database = DictDatabase()
+        tree = MerkleDatabase(database, node_cache=NodeCache(),
+                              compress_paths=True)
+        values = {_address(str(i)): str(i).encode() for i in range(50)}
+        root = tree.update(values, virtual=False)
+        tree.set_merkle_root(root)
+        address = _address('3')
+        proof = tree.get_proof(address)
+
+        with patch.object(database, 'get') as get:
+            self.assertEqual(proof, tree.get_proof(address))
+            get.assert_not_called()
+        self.assertTrue(verify_proof(root, address, b'3', proof))
+
+
+class TestMerkleIterLeaves(unittest.TestCase):
+    def test_iter_leaves(self):
+        """Tests that leaves are yielded lazily in address order from a start
+        address, in both modes, and that the subtrees before start are not
+        read.
+        """
+        updates = {_address(str(i)): i for i in range(200)}
+        updates[_address('7')[:10]] = 'nested'
+        addresses = sorted(updates)
+        start = addresses[150]
+
+        for compress_paths in (False, True):
+            tree = MerkleDatabase(DictDatabase(),
+                                  compress_paths=compress_paths)
+            tree.set_merkle_root(tree.update(updates, virtual=False))
+
+            self.assertEqual([(a, updates[a]) for a in addresses],
+                             list(tree.iter_leaves()))
+            self.assertEqual([(a, updates[a]) for a in addresses[150:]],
+                             list(tree.iter_leaves(start=start)))
+            # a start between addresses
+            self.assertEqual(addresses[151],
+                             next(tree.iter_leaves(start=start + '0'))[0])
+
+            prefix = addresses[0][:2]
+            self.assertEqual(
+                [a for a in addresses if a.startswith(prefix)],
+                [a for a, _ in tree.iter_leaves(prefix)])
+
+            cache = NodeCache()
+            cached_tree = MerkleDatabase(tree._database,
+                                         tree.get_merkle_root(),
+                                         node_cache=cache)
+            cache.clear()
+            next(cached_tree.iter_leaves(start=start))
+            self.assertLess(len(cache), 40)
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def _export(self):
+        database = DictDatabase()
+        tree = MerkleDatabase(database, compress_paths=True)
+        # repeated values make nodes shared by several parents
+        self.updates = {_address(str(i)): i % 7 for i in range(300)}
+        tree.set_merkle_root(tree.update(self.updates, virtual=False))
+        # an abandoned root, whose nodes must not be exported
+        tree.update({_address('abandoned'): 0}, virtual=False)
+
+        out_file = io.BytesIO()
+        count = export_snapshot(database, tree.get_merkle_root(), out_file,
+                                chunk_nodes=50)
+        self.assertLess(count, len(database))
+        return tree.get_merkle_root(), count, out_file.getvalue()
+
+    def test_round_trip(self):
+        """Tests that a snapshot imported into an LMDB database holds exactly
+        the nodes of the exported root.
+        """
+        state_root, count, data = self._export()
+
+        database = LMDBNoLockDatabase(
+            os.path.join(self._temp_dir, 'merkle.lmdb'), 'n')
+        self.assertEqual((state_root, count),
+                         import_snapshot(database, io.BytesIO(data),
+                                         batch_nodes=100))
+        self.assertEqual(count, len(database))
+
+        tree = MerkleDatabase(database, state_root)
+        self.assertEqual(self.updates, tree.leaves(''))
+        database.close()
+
+    def test_invalid_snapshots(self):
+        """Tests that corrupted, truncated and incomplete snapshots are
+        rejected.
+        """
+        _, _, data = self._export()
+
+        corrupted = bytearray(data)
+        corrupted[200] ^= 0xff
+        truncated = data[:len(data) // 2]
+        # drops the nodes of the first chunk, keeping the header
+        header = 8 + 32
+        node_count, length = int.from_bytes(data[header:header + 4], 'big'), \
+            int.from_bytes(data[header + 4:header + 8], 'big')
+        self.assertEqual(50, node_count)
+        incomplete = data[:header] + data[header + 8 + length + 32:]
+
+        for invalid in (bytes(corrupted), truncated, incomplete,
+                        b'not a snapshot'):
+            with self.assertRaises(SnapshotError):
+                import_snapshot(DictDatabase(), io.BytesIO(invalid))
+
+    def test_unreachable_node(self):
+        """Tests that a snapshot holding a node which is not reachable from
+        its state root is rejected.
+        """
+        state_root, _, data = self._export()
+        database = DictDatabase()
+        import_snapshot(database, io.BytesIO(data))
+
+        nodes = list(snapshot._iter_nodes_children_first(database,
+                                                         state_root))
+        junk = encode_node({'v': b'junk', 'c': {}})
+        nodes.insert(len(nodes) // 2, (MerkleDatabase.hash(junk), junk))
+        out_file = io.BytesIO()
+        out_file.write(snapshot.SNAPSHOT_MAGIC)
+        out_file.write(bytes.fromhex(state_root))
+        snapshot._write_chunk(out_file, [
+            part for key, packed in nodes
+            for part in (bytes.fromhex(key),
+                         len(packed).to_bytes(4, 'big'), packed)])
+        out_file.write(bytes(8))
+        out_file.write(len(nodes).to_bytes(8, 'big'))
+
+        with self.assertRaises(SnapshotError):
+            import_snapshot(DictDatabase(), io.BytesIO(out_file.getvalue()))
+
+    def test_expected_state_root(self):
+        """Tests that a snapshot of another state root is rejected before
+        any node is written.
+        """
+        _, _, data = self._export()
+        database = DictDatabase()
+        with self.assertRaises(SnapshotError):
+            import_snapshot(database, io.BytesIO(data),
+                            state_root=_address('other'))
+        self.assertEqual(0, len(database))